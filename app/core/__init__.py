@@ -1,7 +1,7 @@
 from .client import init_gateway_client, shutdown_gateway_client
 from .config import get_settings
 from .decorators import log_and_catch, route_handler
-from .dependencies import check_api_key, get_gateway_service
+from .dependencies import check_admin_key, check_api_key, get_admission_controller, get_gateway_service
 from .logger_setup import logger
 from .mapper import PAY_TYPE_MAPPER, ORGS_MAPPER
 
@@ -11,7 +11,9 @@ __all__ = [
     "init_gateway_client",
     "shutdown_gateway_client",
     "check_api_key",
+    "check_admin_key",
     "get_gateway_service",
+    "get_admission_controller",
     "route_handler",
     "log_and_catch",
     "PAY_TYPE_MAPPER",
@@ -0,0 +1,277 @@
+import asyncio
+import itertools
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set
+
+from fastapi import HTTPException, status
+
+from app.core.logger_setup import logger
+from app.core.metrics import REPORT_BUILDS_CANCELLED, REPORT_BUILDS_SHED
+
+
+def _report_label(key: Hashable) -> str:
+    """Ключи сборок - кортежи, первым элементом которых идет идентификатор отчета."""
+    return str(key[0]) if isinstance(key, tuple) and key else str(key)
+
+
+@dataclass
+class _Build:
+    task: asyncio.Task
+    waiters: int = 0
+
+
+@dataclass
+class _Ticket:
+    key: Hashable
+    future: asyncio.Future
+    cost: float = 0.0
+    heavy: bool = False
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class AdmissionController:
+    """
+    Ограничивает число одновременных сборок тяжелых отчетов в рамках воркера.
+
+    Не больше `max_concurrent` сборок выполняются одновременно, остальные ждут
+    в очереди длиной не больше `max_queue`. Если очередь заполнена, запрос сразу
+    получает 429 с заголовком Retry-After. Одинаковые запросы (по ключу), пришедшие
+    пока сборка еще идет, не занимают очередь и получают результат той же сборки.
+
+    Очередь упорядочена по оценке стоимости сборки (`cost`, секунды): дешевые интерактивные
+    сборки запускаются раньше дорогих. Каждая секунда ожидания снижает стоимость в очереди
+    на `aging`, поэтому дорогие сборки не ждут бесконечно. Сборки дороже `heavy_cost` занимают
+    не больше `heavy_share` слотов - остальные слоты (а с ними и запросы к шлюзу) остаются дешевым.
+
+    Если задан `shed`, перед запуском новой сборки он возвращает причины отказа
+    (например, медленный шлюз): при непустом списке запрос сразу получает 503 с Retry-After,
+    не дожидаясь, пока сборка упрется в таймаут на середине.
+    """
+
+    def __init__(
+            self,
+            max_concurrent: int,
+            max_queue: int,
+            retry_after: int,
+            disconnect_poll_interval: float = 1.0,
+            heavy_cost: Optional[float] = None,
+            heavy_share: float = 1.0,
+            aging: float = 1.0,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.disconnect_poll_interval = disconnect_poll_interval
+        self.heavy_cost = heavy_cost
+        self.max_heavy = max(1, math.floor(max_concurrent * heavy_share))
+        self.aging = aging
+        self._active: Dict[int, Hashable] = {}
+        self._heavy_active: Set[int] = set()
+        self._queue: List[_Ticket] = []
+        self._inflight: Dict[Hashable, _Build] = {}
+        self._slot_ids = itertools.count()
+        self._merged = 0
+        self._rejected = 0
+        self._shed = 0
+        self.shed: Optional[Callable[[], List[str]]] = None
+
+    @property
+    def active_count(self) -> int:
+        return len(self._active)
+
+    @property
+    def queue_length(self) -> int:
+        return len(self._queue)
+
+    def is_heavy(self, cost: float) -> bool:
+        return self.heavy_cost is not None and cost >= self.heavy_cost
+
+    def _priority(self, ticket: _Ticket, now: float) -> float:
+        return ticket.cost - (now - ticket.enqueued_at) * self.aging
+
+    def _ordered(self) -> List[_Ticket]:
+        """Очередь в порядке запуска без учета ограничения тяжелых сборок."""
+        now = time.monotonic()
+        return sorted(self._queue, key=lambda ticket: self._priority(ticket, now))
+
+    def position(self, key: Hashable) -> Optional[int]:
+        """Позиция сборки в очереди (1 - следующая), 0 - уже выполняется, None - не найдена."""
+        if key in self._active.values():
+            return 0
+        for index, ticket in enumerate(self._ordered(), start=1):
+            if ticket.key == key:
+                return index
+        return None
+
+    def ahead_of(self, cost: float) -> int:
+        """Сколько сборок из очереди запустится раньше новой сборки стоимостью `cost`."""
+        now = time.monotonic()
+        return sum(1 for ticket in self._queue if self._priority(ticket, now) <= cost)
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "max_heavy": self.max_heavy,
+            "active": [str(key) for key in self._active.values()],
+            "active_heavy": len(self._heavy_active),
+            "queued": [
+                {
+                    "key": str(ticket.key),
+                    "position": index,
+                    "cost": round(ticket.cost, 2),
+                    "heavy": ticket.heavy,
+                    "waiting_seconds": round(now - ticket.enqueued_at, 1),
+                }
+                for index, ticket in enumerate(self._ordered(), start=1)
+            ],
+            "merged_total": self._merged,
+            "rejected_total": self._rejected,
+            "shed_total": self._shed,
+        }
+
+    def _reject(self):
+        self._rejected += 1
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Сервер занят формированием других отчетов, очередь заполнена. Повторите запрос позже.",
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+    def check_shed(self, key: Hashable, cost: float = 0.0):
+        """
+        Отказывает (503) в запуске новой тяжелой сборки (см. is_heavy), если `shed` вернул причины.
+        Дешевые сборки проходят и при деградации - их очередность решает очередь по стоимости.
+        Сборки через `run` проверяются сами.
+        """
+        if not self.is_heavy(cost):
+            return
+        reasons = self.shed() if self.shed is not None else []
+        if not reasons:
+            return
+        self._shed += 1
+        for reason in reasons:
+            REPORT_BUILDS_SHED.labels(report=_report_label(key), reason=reason).inc()
+        logger.warning(f"[ADMISSION] Тяжелая сборка {key} (стоимость {cost:.1f} с) отклонена до начала: "
+                       f"{', '.join(reasons)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Сервис перегружен ({', '.join(reasons)}), сборка большого отчета отложена. "
+                   f"Повторите запрос позже или сократите период.",
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+    async def acquire(self, key: Hashable, cost: float = 0.0) -> Callable[[], None]:
+        """
+        Занимает слот сборки (при необходимости ожидая в очереди).
+        `cost` - оценка стоимости сборки в секундах, от нее зависит место в очереди.
+        Возвращает функцию освобождения слота, которую нужно вызвать ровно один раз.
+        """
+        ticket = _Ticket(key, asyncio.get_running_loop().create_future(), cost, self.is_heavy(cost))
+        self._queue.append(ticket)
+        self._wake_next()
+        if ticket.future.done():
+            return ticket.future.result()
+
+        if len(self._queue) > self.max_queue:
+            self._queue.remove(ticket)
+            self._reject()
+        logger.info(f"[ADMISSION] Сборка {key} (стоимость {cost:.1f} с) поставлена в очередь, "
+                    f"позиция {self.position(key)}")
+
+        try:
+            return await ticket.future
+        except asyncio.CancelledError:
+            if ticket in self._queue:
+                self._queue.remove(ticket)
+            elif ticket.future.done() and not ticket.future.cancelled():
+                # Слот успели выдать, но ожидающий уже ушел - возвращаем слот
+                ticket.future.result()()
+            raise
+
+    def _grant(self, ticket: _Ticket) -> Callable[[], None]:
+        slot_id = next(self._slot_ids)
+        self._active[slot_id] = ticket.key
+        if ticket.heavy:
+            self._heavy_active.add(slot_id)
+        released = False
+
+        def release():
+            nonlocal released
+            if released:
+                return
+            released = True
+            del self._active[slot_id]
+            self._heavy_active.discard(slot_id)
+            self._wake_next()
+
+        return release
+
+    def _wake_next(self):
+        while self._queue and len(self._active) < self.max_concurrent:
+            heavy_allowed = len(self._heavy_active) < self.max_heavy
+            ticket = next((t for t in self._ordered() if heavy_allowed or not t.heavy), None)
+            if ticket is None:
+                # В очереди только тяжелые сборки, а их доля слотов занята
+                return
+            self._queue.remove(ticket)
+            if not ticket.future.done():
+                ticket.future.set_result(self._grant(ticket))
+
+    async def _execute(self, key: Hashable, factory: Callable[[], Awaitable[Any]], cost: float) -> Any:
+        release = await self.acquire(key, cost)
+        try:
+            return await factory()
+        finally:
+            release()
+
+    async def run(
+            self,
+            key: Hashable,
+            factory: Callable[[], Awaitable[Any]],
+            is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+            cost: float = 0.0,
+    ) -> Any:
+        """
+        Выполняет сборку в слоте (`cost` - оценка стоимости, см. acquire). Если такая же сборка уже ждет или идет,
+        дожидается ее результата вместо запуска новой.
+
+        Если передан `is_disconnected`, пока сборка идет, периодически проверяется,
+        что клиент еще ждет ответа. Когда не остается ни одного ждущего клиента,
+        сборка отменяется.
+        """
+        build = self._inflight.get(key)
+        if build is None:
+            # Присоединение к идущей сборке ничего не стоит - отказ возможен только для новой
+            self.check_shed(key, cost)
+            build = _Build(asyncio.create_task(self._execute(key, factory, cost)))
+            self._inflight[key] = build
+            build.task.add_done_callback(lambda _: self._forget(key, build))
+        else:
+            self._merged += 1
+            logger.info(f"[ADMISSION] Запрос {key} присоединен к уже идущей сборке")
+
+        build.waiters += 1
+        try:
+            if is_disconnected is None:
+                return await asyncio.shield(build.task)
+
+            while True:
+                done, _ = await asyncio.wait({build.task}, timeout=self.disconnect_poll_interval)
+                if done:
+                    return build.task.result()
+                if await is_disconnected():
+                    raise HTTPException(status_code=499, detail="Клиент закрыл соединение")
+        finally:
+            build.waiters -= 1
+            if build.waiters == 0 and not build.task.done():
+                logger.info(f"[ADMISSION] Сборка {key} отменена: ее больше никто не ждет")
+                REPORT_BUILDS_CANCELLED.labels(report=_report_label(key)).inc()
+                build.task.cancel()
+
+    def _forget(self, key: Hashable, build: "_Build"):
+        if self._inflight.get(key) is build:
+            del self._inflight[key]
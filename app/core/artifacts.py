@@ -0,0 +1,168 @@
+import hashlib
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Hashable, List, Optional
+
+from app.core.cache import age_distribution
+from app.core.http_cache import content_etag
+from app.core.logger_setup import logger
+from app.core.metrics import ARTIFACT_STORE_BYTES, ARTIFACT_STORE_EVICTIONS
+
+# Незавершенные записи (например, после падения воркера) удаляются через это время, секунды
+_STALE_TMP_AGE = 3600
+_TMP_PREFIX = ".tmp-"
+
+
+@dataclass(frozen=True)
+class Artifact:
+    path: Path
+    etag: str
+    size: int
+    last_modified: datetime
+
+
+class ArtifactStore:
+    """
+    Готовые файлы отчетов на локальном диске.
+
+    Файл сначала пишется во временный файл в том же каталоге и появляется под своим
+    именем атомарным rename, поэтому воркеры, делящие каталог, никогда не видят его
+    недописанным. Общий размер ограничен `max_bytes`: при превышении удаляются файлы,
+    к которым дольше всего не обращались (время обращения - atime, его обновляет `get`).
+    Методы блокирующие - из event loop их нужно вызывать через asyncio.to_thread.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def _digest(key: Hashable) -> str:
+        return hashlib.sha256(repr(key).encode("utf-8")).hexdigest()[:40]
+
+    @staticmethod
+    def _artifact(path: Path, stat: os.stat_result) -> Artifact:
+        # Имя файла: <ключ>-<ETag><расширение>
+        etag = path.name.split("-", 1)[1].split(".", 1)[0]
+        return Artifact(path, f'"{etag}"', stat.st_size, datetime.fromtimestamp(stat.st_mtime))
+
+    def get(self, key: Hashable) -> Optional[Artifact]:
+        """Файл по ключу, если он есть. Отмечает обращение для вытеснения по LRU."""
+        for path in self.directory.glob(f"{self._digest(key)}-*"):
+            try:
+                stat = path.stat()
+                os.utime(path, (time.time(), stat.st_mtime))
+            except FileNotFoundError:
+                # Файл только что вытеснил другой воркер
+                continue
+            return self._artifact(path, stat)
+        return None
+
+    def put(
+            self,
+            key: Hashable,
+            content: bytes,
+            suffix: str,
+            modified: Optional[datetime] = None,
+            etag: Optional[str] = None,
+    ) -> Artifact:
+        """
+        Сохраняет файл под ключом. `modified` становится временем изменения файла
+        (Last-Modified ответа), по умолчанию - текущее время. `etag` - ETag файла,
+        по умолчанию - по содержимому.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        etag = etag or content_etag(content)
+        path = self.directory / f"{self._digest(key)}-{etag.strip(chr(34))}{suffix}"
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=_TMP_PREFIX)
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(content)
+            mtime = modified.timestamp() if modified is not None else time.time()
+            os.utime(tmp_path, (time.time(), mtime))
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+        self.evict(keep=path)
+        return self._artifact(path, path.stat())
+
+    def evict(self, keep: Optional[Path] = None) -> int:
+        """Удаляет давно не запрошенные файлы сверх квоты. Возвращает количество удаленных."""
+        files: List[tuple] = []
+        total = 0
+        now = time.time()
+        for path in self.directory.iterdir():
+            try:
+                stat = path.stat()
+                if path.name.startswith(_TMP_PREFIX):
+                    if now - stat.st_mtime > _STALE_TMP_AGE:
+                        path.unlink()
+                    continue
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_atime, stat.st_size, path))
+            total += stat.st_size
+
+        removed = 0
+        for _, size, path in sorted(files, key=lambda entry: entry[0]):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+
+        if removed:
+            ARTIFACT_STORE_EVICTIONS.inc(removed)
+            logger.info(f"Хранилище файлов {self.directory}: удалено {removed} файлов сверх квоты")
+        ARTIFACT_STORE_BYTES.set(total)
+        return removed
+
+    def _files(self) -> List[Path]:
+        if not self.directory.exists():
+            return []
+        return [path for path in self.directory.iterdir() if not path.name.startswith(_TMP_PREFIX)]
+
+    def clear(self) -> int:
+        """Удаляет все готовые файлы. Возвращает количество удаленных."""
+        removed = 0
+        for path in self._files():
+            try:
+                path.unlink()
+                removed += 1
+            except FileNotFoundError:
+                pass
+        ARTIFACT_STORE_BYTES.set(0)
+        return removed
+
+    def stats(self) -> dict:
+        now = time.time()
+        sizes, ages = [], []
+        for path in self._files():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            sizes.append(stat.st_size)
+            ages.append(now - stat.st_mtime)
+        return {
+            "kind": "disk",
+            "entries": len(sizes),
+            "bytes": sum(sizes),
+            "max_bytes": self.max_bytes,
+            "ages": age_distribution(ages),
+        }
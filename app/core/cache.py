@@ -0,0 +1,160 @@
+import asyncio
+import sys
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+# Все кеши процесса, по имени (для метрик и администрирования)
+CACHE_REGISTRY: Dict[str, "TTLCache"] = {}
+
+# Границы возрастных групп записей (секунды) и их подписи для сводки кеша
+AGE_BUCKETS: Tuple[Tuple[float, str], ...] = ((60, "<1m"), (300, "1-5m"), (900, "5-15m"), (3600, "15-60m"))
+AGE_BUCKET_OVERFLOW = ">60m"
+
+
+@dataclass(frozen=True)
+class CacheKeyInfo:
+    """Что описывает запись кеша: отчет и период (для инвалидации по отчету и датам)."""
+    report_id: str
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+
+
+def age_distribution(ages: List[float]) -> Dict[str, int]:
+    distribution = {label: 0 for _, label in AGE_BUCKETS}
+    distribution[AGE_BUCKET_OVERFLOW] = 0
+    for age in ages:
+        label = next((label for limit, label in AGE_BUCKETS if age < limit), AGE_BUCKET_OVERFLOW)
+        distribution[label] += 1
+    return distribution
+
+
+def deep_sizeof(value: Any, seen: Optional[set] = None) -> int:
+    """Приблизительный размер объекта в памяти вместе с вложенными контейнерами и моделями."""
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in value)
+    elif hasattr(value, "__dict__"):
+        size += deep_sizeof(vars(value), seen)
+    return size
+
+
+class TTLCache:
+    """
+    In-memory кеш с ограничением по времени жизни и количеству записей.
+    При переполнении вытесняется запись, к которой дольше всего не обращались.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            maxsize: int,
+            ttl: float,
+            describe: Optional[Callable[[Hashable], Optional[CacheKeyInfo]]] = None,
+    ):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # Разбор ключа записи (отчет и период) для инвалидации по отчету и датам
+        self.describe = describe
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        # Сколько вызовов get_or_create держат или ждут блокировку ключа
+        self._lock_users: Dict[Hashable, int] = {}
+        CACHE_REGISTRY[name] = self
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        entry = self._data.pop(key, None)
+        return entry[1] if entry else None
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    async def get_or_create(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Возвращает значение из кеша или вычисляет его.
+        Одновременные запросы одного ключа ждут единственного вычисления.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._lock_users[key] = self._lock_users.get(key, 0) + 1
+        try:
+            async with lock:
+                # Пока ждали блокировку, значение мог посчитать другой запрос
+                entry = self._data.get(key)
+                if entry is not None and time.monotonic() - entry[0] <= self.ttl:
+                    return entry[1]
+
+                value = await factory()
+                self.set(key, value)
+                return value
+        finally:
+            # Блокировка удаляется, только когда ее никто не ждет: иначе следующий вызов
+            # создал бы новую и запустил второе вычисление параллельно с ожидающими
+            self._lock_users[key] -= 1
+            if not self._lock_users[key]:
+                del self._lock_users[key]
+                del self._locks[key]
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Удаляет записи, ключи которых подходят под условие. Возвращает количество удаленных."""
+        keys = [key for key in self._data if predicate(key)]
+        for key in keys:
+            del self._data[key]
+        return len(keys)
+
+    def values(self) -> List[Any]:
+        """Снимок значений (в том числе устаревших, еще не удаленных)."""
+        return [value for _, value in self._data.values()]
+
+    def stats(self) -> dict:
+        """Размер, доля попаданий и возраст записей."""
+        now = time.monotonic()
+        ages = [now - created for created, _ in self._data.values() if now - created <= self.ttl]
+        requests = self.hits + self.misses
+        return {
+            "name": self.name,
+            "kind": "memory",
+            "entries": len(ages),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / requests, 4) if requests else None,
+            "ages": age_distribution(ages),
+        }
@@ -0,0 +1,213 @@
+import asyncio
+import os
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from datetime import date
+from fnmatch import fnmatchcase
+from typing import Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import orjson
+
+from app.core.cache import CACHE_REGISTRY, TTLCache, deep_sizeof
+from app.core.logger_setup import logger
+
+
+@dataclass(frozen=True)
+class InvalidationRule:
+    """
+    Что удалить из кешей. Все заданные условия должны выполняться одновременно:
+    `pattern` - glob по строковому виду ключа, `report_id` - отчет, `start_date`/`end_date` -
+    период записи пересекается с заданным. Без условий удаляется все.
+    `caches` ограничивает правило перечисленными кешами.
+    """
+    caches: Optional[Sequence[str]] = None
+    pattern: Optional[str] = None
+    report_id: Optional[str] = None
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    origin: int = field(default_factory=os.getpid)
+
+    @property
+    def is_total(self) -> bool:
+        return self.pattern is None and self.report_id is None and self.start_date is None and self.end_date is None
+
+    def applies_to(self, cache_name: str) -> bool:
+        return not self.caches or cache_name in self.caches
+
+    def matches(self, cache: TTLCache, key: Hashable) -> bool:
+        if self.pattern is not None and not fnmatchcase(str(key), self.pattern):
+            return False
+        if self.report_id is None and self.start_date is None and self.end_date is None:
+            return True
+
+        info = cache.describe(key) if cache.describe is not None else None
+        if info is None:
+            return False
+        if self.report_id is not None and info.report_id != self.report_id:
+            return False
+        # Периоды пересекаются; незаданная граница - без ограничения
+        if self.start_date is not None and info.end_date is not None and info.end_date < self.start_date:
+            return False
+        if self.end_date is not None and info.start_date is not None and info.start_date > self.end_date:
+            return False
+        return True
+
+    def to_json(self) -> bytes:
+        return orjson.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, raw: bytes) -> "InvalidationRule":
+        data = orjson.loads(raw)
+        for name in ("start_date", "end_date"):
+            if data.get(name):
+                data[name] = date.fromisoformat(data[name])
+        return cls(**data)
+
+
+@dataclass(frozen=True)
+class ExternalCache:
+    """Кеш вне CACHE_REGISTRY (файлы на диске, каталоги): сводка и применение правила инвалидации."""
+    stats: Callable[[], dict]
+    invalidate: Callable[[InvalidationRule], int]
+    # Кеши, правила для которых применяются и к этому (например, общая копия in-memory кеша)
+    covers: Tuple[str, ...] = ()
+
+
+EXTERNAL_CACHES: Dict[str, ExternalCache] = {}
+
+
+def register_external_cache(name: str, cache: ExternalCache):
+    EXTERNAL_CACHES[name] = cache
+
+
+def cache_names() -> List[str]:
+    return [*CACHE_REGISTRY, *EXTERNAL_CACHES]
+
+
+def _memory_bytes(values: List[object]) -> int:
+    seen: set = set()
+    return sum(deep_sizeof(value, seen) for value in values)
+
+
+async def cache_stats(with_memory: bool = False) -> List[dict]:
+    """
+    Сводка по всем кешам этого воркера. In-memory кеши читаются в event loop (их меняет только он),
+    обход записей для оценки памяти и сводки внешних кешей (диск) - в отдельном потоке.
+    """
+    caches = list(CACHE_REGISTRY.values())
+    stats = [cache.stats() for cache in caches]
+    if with_memory:
+        snapshots = [cache.values() for cache in caches]
+        sizes = await asyncio.to_thread(lambda: [_memory_bytes(values) for values in snapshots])
+        for cache_stat, size in zip(stats, sizes):
+            cache_stat["memory_bytes"] = size
+    for name, external in list(EXTERNAL_CACHES.items()):
+        stats.append({"name": name, **await asyncio.to_thread(external.stats)})
+    return stats
+
+
+def apply_rule(rule: InvalidationRule) -> Dict[str, int]:
+    """Применяет правило к кешам этого воркера. Возвращает количество удаленных записей по кешам."""
+    removed = {}
+    for name, cache in list(CACHE_REGISTRY.items()):
+        if rule.applies_to(name):
+            removed[name] = cache.invalidate(lambda key: rule.matches(cache, key))
+    for name, external in list(EXTERNAL_CACHES.items()):
+        if rule.applies_to(name) or any(rule.applies_to(covered) for covered in external.covers):
+            removed[name] = external.invalidate(rule)
+    return removed
+
+
+class InvalidationJournal:
+    """
+    Общий для воркеров журнал правил инвалидации (файл JSON Lines).
+
+    In-memory кеши у каждого воркера свои, а запрос администратора попадает в один из них.
+    Правило применяется в этом воркере сразу и дописывается в журнал; остальные воркеры
+    читают новые строки журнала раз в `poll_interval` секунд и применяют их у себя.
+    Новый воркер начинает с конца журнала - его кеши еще пусты.
+    """
+
+    def __init__(self, path: str, poll_interval: float):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._offset = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def append(self, rule: InvalidationRule):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Одна короткая запись в режиме O_APPEND не перемешивается с записями других воркеров
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, rule.to_json() + b"\n")
+        finally:
+            os.close(fd)
+
+    def read_new(self) -> List[InvalidationRule]:
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return []
+        if size < self._offset:
+            # Журнал очищен - читаем заново
+            self._offset = 0
+        if size == self._offset:
+            return []
+
+        with open(self.path, "rb") as journal:
+            journal.seek(self._offset)
+            data = journal.read(size - self._offset)
+        # Последняя строка может быть еще не дописана
+        complete = data[:data.rfind(b"\n") + 1]
+        self._offset += len(complete)
+
+        rules = []
+        for line in complete.splitlines():
+            try:
+                rules.append(InvalidationRule.from_json(line))
+            except (ValueError, TypeError) as e:
+                logger.warning(f"[CACHE] Пропущена некорректная запись журнала инвалидации: {e}")
+        return rules
+
+    def start(self):
+        try:
+            self._offset = os.path.getsize(self.path)
+        except FileNotFoundError:
+            self._offset = 0
+        self._task = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                rules = await asyncio.to_thread(self.read_new)
+            except OSError as e:
+                logger.warning(f"[CACHE] Не удалось прочитать журнал инвалидации: {e}")
+                continue
+            for rule in rules:
+                if rule.origin == os.getpid():
+                    continue
+                removed = apply_rule(rule)
+                logger.info(f"[CACHE] Применено правило инвалидации {rule.id} из журнала: {removed}")
+
+
+async def invalidate(rule: InvalidationRule, journal: Optional[InvalidationJournal]) -> Dict[str, int]:
+    """Применяет правило в этом воркере и передает его остальным через журнал."""
+    started = time.perf_counter()
+    removed = apply_rule(rule)
+    if journal is not None:
+        await asyncio.to_thread(journal.append, rule)
+    logger.info(f"[CACHE] Инвалидация {rule.id} за {time.perf_counter() - started:.3f} с: {removed}")
+    return removed
@@ -16,6 +16,115 @@ class Settings(BaseSettings):
     DEBUG_HTTP: bool
     LOGS_LEVEL: str
 
+    # Кеш обогащенных строк отчетов (для JSON API и повторных выгрузок)
+    DATASET_CACHE_TTL: int = 600
+    DATASET_CACHE_SIZE: int = 32
+    # Сколько секунд хранится неполный набор (сборка со сроком deadline): следующие страницы
+    # JSON API берутся из него, а не из новой сборки с другой версией
+    PARTIAL_DATASET_TTL: int = 120
+
+    # HTTP-кеширование выгрузок: сколько секунд клиент может не перепроверять отчет за прошедший период
+    # и разрешено ли кешировать ответы в общих кешах (прокси)
+    REPORT_PAST_MAX_AGE: int = 3600
+    REPORT_HTTP_CACHE_PUBLIC: bool = False
+    # Каталог ETag отданных отчетов за прошедший период и сколько секунд их помнить:
+    # условный запрос получает 304 без сборки, даже когда набора строк уже нет в кеше
+    REPORT_VALIDATOR_DIR: str = "http_cache"
+    REPORT_VALIDATOR_TTL: int = 7 * 24 * 3600
+
+    # Каталог готовых файлов отчетов (общий для воркеров) и квота на его размер, МБ
+    ARTIFACT_DIR: str = "artifacts"
+    ARTIFACT_MAX_MB: int = 512
+
+    # Одна сборка одинакового отчета на все воркеры: каталог аренд и общих наборов строк,
+    # срок аренды без продления (секунды), как часто ожидающие проверяют аренду, квота наборов
+    SINGLE_FLIGHT_ENABLED: bool = True
+    SINGLE_FLIGHT_DIR: str = "single_flight"
+    SINGLE_FLIGHT_LEASE_TTL: float = 30.0
+    SINGLE_FLIGHT_POLL: float = 0.5
+    SHARED_DATASET_MAX_MB: int = 256
+
+    # Журнал инвалидации кешей, общий для воркеров, и как часто воркеры его читают (секунды)
+    CACHE_JOURNAL_PATH: str = "cache_control/invalidations.jsonl"
+    CACHE_JOURNAL_POLL: float = 1.0
+
+    # Разбиение больших периодов на подпериоды для параллельной загрузки
+    REPORT_SHARD_DAYS: int = 7
+    REPORT_SHARD_CONCURRENCY: int = 4
+
+    # Отчет 32430: ЛПУ по умолчанию, пользователь ЕВМИАС, от имени которого строится отчет,
+    # и ограничения на выгрузку нескольких ЛПУ одним запросом
+    REPORT_32430_LPU_ID: str = "13102423"
+    REPORT_PMUSER_ID: str = "461432278617"
+    REPORT_MAX_LPUS: int = 20
+    REPORT_LPU_CONCURRENCY: int = 4
+
+    # Движок отчетов: сколько справочных запросов одной сборки идут одновременно
+    # и сколько исходных записей обогащаются параллельно (с сохранением порядка строк)
+    REPORT_LOOKUP_CONCURRENCY: int = 8
+    REPORT_LOOKUP_WINDOW: int = 32
+
+    # Каталог кодов услуг ИНВИТРО: период фонового обновления (0 - без фонового обновления,
+    # каталог загружается при первой сборке) и пауза перед повтором после неудачной загрузки, секунды
+    SERVICE_CATALOG_REFRESH: int = 6 * 3600
+    SERVICE_CATALOG_RETRY: int = 60
+
+    # ИНВИТРО: брать вид оплаты из списка заявок, если он там есть (запрос по направлению - только без него),
+    # и доля заявок (0..1), для которых вид оплаты все равно запрашивается и сверяется со списком
+    INVITRO_PAY_TYPE_FROM_LIST: bool = True
+    INVITRO_PAY_TYPE_VERIFY_RATE: float = 0.0
+
+    # Аналитическое хранилище (DuckDB) с фактами по услугам из полных наборов строк отчетов:
+    # включено ли, файл базы и сколько секунд ждать, пока файл занят другим воркером
+    ANALYTICS_ENABLED: bool = True
+    ANALYTICS_DB_PATH: str = "analytics/reports.duckdb"
+    ANALYTICS_LOCK_TIMEOUT: float = 10.0
+
+    # Снимки полных прогонов отчетов (отпечатки строк) для выгрузки только изменившихся строк:
+    # включены ли, каталог и сколько последних снимков хранить для каждого отчета и периода
+    SNAPSHOTS_ENABLED: bool = True
+    SNAPSHOT_DIR: str = "snapshots"
+    SNAPSHOT_KEEP: int = 14
+
+    # Размер страницы при массовом поиске госпитализаций за период
+    HOSP_SEARCH_PAGE_SIZE: int = 500
+
+    # Ограничение одновременных сборок отчетов в одном воркере
+    REPORT_MAX_CONCURRENT_BUILDS: int = 2
+    REPORT_MAX_QUEUE: int = 8
+    REPORT_RETRY_AFTER: int = 30
+    # Очередь по стоимости: сборки дороже REPORT_HEAVY_COST секунд (по оценке) считаются тяжелыми
+    # и занимают не больше REPORT_HEAVY_SHARE слотов; каждая секунда ожидания снижает стоимость
+    # в очереди на REPORT_PRIORITY_AGING секунд, чтобы тяжелые сборки не ждали бесконечно
+    REPORT_HEAVY_COST: float = 60.0
+    REPORT_HEAVY_SHARE: float = 0.5
+    REPORT_PRIORITY_AGING: float = 1.0
+    # Где хранить историю сборок для оценки стоимости (пусто - только в памяти воркера)
+    REPORT_COST_HISTORY_PATH: str = "build_costs/history.json"
+    # Как часто проверять, что клиент еще ждет отчет (секунды)
+    DISCONNECT_POLL_INTERVAL: float = 1.0
+
+    # Фоновый замер задержки шлюза: интервал (0 - отключен), размер скользящего окна, таймаут запроса
+    GATEWAY_PROBE_INTERVAL: float = 5.0
+    GATEWAY_PROBE_WINDOW: int = 60
+    GATEWAY_PROBE_TIMEOUT: float = 5.0
+    # Деградация: p95 задержки шлюза (секунды), доля ошибок, заполненность очереди сборок
+    READINESS_GATEWAY_P95: float = 2.0
+    READINESS_MAX_ERROR_RATE: float = 0.5
+    READINESS_QUEUE_RATIO: float = 0.75
+    # Отклонять новые тяжелые сборки (дороже REPORT_HEAVY_COST), пока сервис в деградированном состоянии
+    REPORT_SHED_WHEN_DEGRADED: bool = True
+
+    # Мониторинг задержки event loop
+    LOOP_LAG_INTERVAL: float = 0.5
+    LOOP_BLOCK_THRESHOLD: float = 1.0
+
+    # Ключ для служебных эндпоинтов (профилирование и т.п.); если не задан - они отключены
+    ADMIN_API_KEY: Optional[str] = None
+    # Интервал сэмплирования профайлера (секунды) и размер сводок
+    PROFILE_SAMPLE_INTERVAL: float = 0.005
+    PROFILE_TOP: int = 30
+
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8",
@@ -0,0 +1,101 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Пометка для значений, которые не успели получить до истечения срока сборки
+UNRESOLVED = "Не получено: истек срок формирования отчета"
+
+# Момент (time.monotonic), к которому сборка отчета должна быть завершена
+_deadline: ContextVar[Optional[float]] = ContextVar("report_deadline", default=None)
+# Неполученные за отведенное время данные текущей сборки
+_unresolved: ContextVar[Optional[List[Dict[str, str]]]] = ContextVar("report_unresolved", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Истек срок, отведенный на сборку отчета."""
+
+
+def remaining() -> Optional[float]:
+    """Сколько секунд осталось до срока текущей сборки (None - срок не задан)."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float], unresolved: List[Dict[str, str]]):
+    """
+    Задает срок сборки для всех запросов к шлюзу внутри блока
+    (в том числе в задачах, созданных внутри него) и список для неполученных данных.
+    """
+    deadline_token = _deadline.set(time.monotonic() + seconds if seconds else None)
+    unresolved_token = _unresolved.set(unresolved)
+    try:
+        yield
+    finally:
+        _deadline.reset(deadline_token)
+        _unresolved.reset(unresolved_token)
+
+
+def record_unresolved(lookup: str, key: Any):
+    collector = _unresolved.get()
+    if collector is not None:
+        collector.append({"lookup": lookup, "key": str(key)})
+
+
+async def within_deadline(awaitable: Awaitable[T]) -> T:
+    """Ожидает результат не дольше срока сборки, иначе выбрасывает DeadlineExceeded."""
+    left = remaining()
+    if left is None:
+        return await awaitable
+    if left <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise DeadlineExceeded()
+    try:
+        return await asyncio.wait_for(awaitable, left)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded()
+
+
+async def iter_within_deadline(
+        factory: Callable[[], AsyncIterator[T]],
+        seconds: Optional[float],
+        unresolved: List[Dict[str, str]],
+) -> AsyncIterator[T]:
+    """
+    Отдает элементы источника, собранного со сроком `seconds`.
+    Источник работает в отдельной задаче, чтобы срок действовал только на него.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=100)
+    done = object()
+
+    async def producer():
+        with deadline_scope(seconds, unresolved):
+            try:
+                async for item in factory():
+                    await queue.put(item)
+            except asyncio.CancelledError:
+                raise
+            except BaseException as e:
+                await queue.put(e)
+                return
+        await queue.put(done)
+
+    task = asyncio.create_task(producer())
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        if not task.done():
+            task.cancel()
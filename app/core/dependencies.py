@@ -5,9 +5,11 @@ from fastapi import Depends, HTTPException, Request, Security, status
 from fastapi.security import APIKeyHeader
 
 from app.core import get_settings
+from app.core.admission import AdmissionController
 from app.service.gateway.gateway import GatewayService
 
 API_KEY_HEADER_SCHEME = APIKeyHeader(name="X-API-KEY", auto_error=False)
+ADMIN_KEY_HEADER_SCHEME = APIKeyHeader(name="X-ADMIN-KEY", auto_error=False)
 settings = get_settings()
 
 
@@ -21,6 +23,10 @@ async def get_gateway_service(
     return GatewayService(client=client)
 
 
+async def get_admission_controller(request: Request) -> AdmissionController:
+    return request.app.state.admission
+
+
 async def check_api_key(api_key: Optional[str] = Security(API_KEY_HEADER_SCHEME)):
     if api_key and api_key == settings.GATEWAY_API_KEY:
         return api_key
@@ -33,3 +39,17 @@ async def check_api_key(api_key: Optional[str] = Security(API_KEY_HEADER_SCHEME)
             "remedy": "Please include a valid 'X-API-KEY' header in your request.",
         },
     )
+
+
+async def check_admin_key(admin_key: Optional[str] = Security(ADMIN_KEY_HEADER_SCHEME)):
+    if settings.ADMIN_API_KEY and admin_key and admin_key == settings.ADMIN_API_KEY:
+        return admin_key
+
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail={
+            "error": "Authentication Failed",
+            "message": "The provided X-ADMIN-KEY is missing or invalid.",
+            "remedy": "Please include a valid 'X-ADMIN-KEY' header in your request.",
+        },
+    )
@@ -0,0 +1,178 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from fastapi import Request
+
+from app.core.cache import CacheKeyInfo, age_distribution
+from app.core.config import get_settings
+
+settings = get_settings()
+
+
+def make_etag(*parts: Any) -> str:
+    """Сильный ETag по значимым параметрам ответа (отчет, период, формат, версия данных)."""
+    digest = hashlib.sha256("|".join(map(str, parts)).encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def content_etag(content: bytes) -> str:
+    """Сильный ETag по содержимому ответа."""
+    return f'"{hashlib.sha256(content).hexdigest()[:32]}"'
+
+
+def http_date(value: datetime) -> str:
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    # Для If-None-Match используется слабое сравнение: W/"x" совпадает с "x"
+    if header.strip() == "*":
+        return True
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in tags
+
+
+def is_not_modified(request: Request, etag: Optional[str], last_modified: Optional[datetime]) -> bool:
+    """Проверяет условные заголовки запроса. If-None-Match важнее If-Modified-Since."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag is not None and _etag_matches(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        # В HTTP-дате нет долей секунды
+        return last_modified.astimezone(timezone.utc).replace(microsecond=0) <= since
+
+    return False
+
+
+def cache_control(past_only: bool, partial: bool = False) -> str:
+    """
+    Политика кеширования ответа с отчетом.
+
+    Период целиком в прошлом - данные уже не меняются, ответ можно держать в кеше
+    REPORT_PAST_MAX_AGE секунд. Период с сегодняшним днем - кешировать можно,
+    но перед каждым использованием нужно перепроверить (ETag). Неполный отчет не кешируется.
+    """
+    if partial:
+        return "no-store"
+    scope = "public" if settings.REPORT_HTTP_CACHE_PUBLIC else "private"
+    if past_only:
+        return f"{scope}, max-age={settings.REPORT_PAST_MAX_AGE}"
+    return f"{scope}, no-cache"
+
+
+def validator_headers(
+        cache_policy: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[datetime] = None,
+) -> Dict[str, str]:
+    # Ответ зависит от ключа доступа - общий кеш не должен отдавать его с другим ключом
+    headers = {"Cache-Control": cache_policy, "Vary": "X-API-KEY"}
+    if etag is not None:
+        headers["ETag"] = etag
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+class ValidatorIndex:
+    """
+    Валидаторы (ETag и Last-Modified) отданных полных ответов по ключу ответа - на диске, общие для воркеров.
+
+    По ним условный запрос получает 304, даже если набора строк уже нет в кеше, - без новой сборки.
+    Запись действительна `ttl` секунд; `describe` разбирает ключ (отчет и период) для инвалидации.
+    Методы блокирующие - из event loop их нужно вызывать через asyncio.to_thread.
+    """
+
+    def __init__(self, directory: str, ttl: int, describe: Optional[Callable[[Hashable], Optional[CacheKeyInfo]]] = None):
+        self.directory = Path(directory)
+        self.ttl = ttl
+        self.describe = describe
+
+    def _path(self, key: Hashable) -> Path:
+        return self.directory / f"{hashlib.sha256(repr(key).encode('utf-8')).hexdigest()[:40]}.pickle"
+
+    @staticmethod
+    def _load(path: Path) -> Tuple[Hashable, str, datetime]:
+        with open(path, "rb") as entry:
+            return pickle.load(entry)
+
+    def get(self, key: Hashable) -> Optional[Tuple[str, datetime]]:
+        """ETag и Last-Modified ответа по ключу, если они еще действительны."""
+        path = self._path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.ttl:
+                return None
+            stored_key, etag, last_modified = self._load(path)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            return None
+        # Совпадение хеша имени файла у разных ключей не должно давать чужой ETag
+        return (etag, last_modified) if stored_key == key else None
+
+    def put(self, key: Hashable, etag: str, last_modified: datetime):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as entry:
+                pickle.dump((key, etag, last_modified), entry, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def _entries(self) -> List[Path]:
+        if not self.directory.exists():
+            return []
+        return list(self.directory.glob("*.pickle"))
+
+    def invalidate(self, matches: Callable[[Hashable], bool]) -> int:
+        """Удаляет записи, ключи которых подходят под условие, и просроченные. Возвращает количество удаленных."""
+        removed = 0
+        now = time.time()
+        for path in self._entries():
+            try:
+                expired = now - path.stat().st_mtime > self.ttl
+                if not expired and not matches(self._load(path)[0]):
+                    continue
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+                path.unlink(missing_ok=True)
+            removed += 1
+        return removed
+
+    def stats(self) -> dict:
+        now = time.time()
+        sizes, ages = [], []
+        for path in self._entries():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            sizes.append(stat.st_size)
+            ages.append(now - stat.st_mtime)
+        return {
+            "kind": "disk",
+            "entries": len(sizes),
+            "bytes": sum(sizes),
+            "ttl": self.ttl,
+            "ages": age_distribution(ages),
+        }
@@ -0,0 +1,152 @@
+import asyncio
+import fcntl
+import hashlib
+import os
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Hashable, Optional, TypeVar
+
+from app.core.logger_setup import logger
+from app.core.metrics import SINGLE_FLIGHT
+
+T = TypeVar("T")
+
+
+class Lease:
+    """Право одного процесса выполнять работу по ключу. Пока аренда жива, ее файл регулярно обновляется."""
+
+    def __init__(self, path: Path, fd: int):
+        self.path = path
+        self._fd = fd
+
+    def renew(self):
+        os.utime(self._fd)
+
+    def release(self):
+        # Файл удаляется, пока блокировка еще удерживается: ожидающие, открывшие
+        # старый файл, заметят подмену (см. LeaseStore.try_acquire) и откроют новый
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+        os.close(self._fd)
+
+
+def _release_orphan(acquiring: "asyncio.Future[Optional[Lease]]"):
+    """Освобождает аренду, взятую уже после отмены ожидавшего ее."""
+    if acquiring.cancelled() or acquiring.exception() is not None:
+        return
+    lease = acquiring.result()
+    if lease is not None:
+        lease.release()
+
+
+class LeaseStore:
+    """
+    Аренды на локальном диске для координации воркеров одной машины (без внешних сервисов).
+
+    Аренда - эксклюзивная flock-блокировка файла `<directory>/<ключ>.lease`. Упавший
+    процесс теряет блокировку автоматически, поэтому ожидающие сразу ее перехватывают.
+    Живой, но зависший владелец перестает обновлять время изменения файла: если оно старше
+    `ttl` секунд, аренда считается истекшей и ожидающий выполняет работу сам.
+    """
+
+    def __init__(self, directory: str, ttl: float, poll_interval: float):
+        self.directory = Path(directory)
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+
+    def _path(self, key: Hashable) -> Path:
+        return self.directory / f"{hashlib.sha256(repr(key).encode('utf-8')).hexdigest()[:40]}.lease"
+
+    def try_acquire(self, key: Hashable) -> Optional[Lease]:
+        """Берет аренду, если она свободна; не ждет."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return None
+            try:
+                current = os.stat(path)
+            except FileNotFoundError:
+                current = None
+            if current is not None and current.st_ino == os.fstat(fd).st_ino:
+                os.utime(fd)
+                return Lease(path, fd)
+            # Пока открывали, прежний владелец удалил файл - блокировка взята на устаревшем файле
+            os.close(fd)
+
+    async def try_acquire_async(self, key: Hashable) -> Optional[Lease]:
+        """
+        try_acquire из event loop. Если ожидающего отменили, пока поток брал блокировку,
+        взятая аренда освобождается, а не теряется с открытым файлом до конца процесса.
+        """
+        acquiring = asyncio.ensure_future(asyncio.to_thread(self.try_acquire, key))
+        try:
+            return await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            acquiring.add_done_callback(_release_orphan)
+            raise
+
+    def is_expired(self, key: Hashable) -> bool:
+        """Занятая аренда давно не обновлялась - владелец завис."""
+        try:
+            return time.time() - self._path(key).stat().st_mtime > self.ttl
+        except FileNotFoundError:
+            return False
+
+    async def _keep_alive(self, lease: Lease):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            await asyncio.to_thread(lease.renew)
+
+    @asynccontextmanager
+    async def hold(self, lease: Lease) -> AsyncIterator[Lease]:
+        """Продлевает аренду, пока выполняется блок, и освобождает ее по выходе."""
+        keep_alive = asyncio.create_task(self._keep_alive(lease))
+        try:
+            yield lease
+        finally:
+            keep_alive.cancel()
+            await asyncio.to_thread(lease.release)
+
+    async def run(
+            self,
+            key: Hashable,
+            load: Callable[[], Awaitable[Optional[T]]],
+            build: Callable[[], Awaitable[T]],
+    ) -> T:
+        """
+        Выполняет `build` не больше чем в одном процессе одновременно.
+
+        Процесс, взявший аренду, сначала проверяет `load` (результат мог только что оставить
+        предыдущий владелец) и только затем строит. Остальные ждут освобождения аренды
+        и получают результат через `load`. Если аренда истекла, ожидающий строит сам.
+        """
+        waited = False
+        while True:
+            lease = await self.try_acquire_async(key)
+            if lease is not None:
+                break
+            if self.is_expired(key):
+                SINGLE_FLIGHT.labels(result="expired").inc()
+                logger.warning(f"[LEASE] Аренда {key} истекла: владелец не отвечает дольше {self.ttl} с, "
+                               f"выполняем работу без нее")
+                return await build()
+            if not waited:
+                waited = True
+                logger.info(f"[LEASE] {key} уже выполняется другим воркером, ожидаем результат")
+            await asyncio.sleep(self.poll_interval)
+
+        async with self.hold(lease):
+            result = await load()
+            if result is not None:
+                SINGLE_FLIGHT.labels(result="reused").inc()
+                return result
+            SINGLE_FLIGHT.labels(result="leader").inc()
+            return await build()
@@ -0,0 +1,76 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from app.core.logger_setup import logger
+from app.core.metrics import EVENT_LOOP_BLOCKS, EVENT_LOOP_LAG
+
+
+class LoopLagMonitor:
+    """
+    Измеряет задержку event loop и ищет блокирующие вызовы.
+
+    Корутина-пробник периодически засыпает на `interval` и пишет в гистограмму,
+    насколько позже ожидаемого она проснулась. Сторожевой поток следит за
+    пульсом пробника: если loop не отвечает дольше `block_threshold`,
+    в лог пишется стек потока loop - это и есть блокирующий вызов.
+    """
+
+    def __init__(self, interval: float, block_threshold: float):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._probe())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(
+            f"Мониторинг event loop запущен: интервал {self.interval}s, порог блокировки {self.block_threshold}s"
+        )
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._watchdog:
+            self._watchdog.join(timeout=self.interval + self.block_threshold)
+
+    async def _probe(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - started - self.interval
+            EVENT_LOOP_LAG.observe(max(lag, 0.0))
+            self._heartbeat = time.monotonic()
+
+    def _watch(self):
+        reported_heartbeat = None
+        while not self._stop.wait(self.block_threshold / 2):
+            heartbeat = self._heartbeat
+            stalled_for = time.monotonic() - heartbeat - self.interval
+            # Сообщаем о каждой блокировке один раз
+            if stalled_for < self.block_threshold or heartbeat == reported_heartbeat:
+                continue
+
+            reported_heartbeat = heartbeat
+            EVENT_LOOP_BLOCKS.inc()
+            frame = sys._current_frames().get(self._loop_thread_id)  # noqa
+            stack = "".join(traceback.format_stack(frame)) if frame else "стек недоступен"
+            logger.warning(
+                f"[LOOP] Event loop заблокирован более {stalled_for:.2f}s. Стек блокирующего вызова:\n{stack}"
+            )
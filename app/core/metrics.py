@@ -0,0 +1,125 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Метрики приложения. Экспортируются вместе с метриками Instrumentator на /metrics
+
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "Задержка срабатывания таймера event loop относительно ожидаемого времени",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+EVENT_LOOP_BLOCKS = Counter(
+    "event_loop_blocks_total",
+    "Количество блокировок event loop дольше порога",
+)
+
+REPORT_BUILDS_CANCELLED = Counter(
+    "report_builds_cancelled_total",
+    "Сборки отчетов, прерванные из-за отключения клиента",
+    ["report"],
+)
+
+REPORT_LOOKUPS = Counter(
+    "report_lookups_total",
+    "Справочные запросы при сборке отчетов: fetched - запрос к шлюзу, cached - повтор в рамках сборки, "
+    "prefetched - найдено в массовой загрузке, unresolved - истек срок, error - ошибка",
+    ["report", "lookup", "result"],
+)
+
+REPORT_LOOKUP_SECONDS = Histogram(
+    "report_lookup_seconds",
+    "Длительность справочных запросов к шлюзу при сборке отчетов",
+    ["report", "lookup"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+REPORT_PROJECTION_CHECKS = Counter(
+    "report_projection_checks_total",
+    "Сверки значения из списка исходных записей со справочным запросом: match - совпало, mismatch - нет",
+    ["report", "field", "result"],
+)
+
+ARTIFACT_STORE_BYTES = Gauge(
+    "artifact_store_bytes",
+    "Общий размер готовых файлов отчетов на диске",
+)
+
+ARTIFACT_STORE_EVICTIONS = Counter(
+    "artifact_store_evictions_total",
+    "Готовые файлы отчетов, удаленные сверх квоты хранилища",
+)
+
+ANALYTICS_INGESTED_ROWS = Counter(
+    "analytics_ingested_rows_total",
+    "Факты по услугам, сохраненные в аналитическое хранилище",
+    ["report"],
+)
+
+REPORT_ROWS = Counter(
+    "report_rows_total",
+    "Строки, собранные движком отчетов",
+    ["report"],
+)
+
+SERVICE_CATALOG_LOADS = Counter(
+    "service_catalog_loads_total",
+    "Загрузки каталога кодов услуг из ЕВМИАС",
+    ["result"],
+)
+
+SERVICE_CATALOG_ENTRIES = Gauge(
+    "service_catalog_entries",
+    "Количество услуг в текущем снимке каталога",
+)
+
+WORKER_STARTUP_SECONDS = Gauge(
+    "worker_startup_seconds",
+    "Время запуска воркера: от fork (или запуска процесса) до готовности приложения",
+)
+
+WORKER_MEMORY = Gauge(
+    "worker_memory_bytes",
+    "Память воркера: rss, pss, shared (общие страницы, в том числе от мастера при предзагрузке), private",
+    ["kind"],
+)
+
+GATEWAY_PROBES = Counter(
+    "gateway_probes_total",
+    "Фоновые пробные запросы к шлюзу: ok, error - ошибка или превышение таймаута",
+    ["result"],
+)
+
+GATEWAY_PROBE_SECONDS = Histogram(
+    "gateway_probe_seconds",
+    "Длительность фоновых пробных запросов к шлюзу",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+GATEWAY_LATENCY = Gauge(
+    "gateway_latency_seconds",
+    "Скользящие перцентили задержки шлюза по последним пробным запросам",
+    ["quantile"],
+)
+
+GATEWAY_ERROR_RATE = Gauge(
+    "gateway_error_rate",
+    "Доля неудачных пробных запросов к шлюзу в скользящем окне",
+)
+
+SERVICE_DEGRADED = Gauge(
+    "service_degraded",
+    "1 - сервис в деградированном состоянии (медленный шлюз или заполненная очередь сборок)",
+)
+
+REPORT_BUILDS_SHED = Counter(
+    "report_builds_shed_total",
+    "Сборки отчетов, отклоненные до начала из-за деградации: gateway_slow, gateway_errors, queue_saturated",
+    ["report", "reason"],
+)
+
+SINGLE_FLIGHT = Counter(
+    "report_single_flight_total",
+    "Координация одинаковых сборок между воркерами: leader - сборка выполнена здесь, "
+    "reused - взят результат другого воркера, expired - аренда зависшего воркера истекла",
+    ["result"],
+)
@@ -0,0 +1,176 @@
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+# Файлы, на которых простаивают потоки: пул - в ожидании задачи, event loop - в ожидании
+# ввода-вывода (selectors). Такие сэмплы не учитываются, иначе в I/O-сборке горячими будут select/epoll
+_IDLE_FILES = ("threading.py", "queue.py", "selectors.py")
+
+
+@dataclass
+class _CallStat:
+    calls: int = 0
+    errors: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+
+class GatewayCallStats:
+    """Сводка запросов к шлюзу за один прогон: количество, ошибки и время по каждому методу."""
+
+    def __init__(self):
+        self._stats: Dict[str, _CallStat] = {}
+
+    def record(self, name: str, seconds: float, ok: bool):
+        stat = self._stats.setdefault(name, _CallStat())
+        stat.calls += 1
+        stat.errors += 0 if ok else 1
+        stat.total += seconds
+        stat.max = max(stat.max, seconds)
+
+    def count(self, predicate: Callable[[str], bool] = lambda name: True) -> int:
+        """Количество запросов к методам, подходящим под условие."""
+        return sum(stat.calls for name, stat in self._stats.items() if predicate(name))
+
+    def summary(self) -> dict:
+        calls = [
+            {
+                "method": name,
+                "calls": stat.calls,
+                "errors": stat.errors,
+                "total_seconds": round(stat.total, 3),
+                "avg_seconds": round(stat.total / stat.calls, 3),
+                "max_seconds": round(stat.max, 3),
+            }
+            for name, stat in sorted(self._stats.items(), key=lambda item: item[1].total, reverse=True)
+        ]
+        return {
+            "total_calls": sum(stat.calls for stat in self._stats.values()),
+            "total_seconds": round(sum(stat.total for stat in self._stats.values()), 3),
+            "by_method": calls,
+        }
+
+
+_gateway_calls: ContextVar[Optional[GatewayCallStats]] = ContextVar("gateway_call_stats", default=None)
+
+
+@contextmanager
+def gateway_call_scope(stats: GatewayCallStats):
+    """Все запросы к шлюзу внутри блока (и в задачах, созданных в нем) попадают в stats."""
+    token = _gateway_calls.set(stats)
+    try:
+        yield stats
+    finally:
+        _gateway_calls.reset(token)
+
+
+def record_gateway_call(name: str, seconds: float, ok: bool):
+    stats = _gateway_calls.get()
+    if stats is not None:
+        stats.record(name, seconds, ok)
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Сэмплирующий профайлер: фоновый поток раз в `interval` секунд снимает стеки
+    потоков процесса и считает, в каких функциях они находятся.
+
+    Профилируется весь воркер, поэтому в сводку попадут и параллельные запросы.
+    Стоимость - один проход по стекам за сэмпл, выполнение кода не трассируется.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = 0
+        self._self_counts: Counter = Counter()
+        self._total_counts: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():  # noqa
+                if thread_id != own_id:
+                    self._sample(frame)
+            self.samples += 1
+
+    def _sample(self, frame):
+        if frame.f_code.co_filename.endswith(_IDLE_FILES):
+            return
+        self._self_counts[_frame_label(frame.f_code)] += 1
+        # Рекурсивные вызовы считаются в total один раз на сэмпл
+        seen = set()
+        while frame is not None:
+            label = _frame_label(frame.f_code)
+            if label not in seen:
+                seen.add(label)
+                self._total_counts[label] += 1
+            frame = frame.f_back
+
+    def summary(self, top: int) -> List[dict]:
+        """Самые горячие функции: по собственному времени и по времени вместе с вызванными."""
+        samples = max(self.samples, 1)
+        return [
+            {
+                "function": label,
+                "self_samples": count,
+                "self_percent": round(100 * count / samples, 1),
+                "total_samples": self._total_counts[label],
+                "total_percent": round(100 * self._total_counts[label] / samples, 1),
+            }
+            for label, count in self._self_counts.most_common(top)
+        ]
+
+
+@contextmanager
+def trace_allocations():
+    """Включает tracemalloc на время блока (если он не был включен заранее)."""
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        yield
+    finally:
+        if started:
+            tracemalloc.stop()
+
+
+def allocation_summary(top: int) -> dict:
+    """Текущая и пиковая память под tracemalloc и строки кода, выделившие больше всего."""
+    current, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    return {
+        "current_mb": round(current / 1024 / 1024, 2),
+        "peak_mb": round(peak / 1024 / 1024, 2),
+        "top_allocators": [
+            {
+                "location": str(stat.traceback),
+                "size_kb": round(stat.size / 1024, 1),
+                "count": stat.count,
+            }
+            for stat in snapshot.statistics("lineno")[:top]
+        ],
+    }
@@ -0,0 +1,160 @@
+import asyncio
+import math
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from app.core.admission import AdmissionController
+from app.core.logger_setup import logger
+from app.core.metrics import (GATEWAY_ERROR_RATE, GATEWAY_LATENCY, GATEWAY_PROBE_SECONDS, GATEWAY_PROBES,
+                              SERVICE_DEGRADED)
+
+QUANTILES: Tuple[float, ...] = (0.5, 0.95, 0.99)
+
+
+def percentile(values: List[float], quantile: float) -> Optional[float]:
+    """Перцентиль по методу ближайшего ранга; None для пустого списка."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(quantile * len(ordered)) - 1, 0)]
+
+
+class GatewayProbe:
+    """
+    Фоновый замер задержки и доли ошибок шлюза.
+
+    Раз в `interval` секунд выполняет легкий запрос `probe` (без повторов, с таймаутом `timeout`)
+    и хранит результаты последних `window` запросов. По ним считаются скользящие перцентили
+    задержки успешных запросов и доля ошибок - так состояние шлюза известно до того,
+    как тяжелая сборка отчета упрется в медленный шлюз.
+    """
+
+    def __init__(
+            self,
+            probe: Callable[[float], Awaitable[float]],
+            interval: float,
+            window: int,
+            timeout: float,
+    ):
+        self.probe = probe
+        self.interval = interval
+        self.timeout = timeout
+        # (длительность, успех)
+        self._samples: Deque[Tuple[float, bool]] = deque(maxlen=window)
+        self._last_error: Optional[str] = None
+        self._last_probe_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.interval <= 0:
+            logger.info("Фоновый замер задержки шлюза отключен")
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            await self.measure()
+            await asyncio.sleep(self.interval)
+
+    async def measure(self):
+        started = time.perf_counter()
+        try:
+            latency = await asyncio.wait_for(self.probe(self.timeout), self.timeout)
+            self._samples.append((latency, True))
+            self._last_error = None
+            GATEWAY_PROBES.labels(result="ok").inc()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            latency = time.perf_counter() - started
+            self._samples.append((latency, False))
+            self._last_error = f"{type(e).__name__}: {e}"
+            GATEWAY_PROBES.labels(result="error").inc()
+        self._last_probe_at = time.time()
+        GATEWAY_PROBE_SECONDS.observe(latency)
+
+        latencies = self.latencies()
+        for quantile, value in latencies.items():
+            if value is not None:
+                GATEWAY_LATENCY.labels(quantile=str(quantile)).set(value)
+        GATEWAY_ERROR_RATE.set(self.error_rate() or 0.0)
+
+    def latencies(self) -> Dict[float, Optional[float]]:
+        succeeded = [latency for latency, ok in self._samples if ok]
+        return {quantile: percentile(succeeded, quantile) for quantile in QUANTILES}
+
+    def error_rate(self) -> Optional[float]:
+        if not self._samples:
+            return None
+        return sum(1 for _, ok in self._samples if not ok) / len(self._samples)
+
+    def snapshot(self) -> dict:
+        return {
+            "samples": len(self._samples),
+            "latency": {f"p{round(quantile * 100)}": value for quantile, value in self.latencies().items()},
+            "error_rate": self.error_rate(),
+            "last_error": self._last_error,
+            "last_probe_at": self._last_probe_at,
+        }
+
+
+@dataclass
+class Readiness:
+    """
+    Оценка готовности воркера принимать тяжелые сборки.
+
+    Шлюз считается медленным, если p95 задержки пробных запросов выше `slow_p95`,
+    ненадежным - если доля ошибок выше `max_error_rate`. Очередь сборок насыщена,
+    когда в ней не меньше `queue_ratio` от допустимой длины.
+    """
+    probe: GatewayProbe
+    admission: AdmissionController
+    slow_p95: float
+    max_error_rate: float
+    queue_ratio: float
+    _degraded: bool = field(default=False, init=False)
+
+    def reasons(self) -> List[str]:
+        reasons = []
+        p95 = self.probe.latencies()[0.95]
+        if p95 is not None and p95 > self.slow_p95:
+            reasons.append("gateway_slow")
+        error_rate = self.probe.error_rate()
+        if error_rate is not None and error_rate > self.max_error_rate:
+            reasons.append("gateway_errors")
+        if self.admission.queue_length >= max(self.admission.max_queue * self.queue_ratio, 1):
+            reasons.append("queue_saturated")
+
+        degraded = bool(reasons)
+        SERVICE_DEGRADED.set(int(degraded))
+        if degraded != self._degraded:
+            self._degraded = degraded
+            if degraded:
+                logger.warning(f"[READINESS] Сервис деградировал: {', '.join(reasons)}")
+            else:
+                logger.info("[READINESS] Сервис восстановился")
+        return reasons
+
+    def report(self) -> dict:
+        reasons = self.reasons()
+        return {
+            "status": "degraded" if reasons else "ok",
+            "reasons": reasons,
+            "gateway": self.probe.snapshot(),
+            "queue": {
+                "active": self.admission.active_count,
+                "queued": self.admission.queue_length,
+                "max_concurrent": self.admission.max_concurrent,
+                "max_queue": self.admission.max_queue,
+            },
+        }
@@ -0,0 +1,100 @@
+import os
+import resource
+import time
+from typing import Dict, Optional
+
+from app.core.logger_setup import logger
+from app.core.metrics import WORKER_MEMORY, WORKER_STARTUP_SECONDS
+
+# Переменная окружения, в которую gunicorn (post_fork) записывает время запуска воркера
+WORKER_STARTED_ENV = "WORKER_STARTED_AT"
+# Переменная окружения, которую мастер выставляет после предзагрузки общего состояния
+PRELOADED_ENV = "APP_PRELOADED"
+
+# Поля smaps_rollup, из которых складываются общая (copy-on-write с мастером) и собственная память процесса
+_SMAPS_FIELDS = {
+    "Rss": "rss",
+    "Pss": "pss",
+    "Shared_Clean": "shared",
+    "Shared_Dirty": "shared",
+    "Private_Clean": "private",
+    "Private_Dirty": "private",
+}
+
+# Время запуска этого воркера, секунды (заполняется в record_worker_ready)
+_startup_seconds: Optional[float] = None
+
+
+def memory_usage() -> Dict[str, int]:
+    """
+    Память текущего процесса в байтах: rss, pss, shared (общие с другими процессами страницы,
+    в том числе унаследованные от мастера) и private. Без /proc - только пиковый rss.
+    """
+    usage: Dict[str, int] = {}
+    try:
+        with open("/proc/self/smaps_rollup") as smaps:
+            for line in smaps:
+                name, _, value = line.partition(":")
+                kind = _SMAPS_FIELDS.get(name)
+                if kind is not None:
+                    usage[kind] = usage.get(kind, 0) + int(value.split()[0]) * 1024
+    except OSError:
+        usage["rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return usage
+
+
+def _process_started_at() -> Optional[float]:
+    """Время запуска процесса по /proc (как process_start_time_seconds у prometheus_client)."""
+    try:
+        with open("/proc/self/stat") as stat:
+            # Имя процесса в скобках может содержать пробелы - считаем поля после него
+            start_ticks = float(stat.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/stat") as proc_stat:
+            boot_time = next(float(line.split()[1]) for line in proc_stat if line.startswith("btime"))
+    except (OSError, IndexError, StopIteration, ValueError):
+        return None
+    return boot_time + start_ticks / os.sysconf("SC_CLK_TCK")
+
+
+def startup_seconds() -> Optional[float]:
+    """
+    Сколько воркер запускался: от fork (gunicorn) или от запуска процесса (uvicorn) до текущего момента.
+    При предзагрузке импорт приложения выполнен в мастере и в это время не входит.
+    """
+    started_at = os.environ.get(WORKER_STARTED_ENV)
+    started = float(started_at) if started_at else _process_started_at()
+    if started is None:
+        return None
+    return time.time() - started
+
+
+def _mib(value: Optional[int]) -> str:
+    return f"{value / 2 ** 20:.1f} МБ" if value is not None else "-"
+
+
+def record_worker_ready():
+    """Фиксирует время запуска и память воркера после старта приложения: метрики и строка в лог."""
+    global _startup_seconds
+    seconds = _startup_seconds = startup_seconds()
+    if seconds is not None:
+        WORKER_STARTUP_SECONDS.set(seconds)
+    # Память отдается по текущему состоянию при каждом опросе /metrics
+    for kind in ("rss", "pss", "shared", "private"):
+        WORKER_MEMORY.labels(kind=kind).set_function(lambda kind=kind: memory_usage().get(kind, 0))
+
+    usage = memory_usage()
+    startup = f"{seconds:.2f} с" if seconds is not None else "-"
+    logger.info(
+        f"Воркер {os.getpid()} запущен за {startup}: rss {_mib(usage.get('rss'))}, "
+        f"shared {_mib(usage.get('shared'))}, private {_mib(usage.get('private'))}"
+    )
+
+
+def runtime_info() -> Dict[str, object]:
+    """Время запуска и текущая память воркера, обслужившего запрос."""
+    return {
+        "pid": os.getpid(),
+        "preloaded": os.environ.get(PRELOADED_ENV) == "1",
+        "startup_seconds": round(_startup_seconds, 3) if _startup_seconds is not None else None,
+        "memory": memory_usage(),
+    }
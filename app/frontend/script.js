@@ -1,4 +1,4 @@
-const { createApp, ref, reactive } = Vue;
+const { createApp, ref, reactive, watch } = Vue;
 
 createApp({
     setup() {
@@ -26,6 +26,44 @@ createApp({
         // Список активных загрузок
         const downloads = ref([]);
 
+        // Оценка сборки выбранного отчета за период (до отправки запроса)
+        const estimate = ref(null);
+        let estimateRequest = 0;
+
+        const formatDate = (d) => d.split('-').reverse().join('.');
+
+        const loadEstimate = async () => {
+            estimate.value = null;
+            if (!selectedReport.value || !startDate.value || !endDate.value) return;
+
+            const requestId = ++estimateRequest;
+            try {
+                const response = await axios.get(`${BACKEND_URL}/report/estimate`, {
+                    params: {
+                        report: selectedReport.value.id,
+                        start_date: formatDate(startDate.value),
+                        end_date: formatDate(endDate.value)
+                    },
+                    headers: { 'X-API-KEY': API_KEY }
+                });
+                // Ответ на устаревший запрос (период уже изменили) не показываем
+                if (requestId === estimateRequest) estimate.value = response.data;
+            } catch (err) {
+                console.error(err);
+            }
+        };
+
+        watch([selectedReport, startDate, endDate], loadEstimate);
+
+        const estimateText = (e) => {
+            if (e.cached) return 'Отчет уже сформирован и будет выдан сразу';
+            const minutes = Math.round(e.seconds / 60);
+            const duration = e.seconds < 60 ? 'меньше минуты' : `около ${minutes} мин.`;
+            let text = `Примерно ${e.rows} строк, формирование займет ${duration}`;
+            if (e.queue_ahead > 0) text += `, в очереди перед отчетом: ${e.queue_ahead}`;
+            return text;
+        };
+
         const selectReport = (report) => {
             selectedReport.value = report;
         };
@@ -63,8 +101,6 @@ createApp({
             });
 
             try {
-                const formatDate = (d) => d.split('-').reverse().join('.');
-
                 const response = await axios.get(`${BACKEND_URL}/report/${reportId}`, {
                     params: {
                         start_date: formatDate(sDate),
@@ -130,6 +166,8 @@ createApp({
             startDate,
             endDate,
             downloads,
+            estimate,
+            estimateText,
             download,
             removeDownload
         };
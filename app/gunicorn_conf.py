@@ -0,0 +1,31 @@
+"""
+Конфигурация gunicorn для продакшена: gunicorn -c app/gunicorn_conf.py app.main:app
+
+При GUNICORN_PRELOAD=1 (по умолчанию) приложение импортируется один раз в мастере,
+там же строится общее состояние только для чтения (см. app.main.preload_shared_state),
+а воркеры получают его через fork. При GUNICORN_PRELOAD=0 каждый воркер импортирует
+приложение сам, тяжелые модули подгружаются при первом использовании.
+"""
+import os
+import time
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", "4"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.getenv("GUNICORN_PRELOAD", "1").lower() in ("1", "true", "yes")
+
+_master_started = time.perf_counter()
+
+
+def when_ready(server):
+    # Вызывается в мастере после загрузки приложения и до запуска воркеров
+    if preload_app:
+        from app.main import preload_shared_state
+
+        preload_shared_state()
+    server.log.info(f"Master ready in {time.perf_counter() - _master_started:.2f}s (preload_app={preload_app})")
+
+
+def post_fork(server, worker):
+    # Отсчет времени запуска воркера (см. app.core.runtime.startup_seconds)
+    os.environ["WORKER_STARTED_AT"] = str(time.time())
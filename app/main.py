@@ -1,4 +1,8 @@
+import asyncio
+import gc
+import time
 from contextlib import asynccontextmanager
+import httpx
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from prometheus_fastapi_instrumentator import Instrumentator
@@ -7,16 +11,98 @@ from starlette.responses import FileResponse
 import os
 
 from app.core import get_settings, init_gateway_client, shutdown_gateway_client
+from app.core.admission import AdmissionController
+from app.core.cache_control import InvalidationJournal
+from app.core.logger_setup import logger
+from app.core.loop_monitor import LoopLagMonitor
+from app.core.readiness import GatewayProbe, Readiness
+from app.core.runtime import PRELOADED_ENV, record_worker_ready
 from app.route import router as api_router
+from app.service import GatewayService
+from app.service.report.cost import BUILD_COSTS
+from app.service.report.service_catalog import SERVICE_CATALOG
 
 settings = get_settings()
 tags_metadata = []
 
 
+def preload_shared_state():
+    """
+    Строит в мастере gunicorn общее состояние только для чтения, чтобы воркеры получили его
+    через fork (copy-on-write), а не строили каждый сам: модули, которые иначе импортируются
+    лениво при первой сборке отчета, и каталог услуг.
+    """
+    started = time.perf_counter()
+    # Модули openpyxl, которые воркеры импортируют при первом построении или разборе книги
+    import openpyxl  # noqa: F401
+    import openpyxl.styles  # noqa: F401
+    import openpyxl.utils  # noqa: F401
+    import openpyxl.worksheet.worksheet  # noqa: F401
+
+    async def load_catalog():
+        # HTTP-клиент мастера нельзя передавать воркерам - он живет только на время загрузки
+        client = httpx.AsyncClient(
+            base_url=settings.GATEWAY_URL,
+            headers={"X-API-KEY": settings.GATEWAY_API_KEY},
+            timeout=settings.REQUEST_TIMEOUT,
+        )
+        async with client:
+            # Недоступный шлюз не должен задерживать запуск воркеров
+            await asyncio.wait_for(SERVICE_CATALOG.load(GatewayService(client)), settings.REQUEST_TIMEOUT)
+
+    try:
+        asyncio.run(load_catalog())
+    except Exception as e:
+        # Воркеры загрузят каталог сами
+        logger.warning(f"Каталог услуг не предзагружен: {e}")
+
+    # Объекты мастера больше не просматриваются сборщиком мусора, поэтому воркеры
+    # не трогают их заголовки и не копируют унаследованные страницы памяти
+    gc.freeze()
+    os.environ[PRELOADED_ENV] = "1"
+    logger.info(f"Общее состояние предзагружено за {time.perf_counter() - started:.2f} с")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await init_gateway_client(app)
+    app.state.admission = AdmissionController(
+        max_concurrent=settings.REPORT_MAX_CONCURRENT_BUILDS,
+        max_queue=settings.REPORT_MAX_QUEUE,
+        retry_after=settings.REPORT_RETRY_AFTER,
+        disconnect_poll_interval=settings.DISCONNECT_POLL_INTERVAL,
+        heavy_cost=settings.REPORT_HEAVY_COST,
+        heavy_share=settings.REPORT_HEAVY_SHARE,
+        aging=settings.REPORT_PRIORITY_AGING,
+    )
+    BUILD_COSTS.load()
+    app.state.loop_monitor = LoopLagMonitor(settings.LOOP_LAG_INTERVAL, settings.LOOP_BLOCK_THRESHOLD)
+    app.state.loop_monitor.start()
+    app.state.gateway_probe = GatewayProbe(
+        probe=GatewayService(app.state.gateway_client).probe,
+        interval=settings.GATEWAY_PROBE_INTERVAL,
+        window=settings.GATEWAY_PROBE_WINDOW,
+        timeout=settings.GATEWAY_PROBE_TIMEOUT,
+    )
+    app.state.gateway_probe.start()
+    app.state.readiness = Readiness(
+        probe=app.state.gateway_probe,
+        admission=app.state.admission,
+        slow_p95=settings.READINESS_GATEWAY_P95,
+        max_error_rate=settings.READINESS_MAX_ERROR_RATE,
+        queue_ratio=settings.READINESS_QUEUE_RATIO,
+    )
+    if settings.REPORT_SHED_WHEN_DEGRADED:
+        app.state.admission.shed = app.state.readiness.reasons
+    SERVICE_CATALOG.start(GatewayService(app.state.gateway_client))
+    app.state.cache_journal = InvalidationJournal(settings.CACHE_JOURNAL_PATH, settings.CACHE_JOURNAL_POLL)
+    app.state.cache_journal.start()
+    record_worker_ready()
     yield
+    await app.state.cache_journal.stop()
+    await SERVICE_CATALOG.stop()
+    await app.state.gateway_probe.stop()
+    await app.state.loop_monitor.stop()
     await shutdown_gateway_client(app)
 
 
@@ -0,0 +1,34 @@
+from datetime import date, datetime
+from typing import Any, Dict, List
+
+from pydantic import BaseModel, Field
+
+
+class LoadedRange(BaseModel):
+    lpu_id: str = Field(..., description="ЛПУ (пусто - отчет без разбивки по ЛПУ)")
+    start_date: date
+    end_date: date
+    rows: int = Field(..., description="Сохранено фактов за период")
+    loaded_at: datetime = Field(..., description="Когда период загружен в хранилище")
+
+
+class MissingRange(BaseModel):
+    lpu_id: str
+    start_date: date
+    end_date: date
+
+
+class AggregateResult(BaseModel):
+    report_id: str
+    start_date: date
+    end_date: date
+    group_by: List[str]
+    bucket: str
+    rows: List[Dict[str, Any]] = Field(
+        ..., description="Группы: значения измерений, period (начало интервала), services - число услуг, "
+                         "quantity - сумма количества"
+    )
+    loaded: List[LoadedRange] = Field(..., description="Загрузки в хранилище, пересекающиеся с периодом")
+    missing: List[MissingRange] = Field(
+        ..., description="Части периода без данных в хранилище (пусто - период покрыт полностью)"
+    )
@@ -0,0 +1,17 @@
+from pydantic import BaseModel, Field
+
+
+class BuildEstimateInfo(BaseModel):
+    report_id: str
+    start_date: str
+    end_date: str
+    days: int = Field(..., description="Дней в периоде")
+    units: int = Field(..., description="ЛПУ, которые запрашиваются отдельно")
+    rows: int = Field(..., description="Ожидаемое количество строк")
+    gateway_calls: int = Field(..., description="Ожидаемое количество запросов к шлюзу")
+    seconds: float = Field(..., description="Ожидаемая длительность сборки, секунды (0 - набор строк уже в кеше)")
+    heavy: bool = Field(..., description="Тяжелая сборка: занимает ограниченную долю слотов и идет после дешевых")
+    cached: bool = Field(..., description="Набор строк уже собран и будет отдан из кеша")
+    history: int = Field(..., description="Сколько сборок отчета учтено в оценке (0 - оценка по умолчанию)")
+    queue_ahead: int = Field(..., description="Сборок в очереди, которые запустятся раньше")
+    active: int = Field(..., description="Сборок, выполняющихся сейчас")
@@ -0,0 +1,20 @@
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel, Field
+
+
+class InvalidateRequest(BaseModel):
+    caches: Optional[List[str]] = Field(None, description="Имена кешей (по умолчанию - все)")
+    pattern: Optional[str] = Field(
+        None, description="Glob по строковому виду ключа, например \"('invitro', '01.11.2025'*\""
+    )
+    report_id: Optional[str] = Field(None, description="Только записи отчета")
+    start_date: Optional[str] = Field(None, description="Только записи, период которых пересекается с [start_date, end_date]")
+    end_date: Optional[str] = None
+
+
+class WarmUpRequest(BaseModel):
+    reports: List[Literal["32430", "invitro"]] = Field(["32430", "invitro"], description="Отчеты для построения")
+    start_date: str = Field(..., description="Начало периода, ДД.ММ.ГГГГ")
+    end_date: str = Field(..., description="Конец периода, ДД.ММ.ГГГГ")
+    catalog: bool = Field(True, description="Перезагрузить каталог услуг")
@@ -0,0 +1,31 @@
+from typing import ClassVar, Optional
+
+from pydantic import BaseModel
+
+from app.core.deadline import UNRESOLVED
+
+
+class InvitroRow(BaseModel):
+    surname: Optional[str] = None
+    first_name: Optional[str] = None
+    middle_name: Optional[str] = None
+    birthday: Optional[str] = None
+    soc_status: Optional[str] = None
+    job_category: Optional[str] = None
+    job_name: Optional[str] = None
+    service_date: Optional[str] = None
+    pay_type: Optional[str] = None
+    service_code: Optional[str] = None
+    service_name: Optional[str] = None
+
+    MISSING_JOB: ClassVar[str] = "В ЕВМИАС отсутствуют данные о месте работы"
+
+    @property
+    def is_missing_job(self) -> bool:
+        """Строки без сведений о месте работы подсвечиваются в отчете"""
+        return self.job_name == self.MISSING_JOB
+
+    @property
+    def is_unresolved(self) -> bool:
+        """Строки, часть сведений которых не успели получить до срока сборки"""
+        return UNRESOLVED in (self.soc_status, self.job_name, self.pay_type, self.service_code)
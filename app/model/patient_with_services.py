@@ -2,6 +2,8 @@ from pydantic import BaseModel, Field, field_validator
 from datetime import date, datetime
 from typing import Optional, Dict, ClassVar
 
+from app.core.deadline import UNRESOLVED
+
 
 class PatientServiceRow(BaseModel):
     full_name: Optional[str] = None
@@ -31,6 +33,9 @@ class PatientServiceRow(BaseModel):
 
     service_payment_source: Optional[str] = None
 
+    # ЛПУ, из выгрузки которого получена строка
+    lpu_id: Optional[str] = None
+
     # КАРТА СООТВЕТСТВИЯ
     _COLUMN_MAP: ClassVar[Dict[str, int]] = {
         "full_name": 1,
@@ -75,11 +80,18 @@ class PatientServiceRow(BaseModel):
 
     @field_validator('birthday', 'service_date', 'start_date', 'end_date', mode='before')
     def parse_date(cls, v): # noqa
-        """Превращает 'DD.MM.YYYY' в date object. Если уже date/datetime - оставляет как есть."""
+        """
+        Превращает 'DD.MM.YYYY' (или ISO 'YYYY-MM-DD' из JSON, например из снимка прогона)
+        в date object. Если уже date/datetime - оставляет как есть.
+        """
         if isinstance(v, str):
             try:
                 # Если в ячейке дата текстом
                 return datetime.strptime(v, "%d.%m.%Y").date()
+            except ValueError:
+                pass
+            try:
+                return date.fromisoformat(v)
             except ValueError:
                 return None
         # Если openpyxl сам распознал дату (вернул datetime), Pydantic сам приведет её к date
@@ -94,6 +106,11 @@ class PatientServiceRow(BaseModel):
         except (ValueError, TypeError):
             return None
 
+    @property
+    def is_unresolved(self) -> bool:
+        """Источник оплаты не успели получить до срока сборки"""
+        return self.service_payment_source == UNRESOLVED
+
     @classmethod
     def from_row(cls, row: tuple) -> "PatientServiceRow":
         data = {}
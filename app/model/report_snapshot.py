@@ -0,0 +1,9 @@
+from datetime import datetime
+
+from pydantic import BaseModel, Field
+
+
+class ReportSnapshotInfo(BaseModel):
+    id: str = Field(..., description="Идентификатор снимка (версия набора строк), передается в since/until")
+    built_at: datetime = Field(..., description="Когда был собран набор строк")
+    rows: int = Field(..., description="Строк в наборе")
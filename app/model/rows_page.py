@@ -0,0 +1,22 @@
+from datetime import datetime
+from typing import Generic, List, Optional, TypeVar
+
+from pydantic import BaseModel, Field
+
+RowT = TypeVar("RowT")
+
+
+class UnresolvedLookup(BaseModel):
+    lookup: str = Field(..., description="Какие сведения не получены")
+    key: str = Field(..., description="Для какого значения (заявка, карта, услуга)")
+
+
+class RowsPage(BaseModel, Generic[RowT]):
+    items: List[RowT]
+    total: int = Field(..., description="Количество строк после применения фильтров")
+    next_cursor: Optional[str] = Field(None, description="Курсор следующей страницы (null - страниц больше нет)")
+    built_at: datetime = Field(..., description="Время построения набора данных")
+    unresolved: List[UnresolvedLookup] = Field(
+        default_factory=list,
+        description="Сведения, не полученные до истечения срока сборки (пусто - набор полный)",
+    )
@@ -1,8 +1,12 @@
 from fastapi import APIRouter
 
+from .admin import router as admin_router
+from .analytics import router as analytics_router
 from .health import router as health_router
 from .report import router as report_router
 
 router = APIRouter()
 router.include_router(health_router)
 router.include_router(report_router)
+router.include_router(analytics_router)
+router.include_router(admin_router)
@@ -0,0 +1,114 @@
+import os
+from typing import Annotated, Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+
+from app.core import check_admin_key, get_admission_controller, get_gateway_service, get_settings
+from app.core.admission import AdmissionController
+from app.core.cache_control import InvalidationRule, cache_names, cache_stats, invalidate
+from app.core.runtime import runtime_info
+from app.model.cache_admin import InvalidateRequest, WarmUpRequest
+from app.service import GatewayService
+from app.service.report.profile import profile_report_build
+from app.service.report.warmup import schedule_warm_up
+from app.service.tool.sharding import parse_date
+
+settings = get_settings()
+
+router = APIRouter(
+    prefix="/admin", tags=["Администрирование"], dependencies=[Depends(check_admin_key)]
+)
+
+
+@router.get(
+    path="/profile/{report_id}",
+    summary="Профилирование сборки отчета",
+    description="Собирает отчет за период с нуля под сэмплирующим профайлером и tracemalloc. "
+                "Возвращает горячие функции, статистику выделения памяти и разбивку запросов к шлюзу. "
+                "Профилируется весь воркер, поэтому параллельные запросы тоже попадут в сводку.",
+)
+async def profile_report(
+        report_id: Literal["32430", "invitro"],
+        gateway: Annotated[GatewayService, Depends(get_gateway_service)],
+        admission: Annotated[AdmissionController, Depends(get_admission_controller)],
+        start_date: str = "13.11.2025",
+        end_date: str = "13.11.2025",
+        top: Annotated[Optional[int], Query(ge=1, le=200)] = None,
+):
+    # Сборка под профайлером занимает слот наравне с обычными отчетами
+    release = await admission.acquire(("profile", report_id, start_date, end_date))
+    try:
+        return await profile_report_build(report_id, start_date, end_date, gateway, top or settings.PROFILE_TOP)
+    finally:
+        release()
+
+
+@router.get(
+    path="/runtime",
+    summary="Запуск и память воркера",
+    description="Время запуска и память (rss, pss, shared, private) воркера, обслужившего запрос, "
+                "и признак предзагрузки общего состояния в мастере gunicorn.",
+)
+async def get_runtime():
+    return runtime_info()
+
+
+@router.get(
+    path="/caches",
+    summary="Состояние кешей",
+    description="Для каждого кеша воркера, обслужившего запрос: число записей, доля попаданий, "
+                "распределение записей по возрасту и (с memory=true) приблизительный объем памяти. "
+                "In-memory кеши у каждого воркера свои.",
+)
+async def list_caches(memory: bool = True):
+    return {
+        "pid": os.getpid(),
+        "caches": await cache_stats(memory),
+    }
+
+
+@router.post(
+    path="/caches/invalidate",
+    summary="Инвалидация кешей",
+    description="Удаляет записи, подходящие под все заданные условия: glob по ключу, отчет, "
+                "пересечение периода записи с заданным. Без условий очищает выбранные кеши целиком. "
+                "Правило применяется сразу в этом воркере и в течение CACHE_JOURNAL_POLL секунд - в остальных.",
+)
+async def invalidate_caches(body: InvalidateRequest, request: Request):
+    unknown = set(body.caches or ()) - set(cache_names())
+    if unknown:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Неизвестные кеши: {sorted(unknown)}")
+    try:
+        start = parse_date(body.start_date) if body.start_date else None
+        end = parse_date(body.end_date) if body.end_date else None
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Даты ожидаются в формате ДД.ММ.ГГГГ")
+
+    rule = InvalidationRule(
+        caches=body.caches, pattern=body.pattern, report_id=body.report_id, start_date=start, end_date=end
+    )
+    removed = await invalidate(rule, request.app.state.cache_journal)
+    return {"rule_id": rule.id, "removed": removed}
+
+
+@router.post(
+    path="/caches/warm",
+    summary="Прогрев кешей",
+    description="Запускает в фоне загрузку каталога услуг и построение отчетов за период. "
+                "Сборки идут через общую очередь и не вытесняют пользовательские запросы: "
+                "при заполненной очереди отчет пропускается (итог - в логе).",
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def warm_caches(
+        body: WarmUpRequest,
+        gateway: Annotated[GatewayService, Depends(get_gateway_service)],
+        admission: Annotated[AdmissionController, Depends(get_admission_controller)],
+):
+    try:
+        if parse_date(body.start_date) > parse_date(body.end_date):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Начало периода позже его конца")
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Даты ожидаются в формате ДД.ММ.ГГГГ")
+
+    schedule_warm_up(body.reports, body.start_date, body.end_date, gateway, admission, body.catalog)
+    return {"status": "started", "reports": body.reports, "start_date": body.start_date, "end_date": body.end_date}
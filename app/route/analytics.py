@@ -0,0 +1,117 @@
+import asyncio
+from typing import Annotated, List, Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+
+from app.core import check_api_key, get_admission_controller, get_gateway_service, get_settings
+from app.core.admission import AdmissionController
+from app.model.analytics import AggregateResult
+from app.service import GatewayService
+from app.service.report.analytics import ANALYTICS, Bucket, Dimension, StoreBusy, ingest_dataset, missing_ranges
+from app.service.report.dataset import get_dataset
+from app.service.report.patient_with_service import normalize_lpu_ids
+from app.service.report.registry import REPORTS
+from app.service.tool.sharding import parse_date
+
+settings = get_settings()
+
+router = APIRouter(
+    prefix="/analytics", tags=["Аналитика"], dependencies=[Depends(check_api_key)]
+)
+
+GROUP_BY_DESCRIPTION = "Измерения группировки (параметр можно повторять); без них - итог за период"
+BUCKET_DESCRIPTION = "Разбивка по интервалам дат услуги: none (без разбивки), day, week, month, year"
+LPU_DESCRIPTION = "ЛПУ (параметр можно повторять), только для отчета 32430; по умолчанию - ЛПУ отчета по умолчанию"
+
+ReportId = Literal["32430", "invitro"]
+
+
+def _lpu_scope(report_id: str, lpu: Optional[List[str]]) -> tuple:
+    """ЛПУ, по которым считаются агрегаты и покрытие периода."""
+    try:
+        params = {"lpu_ids": tuple(normalize_lpu_ids(lpu))} if report_id == "32430" else {}
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return REPORTS[report_id].facts.scope(params)
+
+
+def _period(start_date: str, end_date: str):
+    try:
+        start, end = parse_date(start_date), parse_date(end_date)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Даты ожидаются в формате ДД.ММ.ГГГГ")
+    if start > end:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Начало периода позже его конца")
+    return start, end
+
+
+@router.get(
+    path="/{report_id}/aggregate",
+    summary="Итоги по услугам из аналитического хранилища",
+    description="Количество услуг и сумма количества за период с группировкой по измерениям и интервалам дат. "
+                "Считается по ранее собранным отчетам без обращения к ЕВМИАС; поле missing показывает "
+                "части периода, отчеты за которые еще не собирались.",
+    response_model=AggregateResult,
+)
+async def get_aggregate(
+        report_id: ReportId,
+        start_date: str = "13.11.2025",
+        end_date: str = "13.11.2025",
+        group_by: Annotated[Optional[List[Dimension]], Query(description=GROUP_BY_DESCRIPTION)] = None,
+        bucket: Annotated[Bucket, Query(description=BUCKET_DESCRIPTION)] = Bucket.NONE,
+        lpu: Annotated[Optional[List[str]], Query(description=LPU_DESCRIPTION)] = None,
+):
+    start, end = _period(start_date, end_date)
+    scope = _lpu_scope(report_id, lpu)
+    dimensions = list(dict.fromkeys(group_by or []))
+
+    try:
+        rows = await asyncio.to_thread(ANALYTICS.aggregate, report_id, start, end, dimensions, bucket, scope)
+        loaded = await asyncio.to_thread(ANALYTICS.loaded_ranges, report_id, start, end, scope)
+    except StoreBusy as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+
+    return AggregateResult(
+        report_id=report_id,
+        start_date=start,
+        end_date=end,
+        group_by=[dimension.value for dimension in dimensions],
+        bucket=bucket.value,
+        rows=rows,
+        loaded=loaded,
+        missing=missing_ranges(loaded, start, end, scope),
+    )
+
+
+@router.post(
+    path="/{report_id}/load",
+    summary="Загрузка периода в аналитическое хранилище",
+    description="Собирает отчет за период (или берет готовый набор строк из кеша) и сохраняет его в хранилище, "
+                "заменяя ранее загруженные данные за этот период.",
+)
+async def load_period(
+        report_id: ReportId,
+        request: Request,
+        gateway: Annotated[GatewayService, Depends(get_gateway_service)],
+        admission: Annotated[AdmissionController, Depends(get_admission_controller)],
+        start_date: str = "13.11.2025",
+        end_date: str = "13.11.2025",
+        lpu: Annotated[Optional[List[str]], Query(description=LPU_DESCRIPTION)] = None,
+):
+    _period(start_date, end_date)
+    scope = _lpu_scope(report_id, lpu)
+    # Параметры источника - как у выгрузки отчета, чтобы использовать тот же кеш наборов строк
+    params = None if report_id != "32430" or scope == (settings.REPORT_32430_LPU_ID,) else {"lpu_ids": scope}
+
+    dataset = await admission.run(
+        (report_id, start_date, end_date, "rows", None, tuple(sorted((params or {}).items()))),
+        lambda: get_dataset(report_id, start_date, end_date, gateway, params=params),
+        is_disconnected=request.is_disconnected,
+    )
+    try:
+        stored = await ingest_dataset(dataset)
+    except StoreBusy as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+
+    return {"report_id": report_id, "start_date": start_date, "end_date": end_date, "rows": len(dataset.rows),
+            "stored": stored}
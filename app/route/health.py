@@ -1,6 +1,6 @@
 from typing import Annotated
-from fastapi import APIRouter, Depends
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, Request, status
+from fastapi.responses import JSONResponse, StreamingResponse
 
 from app.core import check_api_key, get_gateway_service
 from app.model import GatewayRequest
@@ -20,6 +20,19 @@ async def check():
     return {"ping": "pong"}
 
 
+@router.get(
+    path="/ready",
+    summary="Готовность к сборке отчетов",
+    description="Состояние по фоновым замерам шлюза (перцентили задержки, доля ошибок) и очереди сборок. "
+                "Возвращает 503 со статусом 'degraded', если шлюз медленный или ненадежный "
+                "либо очередь сборок почти заполнена - в этом состоянии новые сборки отклоняются.",
+)
+async def check_readiness(request: Request):
+    report = request.app.state.readiness.report()
+    status_code = status.HTTP_200_OK if report["status"] == "ok" else status.HTTP_503_SERVICE_UNAVAILABLE
+    return JSONResponse(report, status_code=status_code)
+
+
 @router.post(
     path="/gateway",
     summary="Проверка связи со шлюзом API",
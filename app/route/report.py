@@ -1,34 +1,577 @@
-from typing import Annotated
-from fastapi import APIRouter, Depends
-from fastapi.responses import StreamingResponse
+import asyncio
+from datetime import date, datetime
+from typing import Any, AsyncGenerator, AsyncIterator, Annotated, Awaitable, Callable, Dict, List, Literal, Optional, Tuple
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import FileResponse, Response, StreamingResponse
 
-from app.core import check_api_key, get_gateway_service
+from app.core import check_api_key, get_admission_controller, get_gateway_service, get_settings, logger, route_handler
+from app.core.admission import AdmissionController
+from app.core.http_cache import cache_control, is_not_modified, validator_headers
+from app.core.metrics import REPORT_BUILDS_CANCELLED
+from app.model.build_estimate import BuildEstimateInfo
+from app.model.invitro import InvitroRow
+from app.model.patient_with_services import PatientServiceRow
+from app.model.report_snapshot import ReportSnapshotInfo
+from app.model.rows_page import RowsPage
 from app.service import GatewayService
-from app.service.report.invitro_list import process_invitro_list
-from app.service.report.patient_with_service import get_list_patients_with_services, generate_excel_from_models
+from app.service.report.bundle import BUNDLE_MEDIA_TYPES, BundleFormat, build_bundle, render_bundle
+from app.service.report.cost import BUILD_COSTS
+from app.service.report.dataset import (VALIDATORS, RenderedReport, ReportDataset, get_dataset, iter_dataset_rows,
+                                        paginate_dataset, peek_dataset, peek_rendered, render_dataset)
+from app.service.report.delta import SNAPSHOTS, Delta, DeltaRow, compute_delta, delta_definition, render_delta
+from app.service.report.patient_with_service import normalize_lpu_ids
+from app.service.report.registry import REPORTS
+from app.service.tool.export import MEDIA_TYPES, ReportFormat, stream_csv, stream_ndjson
+from app.service.tool.sharding import parse_date
+
+settings = get_settings()
 
 router = APIRouter(
     prefix="/report", tags=["Отчеты"], dependencies=[Depends(check_api_key)]
 )
 
+FORMAT_DESCRIPTION = "Формат выгрузки: xlsx (по умолчанию), csv или ndjson (потоковая отдача)"
+CURSOR_DESCRIPTION = "Курсор из поля next_cursor предыдущей страницы"
+DEADLINE_DESCRIPTION = ("Срок сборки в секундах: по его истечении отчет отдается с тем, что успели получить, "
+                        "недополученные значения помечаются")
+
+LPU_DESCRIPTION = ("Идентификаторы ЛПУ (параметр можно повторять). Несколько ЛПУ выгружаются параллельно: "
+                   "в Excel каждое ЛПУ на своем листе, в остальных форматах - общий набор с колонкой ЛПУ")
+
+SINCE_DESCRIPTION = "Снимок, с которым сравнивать (id из списка снимков), по умолчанию - предыдущий"
+UNTIL_DESCRIPTION = ("Снимок, который сравнивать, по умолчанию - текущий набор строк. "
+                     "Сравнение двух снимков не обращается к ЕВМИАС")
+DELTA_FORMAT_DESCRIPTION = "Формат выгрузки: xlsx (по умолчанию), csv или ndjson"
+
+BUNDLE_REPORTS_DESCRIPTION = "Отчеты пакета (параметр можно повторять), по умолчанию все"
+BUNDLE_FORMAT_DESCRIPTION = "xlsx - одна книга с листом на каждый отчет (по умолчанию), zip - архив отдельных книг"
+
+Deadline = Annotated[Optional[float], Query(gt=0, description=DEADLINE_DESCRIPTION)]
+Lpu = Annotated[Optional[List[str]], Query(description=LPU_DESCRIPTION)]
+
+
+def _params_key(params: Optional[Dict[str, Any]]) -> tuple:
+    return tuple(sorted((params or {}).items()))
+
+
+def _lpu_params(lpu: Optional[List[str]]) -> Optional[Dict[str, Any]]:
+    """Параметры источника 32430 для выбранных ЛПУ (None - только ЛПУ по умолчанию)."""
+    try:
+        lpu_ids = normalize_lpu_ids(lpu)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    if lpu_ids == [settings.REPORT_32430_LPU_ID]:
+        return None
+    return {"lpu_ids": tuple(lpu_ids)}
+
+
+async def _release_after(
+        content: AsyncIterator[bytes],
+        release: Callable[[], None],
+        report_id: str,
+        gateway: GatewayService,
+) -> AsyncIterator[bytes]:
+    """
+    Держит слот сборки, пока поток не будет отдан клиенту целиком.
+    Если клиент отключился, поток прерывается вместе с ожидающими запросами к шлюзу.
+    """
+    try:
+        async for chunk in content:
+            yield chunk
+    except (asyncio.CancelledError, GeneratorExit):
+        REPORT_BUILDS_CANCELLED.labels(report=report_id).inc()
+        cancelled = gateway.cancel_pending()
+        logger.info(f"Клиент отключился от потоковой выгрузки {report_id}, отменено запросов к шлюзу: {cancelled}")
+        raise
+    finally:
+        release()
+
+
+class _SlotStreamingResponse(StreamingResponse):
+    """
+    Потоковый ответ, занимающий слот сборки. Слот освобождается по завершении ответа, даже если
+    тело так и не начали отдавать: при ASGI < 2.4 Starlette отменяет отдачу, когда клиент ушел
+    раньше, и генератор тела (вместе с его finally) не запускается вовсе.
+    """
+
+    def __init__(
+            self,
+            content: AsyncIterator[bytes],
+            release: Callable[[], None],
+            rows: AsyncGenerator[Any, None],
+            **kwargs,
+    ):
+        super().__init__(content, **kwargs)
+        self._release = release
+        self._rows = rows
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._release()
+            # Сборка уже начата (получена первая строка): если тело не отдали, останавливаем ее
+            await self._rows.aclose()
+
+
+async def _start_rows(rows: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    """
+    Получает первую строку до отправки ответа: ошибка в начале сборки (недоступный шлюз,
+    ошибка ЕВМИАС) возвращается клиенту обычным статусом, а не обрывом тела после 200.
+    """
+    try:
+        first = await anext(rows)
+    except StopAsyncIteration:
+        empty = True
+    else:
+        empty = False
+
+    async def started() -> AsyncIterator[Any]:
+        if empty:
+            return
+        yield first
+        async for row in rows:
+            yield row
+
+    return started()
+
+
+async def _logged_rows(rows: AsyncIterator[Any], key: tuple) -> AsyncIterator[Any]:
+    try:
+        async for row in rows:
+            yield row
+    except Exception as e:
+        logger.error(f"Потоковая выгрузка {key} прервана после отправки заголовков, "
+                     f"в конец файла записана ошибка: {e}")
+        raise
+
+
+def _cancellable(gateway: GatewayService, factory: Callable[[], Awaitable[Any]]) -> Callable[[], Awaitable[Any]]:
+    """При отмене сборки отменяет и запросы к шлюзу, запущенные ею в отдельных задачах."""
+    async def wrapper():
+        try:
+            return await factory()
+        except asyncio.CancelledError:
+            gateway.cancel_pending()
+            raise
+
+    return wrapper
+
+
+def _build_cost(report_id: str, start_date: str, end_date: str, params: Optional[Dict[str, Any]] = None) -> float:
+    """Оценка стоимости сборки для очереди; набор строк из кеша почти ничего не стоит."""
+    if peek_dataset(report_id, start_date, end_date, params) is not None:
+        return 0.0
+    try:
+        return BUILD_COSTS.estimate(report_id, start_date, end_date, params).cost
+    except ValueError:
+        # Некорректный период отклонит сама сборка
+        return 0.0
+
+
+def _past_only(end_date: str) -> bool:
+    """Период целиком в прошлом: данные за него уже не меняются."""
+    try:
+        return parse_date(end_date) < date.today()
+    except ValueError:
+        return False
+
+
+def _not_modified(headers: Dict[str, str]) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+
+def _validator_key(
+        report_id: str,
+        start_date: str,
+        end_date: str,
+        params: Optional[Dict[str, Any]],
+        report_format: ReportFormat,
+) -> tuple:
+    return report_id, start_date, end_date, _params_key(params), report_format.value
+
+
+async def _remembered_not_modified(request: Request, key: tuple) -> Optional[Response]:
+    """
+    Условный запрос к отчету за прошедший период, набора которого уже нет в кеше:
+    304 по сохраненному ETag без сборки. None - валидаторов нет или они не совпали.
+    """
+    if "if-none-match" not in request.headers and "if-modified-since" not in request.headers:
+        return None
+    stored = await asyncio.to_thread(VALIDATORS.get, key)
+    if stored is None:
+        return None
+    etag, last_modified = stored
+    if not is_not_modified(request, etag, last_modified):
+        return None
+    return _not_modified(validator_headers(cache_control(True), etag, last_modified))
+
+
+async def _remember_validators(key: tuple, etag: str, last_modified: datetime):
+    """Сохраняет валидаторы полного отчета за прошедший период. Ошибка не мешает выдаче отчета."""
+    try:
+        await asyncio.to_thread(VALIDATORS.put, key, etag, last_modified)
+    except Exception as e:
+        logger.warning(f"ETag отчета {key} не сохранен: {e}")
+
+
+def _file_response(rendered: RenderedReport, media_type: str, headers: Dict[str, str]) -> Response:
+    """
+    Файл из хранилища отдается FileResponse: он читается с диска по частям
+    (или через sendfile, если сервер это поддерживает), поддерживаются Range-запросы.
+    """
+    if rendered.path is not None:
+        return FileResponse(rendered.path, media_type=media_type, headers=headers)
+    return Response(rendered.content, media_type=media_type, headers=headers)
+
+
+async def _stream_rows(
+        report_id: str,
+        start_date: str,
+        end_date: str,
+        gateway: GatewayService,
+        admission: AdmissionController,
+        request: Request,
+        report_format: ReportFormat,
+        filename: str,
+        deadline: Optional[float] = None,
+        params: Optional[Dict[str, Any]] = None,
+) -> Response:
+    """Потоковая отдача строк отчета в CSV/NDJSON без построения книги Excel."""
+    past_only = _past_only(end_date)
+    validator_key = _validator_key(report_id, start_date, end_date, params, report_format)
+    dataset = peek_dataset(report_id, start_date, end_date, params)
+    if dataset is not None:
+        # Готовый набор из кеша: ответ определяется параметрами запроса и версией набора
+        etag = dataset.etag(report_format.value)
+        cache_headers = validator_headers(cache_control(past_only), etag=etag, last_modified=dataset.built_at)
+        if is_not_modified(request, etag, dataset.built_at):
+            return _not_modified(cache_headers)
+        if past_only:
+            await _remember_validators(validator_key, etag, dataset.built_at)
+    else:
+        if past_only:
+            not_modified = await _remembered_not_modified(request, validator_key)
+            if not_modified is not None:
+                return not_modified
+        # Строки собираются по ходу отдачи - версию набора заранее не знаем
+        cache_headers = validator_headers(cache_control(past_only, partial=deadline is not None))
+
+    def render(rows: AsyncIterator[Any]) -> AsyncIterator[bytes]:
+        if report_format == ReportFormat.CSV:
+            definition = REPORTS[report_id].for_params(params)
+            return stream_csv(definition.titles, rows, definition.row_values)
+        return stream_ndjson(rows)
+
+    source = iter_dataset_rows(report_id, start_date, end_date, gateway, deadline, params)
+
+    # Готовый набор из кеша отдается без очереди, сборка с нуля занимает слот
+    if dataset is None:
+        key = (report_id, start_date, end_date, report_format.value, deadline, _params_key(params))
+        cost = _build_cost(report_id, start_date, end_date, params)
+        admission.check_shed(key, cost)
+        release = await admission.acquire(key, cost)
+        try:
+            rows = await _start_rows(source)
+        except BaseException as e:
+            release()
+            await source.aclose()
+            if isinstance(e, Exception):
+                logger.error(f"Потоковая выгрузка {key} не начата: {e}")
+            raise
+        return _SlotStreamingResponse(
+            _release_after(render(_logged_rows(rows, key)), release, report_id, gateway),
+            release,
+            source,
+            media_type=MEDIA_TYPES[report_format],
+            headers={"Content-Disposition": f"attachment; filename={filename}.{report_format.value}", **cache_headers}
+        )
+
+    return StreamingResponse(
+        render(source),
+        media_type=MEDIA_TYPES[report_format],
+        headers={"Content-Disposition": f"attachment; filename={filename}.{report_format.value}", **cache_headers}
+    )
+
+
+async def _xlsx_response(
+        report_id: str,
+        start_date: str,
+        end_date: str,
+        gateway: GatewayService,
+        admission: AdmissionController,
+        request: Request,
+        filename: str,
+        deadline: Optional[float] = None,
+        params: Optional[Dict[str, Any]] = None,
+) -> Response:
+    """
+    Собирает книгу Excel через очередь сборок; одинаковые запросы получают один результат.
+    Условный запрос к уже построенной книге получает 304 без очереди и без пересборки.
+    """
+    past_only = _past_only(end_date)
+    validator_key = _validator_key(report_id, start_date, end_date, params, ReportFormat.XLSX)
+    headers = {"Content-Disposition": f"attachment; filename={filename}.xlsx"}
+
+    # Уже построенная книга отдается без очереди и без пересборки
+    dataset = peek_dataset(report_id, start_date, end_date, params)
+    rendered = await peek_rendered(dataset) if dataset is not None else None
+    if rendered is not None:
+        cache_headers = validator_headers(cache_control(past_only), rendered.etag, rendered.last_modified)
+        if is_not_modified(request, rendered.etag, rendered.last_modified):
+            return _not_modified(cache_headers)
+        if past_only:
+            await _remember_validators(validator_key, rendered.etag, rendered.last_modified)
+        return _file_response(rendered, MEDIA_TYPES[ReportFormat.XLSX], {**headers, "X-Unresolved-Lookups": "0", **cache_headers})
+
+    if dataset is None and past_only:
+        not_modified = await _remembered_not_modified(request, validator_key)
+        if not_modified is not None:
+            return not_modified
+
+    async def build() -> Tuple[RenderedReport, int]:
+        built = await get_dataset(report_id, start_date, end_date, gateway, deadline, params)
+        return await render_dataset(built), len(built.unresolved)
+
+    rendered, unresolved_count = await admission.run(
+        (report_id, start_date, end_date, ReportFormat.XLSX.value, deadline, _params_key(params)),
+        _cancellable(gateway, build),
+        is_disconnected=request.is_disconnected,
+        cost=_build_cost(report_id, start_date, end_date, params),
+    )
+
+    if unresolved_count:
+        # Неполный отчет не кешируется и не получает валидаторов
+        cache_headers = validator_headers(cache_control(past_only, partial=True))
+    else:
+        cache_headers = validator_headers(cache_control(past_only), rendered.etag, rendered.last_modified)
+        if is_not_modified(request, rendered.etag, rendered.last_modified):
+            return _not_modified(cache_headers)
+        if past_only:
+            await _remember_validators(validator_key, rendered.etag, rendered.last_modified)
+
+    return _file_response(rendered, MEDIA_TYPES[ReportFormat.XLSX], {**headers, "X-Unresolved-Lookups": str(unresolved_count), **cache_headers})
+
+
+async def _admitted_dataset(
+        report_id: str,
+        start_date: str,
+        end_date: str,
+        gateway: GatewayService,
+        admission: AdmissionController,
+        request: Request,
+        deadline: Optional[float] = None,
+        params: Optional[Dict[str, Any]] = None,
+) -> ReportDataset:
+    dataset = peek_dataset(report_id, start_date, end_date, params)
+    if dataset is not None:
+        return dataset
+
+    return await admission.run(
+        (report_id, start_date, end_date, "rows", deadline, _params_key(params)),
+        _cancellable(gateway, lambda: get_dataset(report_id, start_date, end_date, gateway, deadline, params)),
+        is_disconnected=request.is_disconnected,
+        cost=_build_cost(report_id, start_date, end_date, params),
+    )
+
+
+@router.get(
+    path="/queue",
+    description="Текущие сборки отчетов в этом воркере и очередь ожидания с позициями",
+    summary="Состояние очереди сборки отчетов",
+)
+async def get_build_queue(
+        admission: Annotated[AdmissionController, Depends(get_admission_controller)],
+):
+    return admission.snapshot()
+
+
+@router.get(
+    path="/estimate",
+    description="Оценка сборки отчета за период по истории сборок: строки, запросы к шлюзу, длительность "
+                "и место в очереди. Позволяет предупредить пользователя о долгой выгрузке до отправки запроса.",
+    summary="Оценка стоимости сборки отчета",
+    response_model=BuildEstimateInfo,
+)
+async def estimate_report_build(
+        admission: Annotated[AdmissionController, Depends(get_admission_controller)],
+        report: Literal["32430", "invitro"],
+        start_date: str = "13.11.2025",
+        end_date: str = "13.11.2025",
+        lpu: Lpu = None,
+):
+    params = _lpu_params(lpu) if report == "32430" else None
+    try:
+        estimate = BUILD_COSTS.estimate(report, start_date, end_date, params)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    cached = peek_dataset(report, start_date, end_date, params) is not None
+    cost = 0.0 if cached else estimate.cost
+    return BuildEstimateInfo(
+        report_id=report,
+        start_date=start_date,
+        end_date=end_date,
+        days=estimate.days,
+        units=estimate.units,
+        rows=estimate.rows,
+        gateway_calls=0 if cached else estimate.gateway_calls,
+        seconds=cost,
+        heavy=admission.is_heavy(cost),
+        cached=cached,
+        history=estimate.history,
+        queue_ahead=admission.ahead_of(cost),
+        active=admission.active_count,
+    )
+
+
+async def _iter_rows(rows: List[DeltaRow]) -> AsyncIterator[DeltaRow]:
+    for row in rows:
+        yield row
+
+
+async def _delta_response(
+        report_id: str,
+        delta: Delta,
+        report_format: ReportFormat,
+        filename: str,
+        params: Optional[Dict[str, Any]] = None,
+) -> Response:
+    headers = {
+        "Content-Disposition": f"attachment; filename={filename}.{report_format.value}",
+        "X-Delta-Since": delta.since.id,
+        "X-Delta-Until": delta.until.id,
+        "X-Delta-Added": str(delta.count("added")),
+        "X-Delta-Removed": str(delta.count("removed")),
+        "X-Delta-Changed": str(delta.count("changed")),
+    }
+    media_type = MEDIA_TYPES[report_format]
+    if report_format == ReportFormat.XLSX:
+        content = await asyncio.to_thread(render_delta, report_id, delta, params)
+        return Response(content, media_type=media_type, headers=headers)
+
+    if report_format == ReportFormat.CSV:
+        definition = delta_definition(REPORTS[report_id].for_params(params))
+        content = stream_csv(definition.titles, _iter_rows(delta.rows), definition.row_values)
+    else:
+        content = stream_ndjson(_iter_rows(delta.rows))
+    return StreamingResponse(content, media_type=media_type, headers=headers)
+
+
+@router.get(
+    path="/{report_id}/snapshots",
+    description="Сохраненные снимки полных прогонов отчета за период, от старых к новым",
+    summary="Снимки прогонов отчета",
+    response_model=List[ReportSnapshotInfo],
+)
+async def list_report_snapshots(
+        report_id: Literal["32430", "invitro"],
+        start_date: str = "13.11.2025",
+        end_date: str = "13.11.2025",
+        lpu: Lpu = None,
+):
+    params = _lpu_params(lpu) if report_id == "32430" else None
+    snapshots = await asyncio.to_thread(SNAPSHOTS.list, report_id, start_date, end_date, _params_key(params))
+    return [ReportSnapshotInfo(id=info.id, built_at=info.built_at, rows=info.rows) for info in snapshots]
+
+
+@router.get(
+    path="/{report_id}/delta",
+    description="Только строки, которые добавились, исчезли или изменились с прошлого прогона отчета за тот же период "
+                "(или между двумя сохраненными снимками). Изменившиеся колонки перечислены в колонке «Изменено».",
+    summary="Изменения отчета с прошлого прогона",
+)
+async def get_report_delta(
+        request: Request,
+        gateway: Annotated[GatewayService, Depends(get_gateway_service)],
+        admission: Annotated[AdmissionController, Depends(get_admission_controller)],
+        report_id: Literal["32430", "invitro"],
+        start_date: str = "13.11.2025",
+        end_date: str = "13.11.2025",
+        since: Annotated[Optional[str], Query(description=SINCE_DESCRIPTION)] = None,
+        until: Annotated[Optional[str], Query(description=UNTIL_DESCRIPTION)] = None,
+        report_format: Annotated[ReportFormat, Query(alias="format", description=DELTA_FORMAT_DESCRIPTION)] = ReportFormat.XLSX,
+        lpu: Lpu = None,
+) -> Response:
+    params = _lpu_params(lpu) if report_id == "32430" else None
+    current = until
+    if current is None:
+        current = await _admitted_dataset(report_id, start_date, end_date, gateway, admission, request, params=params)
+
+    try:
+        delta = await compute_delta(report_id, start_date, end_date, _params_key(params), since, current)
+    except LookupError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+    return await _delta_response(
+        report_id, delta, report_format, f"report_{report_id}_delta_{start_date}-{end_date}", params
+    )
+
+
+@router.get(
+    path="/bundle",
+    description="Несколько отчетов за один период одним заданием: одна книга Excel с листом на отчет или zip-архив",
+    summary="Пакет отчетов за период",
+)
+async def get_report_bundle(
+        request: Request,
+        gateway: Annotated[GatewayService, Depends(get_gateway_service)],
+        admission: Annotated[AdmissionController, Depends(get_admission_controller)],
+        reports: Annotated[Optional[List[Literal["32430", "invitro"]]], Query(description=BUNDLE_REPORTS_DESCRIPTION)] = None,
+        start_date: str = "13.11.2025",
+        end_date: str = "13.11.2025",
+        bundle_format: Annotated[BundleFormat, Query(alias="format", description=BUNDLE_FORMAT_DESCRIPTION)] = BundleFormat.XLSX,
+        deadline: Deadline = None,
+) -> Response:
+    # Порядок листов/файлов - порядок в запросе, повторы отбрасываются
+    report_ids = list(dict.fromkeys(reports or list(REPORTS)))
+
+    async def build() -> Tuple[RenderedReport, int]:
+        datasets = await build_bundle(report_ids, start_date, end_date, gateway, deadline)
+        return await render_bundle(datasets, bundle_format), sum(len(dataset.unresolved) for dataset in datasets)
+
+    rendered, unresolved_count = await admission.run(
+        ("bundle", tuple(report_ids), start_date, end_date, bundle_format.value, deadline),
+        _cancellable(gateway, build),
+        is_disconnected=request.is_disconnected,
+        cost=sum(_build_cost(report_id, start_date, end_date) for report_id in report_ids),
+    )
+
+    return _file_response(
+        rendered,
+        BUNDLE_MEDIA_TYPES[bundle_format],
+        {
+            "Content-Disposition": f"attachment; filename=reports_{start_date}-{end_date}.{bundle_format.value}",
+            "X-Unresolved-Lookups": str(unresolved_count),
+        }
+    )
+
 
 @router.get(
     path="/32430",
     description="Список пациентов с услугами по стационару",
     summary="Формирует отчет по услугам оказанным пациентам в стационаре с указанием источника оплаты")
 async def list_patients_with_services(
+        request: Request,
         gateway: Annotated[GatewayService, Depends(get_gateway_service)],
+        admission: Annotated[AdmissionController, Depends(get_admission_controller)],
         start_date: str = "13.11.2025",
-        end_date: str = "13.11.2025"
-)-> StreamingResponse:
-    patients_list = await get_list_patients_with_services(start_date, end_date, gateway)
-    file_stream = generate_excel_from_models(patients_list)
-    filename = f"report_32430_{start_date}-{end_date}.xlsx"
+        end_date: str = "13.11.2025",
+        report_format: Annotated[ReportFormat, Query(alias="format", description=FORMAT_DESCRIPTION)] = ReportFormat.XLSX,
+        deadline: Deadline = None,
+        lpu: Lpu = None,
+) -> Response:
+    filename = f"report_32430_{start_date}-{end_date}"
+    params = _lpu_params(lpu)
 
-    return StreamingResponse(
-        file_stream,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    if report_format != ReportFormat.XLSX:
+        return await _stream_rows(
+            "32430", start_date, end_date, gateway, admission, request, report_format, filename, deadline, params
+        )
+
+    return await _xlsx_response(
+        "32430", start_date, end_date, gateway, admission, request, filename, deadline, params
     )
 
 
@@ -38,17 +581,72 @@ async def list_patients_with_services(
     summary="Формирует отчет по анализам ИНВИТРО с указанием источника оплаты"
 )
 async def get_invitro_report(
+        request: Request,
         gateway: Annotated[GatewayService, Depends(get_gateway_service)],
+        admission: Annotated[AdmissionController, Depends(get_admission_controller)],
         start_date: str = "13.11.2025",
-        end_date: str = "13.11.2025"
-) -> StreamingResponse:
-    # Вызываем сервис, он вернет BytesIO
-    file_stream = await process_invitro_list(start_date, end_date, gateway)
+        end_date: str = "13.11.2025",
+        report_format: Annotated[ReportFormat, Query(alias="format", description=FORMAT_DESCRIPTION)] = ReportFormat.XLSX,
+        deadline: Deadline = None,
+) -> Response:
+    filename = f"invitro_{start_date}-{end_date}"
 
-    filename = f"invitro_{start_date}-{end_date}.xlsx"
+    if report_format != ReportFormat.XLSX:
+        return await _stream_rows(
+            "invitro", start_date, end_date, gateway, admission, request, report_format, filename, deadline
+        )
 
-    return StreamingResponse(
-        file_stream,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    return await _xlsx_response(
+        "invitro", start_date, end_date, gateway, admission, request, filename, deadline
     )
+
+
+@router.get(
+    path="/32430/rows",
+    description="Постраничный просмотр строк отчета 32430 с фильтрацией на сервере",
+    summary="Строки отчета 32430 в JSON",
+    response_model=RowsPage[PatientServiceRow],
+)
+@route_handler(debug=False)
+async def list_patients_with_services_rows(
+        request: Request,
+        gateway: Annotated[GatewayService, Depends(get_gateway_service)],
+        admission: Annotated[AdmissionController, Depends(get_admission_controller)],
+        start_date: str = "13.11.2025",
+        end_date: str = "13.11.2025",
+        department: Optional[str] = None,
+        pay_source: Optional[str] = None,
+        service_code: Optional[str] = None,
+        cursor: Annotated[Optional[str], Query(description=CURSOR_DESCRIPTION)] = None,
+        limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+        deadline: Deadline = None,
+        lpu: Lpu = None,
+):
+    params = _lpu_params(lpu)
+    dataset = await _admitted_dataset("32430", start_date, end_date, gateway, admission, request, deadline, params)
+    filters = {"department": department, "pay_source": pay_source, "service_code": service_code}
+    return paginate_dataset(dataset, filters, cursor, limit)
+
+
+@router.get(
+    path="/invitro/rows",
+    description="Постраничный просмотр строк отчета ИНВИТРО с фильтрацией на сервере",
+    summary="Строки отчета ИНВИТРО в JSON",
+    response_model=RowsPage[InvitroRow],
+)
+@route_handler(debug=False)
+async def get_invitro_rows(
+        request: Request,
+        gateway: Annotated[GatewayService, Depends(get_gateway_service)],
+        admission: Annotated[AdmissionController, Depends(get_admission_controller)],
+        start_date: str = "13.11.2025",
+        end_date: str = "13.11.2025",
+        pay_source: Optional[str] = None,
+        service_code: Optional[str] = None,
+        cursor: Annotated[Optional[str], Query(description=CURSOR_DESCRIPTION)] = None,
+        limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+        deadline: Deadline = None,
+):
+    dataset = await _admitted_dataset("invitro", start_date, end_date, gateway, admission, request, deadline)
+    filters = {"pay_source": pay_source, "service_code": service_code}
+    return paginate_dataset(dataset, filters, cursor, limit)
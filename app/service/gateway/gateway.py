@@ -1,6 +1,15 @@
+import asyncio
+import time
+from typing import Any, AsyncIterator, Optional, Set
+
 import httpx
+from fastapi import HTTPException, status
 from app.core import get_settings
+from app.core.logger_setup import logger
 from app.core.decorators import log_and_catch
+from app.core.deadline import DeadlineExceeded, remaining, within_deadline
+from app.core.profiling import record_gateway_call
+from app.service.gateway.json_stream import JsonArrayDecoder
 from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_exception
 
 
@@ -20,11 +29,47 @@ def is_retryable_exception(exception) -> bool:
     return False
 
 
+def _call_name(kwargs: dict) -> str:
+    """Метод ЕВМИАС (класс.метод) из тела запроса к шлюзу - для сводки профилирования."""
+    params = (kwargs.get("json") or {}).get("params") or {}
+    name = f"{params.get('c', '?')}.{params.get('m', '?')}"
+    if params.get("Report_id"):
+        name += f" ({params['Report_id']})"
+    return name
+
+
 class GatewayService:
     GATEWAY_ENDPOINT = settings.GATEWAY_REQUEST_ENDPOINT
+    STREAM_ATTEMPTS = 5
+    STREAM_RETRY_DELAY = 2
 
     def __init__(self, client: httpx.AsyncClient):
         self._client = client
+        # Задачи, которые сейчас ждут ответа шлюза (включая паузы между повторами)
+        self._pending: Set[asyncio.Task] = set()
+
+    def cancel_pending(self) -> int:
+        """Отменяет все ожидающие запросы к шлюзу этого сервиса. Возвращает их количество."""
+        current = asyncio.current_task()
+        cancelled = 0
+        for task in list(self._pending):
+            if task is not current and not task.done():
+                task.cancel()
+                cancelled += 1
+        return cancelled
+
+    async def make_request(self, method: str, **kwargs) -> dict:
+        task = asyncio.current_task()
+        self._pending.add(task)
+        started, ok = time.perf_counter(), False
+        try:
+            # Запрос (вместе с повторами) не может длиться дольше срока сборки отчета
+            result = await within_deadline(self._make_request(method=method, **kwargs))
+            ok = True
+            return result
+        finally:
+            self._pending.discard(task)
+            record_gateway_call(_call_name(kwargs), time.perf_counter() - started, ok)
 
     @retry(
         stop=stop_after_attempt(5),
@@ -32,7 +77,7 @@ class GatewayService:
         retry=retry_if_exception(is_retryable_exception),  # noqa
     )
     @log_and_catch()
-    async def make_request(self, method: str, **kwargs) -> dict:
+    async def _make_request(self, method: str, **kwargs) -> dict:
         if not hasattr(self._client, method.lower()):
             raise ValueError(f"Неподдерживаемый HTTP метод: {method}")
 
@@ -41,11 +86,34 @@ class GatewayService:
         response.raise_for_status()
         return response.json() if response.content else {}
 
-    @log_and_catch()
+    async def probe(self, timeout: float) -> float:
+        """
+        Один легкий запрос к ЕВМИАС (текущее время сервера) без повторов - для замера задержки шлюза.
+        Возвращает длительность в секундах; ошибку или превышение `timeout` пробрасывает.
+        """
+        started = time.perf_counter()
+        response = await self._client.post(
+            url=self.GATEWAY_ENDPOINT,
+            json={"params": {"c": "Common", "m": "getCurrentDateTime"}, "data": {"is_activerulles": "true"}},
+            timeout=timeout,
+        )
+        response.raise_for_status()
+        return time.perf_counter() - started
+
     async def download(self, url: str, method: str = "POST", **kwargs) -> bytes:
         """
         Метод для скачивания файлов.
         """
+        started, ok = time.perf_counter(), False
+        try:
+            content = await within_deadline(self._download(url, method, **kwargs))
+            ok = True
+            return content
+        finally:
+            record_gateway_call(f"download {_call_name(kwargs)}", time.perf_counter() - started, ok)
+
+    @log_and_catch()
+    async def _download(self, url: str, method: str, **kwargs) -> bytes:
         response = await self._client.request(method=method, url=url, **kwargs)
 
         if response.status_code != 200:
@@ -56,3 +124,91 @@ class GatewayService:
             )
 
         return response.content
+
+    async def _read_list(self, queue: asyncio.Queue, array_key: Optional[str], kwargs: dict):
+        """Читает ответ шлюза кусками и кладет готовые элементы массива в очередь."""
+        for attempt in range(1, self.STREAM_ATTEMPTS + 1):
+            decoder = JsonArrayDecoder(array_key)
+            received = 0
+            try:
+                async with self._client.stream("POST", self.GATEWAY_ENDPOINT, **kwargs) as response:
+                    response.raise_for_status()
+                    async for chunk in response.aiter_bytes():
+                        for item in decoder.feed(chunk):
+                            received += 1
+                            await queue.put(item)
+                        if decoder.done:
+                            break
+
+                if not decoder.found:
+                    logger.warning(f"В ответе шлюза не найден массив '{array_key}'")
+                return
+
+            except httpx.HTTPStatusError as e:
+                # Как в log_and_catch: ответ шлюза с ошибкой отдается клиенту как HTTPException
+                logger.error(f"[INTERNAL] ❌ Ошибка в _read_list при потоковом чтении списка: {e}")
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"Ошибка в _read_list при потоковом запросе POST {self.GATEWAY_ENDPOINT}: {e}",
+                )
+
+            except httpx.RequestError as e:
+                # Повторять можно только пока потребителю ничего не отдано
+                if received or not is_retryable_exception(e) or attempt == self.STREAM_ATTEMPTS:
+                    logger.error(f"[GATEWAY] ❌ Ошибка соединения при потоковом чтении списка: {e}")
+                    raise HTTPException(
+                        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        detail="Не удалось связаться со шлюзом ЕВМИАС. Пожалуйста, проверьте соединение и попробуйте позже.",
+                    )
+                logger.warning(f"[GATEWAY] Повтор потокового запроса ({attempt}/{self.STREAM_ATTEMPTS}): {e}")
+                await asyncio.sleep(self.STREAM_RETRY_DELAY)
+
+    async def stream_list(
+            self,
+            array_key: Optional[str] = "data",
+            prefetch: int = 500,
+            **kwargs
+    ) -> AsyncIterator[Any]:
+        """
+        Потоково отдает элементы массива из ответа шлюза (по умолчанию `data`).
+
+        Элементы декодируются по мере получения тела, поэтому обработку можно
+        начинать до окончания загрузки. Чтение идет в фоне с опережением
+        не более чем на `prefetch` элементов.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=prefetch)
+        done = object()
+
+        async def reader():
+            started = time.perf_counter()
+            try:
+                await self._read_list(queue, array_key, kwargs)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                record_gateway_call(f"stream {_call_name(kwargs)}", time.perf_counter() - started, False)
+                await queue.put(done)
+                raise
+            else:
+                record_gateway_call(f"stream {_call_name(kwargs)}", time.perf_counter() - started, True)
+                await queue.put(done)
+
+        task = asyncio.create_task(reader())
+        try:
+            while True:
+                left = remaining()
+                if left is None:
+                    item = await queue.get()
+                else:
+                    try:
+                        item = await asyncio.wait_for(queue.get(), max(left, 0))
+                    except asyncio.TimeoutError:
+                        raise DeadlineExceeded()
+                if item is done:
+                    break
+                yield item
+            # Пробрасываем ошибку чтения, если она была
+            await task
+        finally:
+            if not task.done():
+                task.cancel()
@@ -0,0 +1,155 @@
+import re
+from typing import Any, List, Optional
+
+import orjson
+
+# Структурные символы JSON, между которыми содержимое можно пропускать целиком
+_STRUCTURAL = re.compile(rb'["{}\[\],]')
+# Конец скалярного элемента массива (число, true/false/null)
+_SCALAR_END = re.compile(rb"[,\]]")
+_WHITESPACE = b" \t\r\n,"
+# Содержимое внутри элемента до ближайшей скобки: строки целиком и любые прочие символы
+_SKIP_TO_BRACKET = re.compile(rb'[^"{}\[\]]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"{}\[\]]*)*', re.DOTALL)
+
+
+class JsonArrayDecoder:
+    """
+    Инкрементальный декодер элементов JSON-массива.
+
+    Принимает тело ответа кусками и возвращает элементы массива, как только они
+    пришли целиком. Массив ищется по ключу верхнего уровня (`{"data": [...]}`),
+    а если ключ не задан - массивом должен быть сам ответ. Каждый элемент
+    декодируется orjson, весь ответ целиком в памяти не собирается.
+    """
+
+    def __init__(self, array_key: Optional[str] = "data"):
+        self._array_key = orjson.dumps(array_key) if array_key is not None else None
+        self._buffer = bytearray()
+        self._pos = 0
+        self._depth = 0
+        self._array_depth: Optional[int] = None
+        self._last_key: Optional[bytes] = None
+        self._item_start: Optional[int] = None
+        self.done = False
+
+    @property
+    def found(self) -> bool:
+        """Был ли найден искомый массив в ответе."""
+        return self._array_depth is not None
+
+    def feed(self, chunk: bytes) -> List[Any]:
+        if self.done:
+            return []
+
+        self._buffer += chunk
+        items = self._scan()
+
+        # Отбрасываем уже разобранную часть буфера
+        cut = self._item_start if self._item_start is not None else self._pos
+        if cut:
+            del self._buffer[:cut]
+            self._pos -= cut
+            if self._item_start is not None:
+                self._item_start = 0
+
+        return items
+
+    def _opens_array(self) -> bool:
+        if self.found:
+            return False
+        if self._array_key is None:
+            return self._depth == 1
+        return self._depth == 2 and self._last_key == self._array_key
+
+    def _emit(self, items: List[Any], end: int):
+        items.append(orjson.loads(bytes(self._buffer[self._item_start:end])))
+        self._item_start = None
+
+    def _scan(self) -> List[Any]:
+        items = []
+        buffer = self._buffer
+
+        while not self.done:
+            if self.found and self._depth == self._array_depth:
+                if self._item_start is None:
+                    # На уровне массива: ищем начало следующего элемента
+                    while self._pos < len(buffer) and buffer[self._pos] in _WHITESPACE:
+                        self._pos += 1
+                    if self._pos >= len(buffer):
+                        break
+                    if buffer[self._pos] == ord("]"):
+                        self.done = True
+                        break
+                    self._item_start = self._pos
+
+                if buffer[self._item_start] not in b'{["':
+                    # Скалярный элемент заканчивается запятой или концом массива
+                    match = _SCALAR_END.search(buffer, self._item_start)
+                    if not match:
+                        break
+                    self._emit(items, match.start())
+                    self._pos = match.start()
+                    continue
+
+            if self.found and self._depth > self._array_depth:
+                # Внутри элемента важны только скобки - пропускаем остальное одним регулярным выражением
+                self._pos = _SKIP_TO_BRACKET.match(buffer, self._pos).end()
+                if self._pos >= len(buffer) or buffer[self._pos] == ord('"'):
+                    # Кусок закончился (возможно, посреди строки) - ждем следующий
+                    break
+
+            match = _STRUCTURAL.search(buffer, self._pos)
+            if not match:
+                self._pos = len(buffer)
+                break
+
+            start = match.start()
+            char = buffer[start]
+
+            if char == ord('"'):
+                end = self._find_string_end(start + 1)
+                if end is None:
+                    # Строка пришла не целиком - ждем следующий кусок
+                    self._pos = start
+                    break
+                self._pos = end + 1
+                if not self.found and self._depth == 1:
+                    self._last_key = bytes(buffer[start:self._pos])
+                elif self._item_start is not None and self._depth == self._array_depth:
+                    # Элемент массива - строка
+                    self._emit(items, self._pos)
+                continue
+
+            self._pos = start + 1
+            if char in b"{[":
+                self._depth += 1
+                if char == ord("[") and self._opens_array():
+                    self._array_depth = self._depth
+            elif char in b"}]":
+                self._depth -= 1
+                if self._item_start is not None and self._depth == self._array_depth:
+                    self._emit(items, self._pos)
+                elif self.found and self._depth < self._array_depth:
+                    self.done = True
+            elif self._depth == 1 and not self.found:
+                # Запятая между парами верхнего уровня
+                self._last_key = None
+
+        return items
+
+    def _find_string_end(self, start: int) -> Optional[int]:
+        buffer = self._buffer
+        pos = start
+        while True:
+            end = buffer.find(b'"', pos)
+            if end == -1:
+                return None
+            # Нечетное число обратных слешей перед кавычкой - кавычка экранирована
+            slashes = 0
+            back = end - 1
+            while back >= start and buffer[back] == ord("\\"):
+                slashes += 1
+                back -= 1
+            if slashes % 2 == 0:
+                return end
+            pos = end + 1
@@ -0,0 +1,287 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from enum import Enum
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Set
+
+import orjson
+
+from app.core import get_settings, logger
+from app.core.metrics import ANALYTICS_INGESTED_ROWS
+from app.service.report.registry import REPORTS
+from app.service.tool.sharding import parse_date
+
+if TYPE_CHECKING:
+    from app.service.report.dataset import ReportDataset
+
+settings = get_settings()
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS service_facts (
+        report_id VARCHAR,
+        lpu_id VARCHAR,
+        service_date DATE,
+        pay_source VARCHAR,
+        department VARCHAR,
+        org_category VARCHAR,
+        service_code VARCHAR,
+        service_name VARCHAR,
+        quantity INTEGER
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS loaded_ranges (
+        report_id VARCHAR,
+        lpu_id VARCHAR,
+        start_date DATE,
+        end_date DATE,
+        rows INTEGER,
+        loaded_at TIMESTAMP
+    )
+    """,
+)
+
+# Колонки фактов в порядке таблицы (кроме report_id) и их типы для чтения NDJSON
+_FACT_COLUMNS = {
+    "lpu_id": "VARCHAR",
+    "service_date": "DATE",
+    "pay_source": "VARCHAR",
+    "department": "VARCHAR",
+    "org_category": "VARCHAR",
+    "service_code": "VARCHAR",
+    "service_name": "VARCHAR",
+    "quantity": "INTEGER",
+}
+
+
+class Dimension(str, Enum):
+    PAY_SOURCE = "pay_source"
+    DEPARTMENT = "department"
+    ORG_CATEGORY = "org_category"
+    SERVICE_CODE = "service_code"
+    SERVICE_NAME = "service_name"
+    LPU = "lpu_id"
+
+
+class Bucket(str, Enum):
+    NONE = "none"
+    DAY = "day"
+    WEEK = "week"
+    MONTH = "month"
+    YEAR = "year"
+
+
+class StoreBusy(RuntimeError):
+    """Файл хранилища открыт на запись другим процессом дольше допустимого."""
+
+
+class AnalyticsStore:
+    """
+    Встроенное колоночное хранилище (DuckDB) с фактами по услугам из собранных отчетов.
+
+    Каждый полный набор строк заменяет в хранилище факты своего отчета и ЛПУ за свой период,
+    поэтому история накапливается по мере построения отчетов за разные периоды.
+    Агрегаты считаются векторно внутри DuckDB. Файл базы открывается на время одной операции:
+    DuckDB не дает нескольким процессам держать его открытым на запись, поэтому воркеры
+    по очереди берут его, а занятый файл ждут до `lock_timeout` секунд.
+    Методы блокирующие - из event loop их нужно вызывать через asyncio.to_thread.
+    """
+
+    def __init__(self, path: str, lock_timeout: float):
+        self.path = path
+        self.lock_timeout = lock_timeout
+        # Внутри процесса операции с файлом идут по одной
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        import duckdb
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            try:
+                connection = duckdb.connect(self.path)
+                break
+            except duckdb.IOException as e:
+                # Файл держит другой воркер
+                if time.monotonic() >= deadline:
+                    raise StoreBusy(f"Аналитическое хранилище занято: {e}") from e
+                time.sleep(0.05)
+
+        for statement in _SCHEMA:
+            connection.execute(statement)
+        return connection
+
+    def ingest(self, report_id: str, facts: List[Dict[str, Any]], scope: Sequence[str], start: date, end: date) -> int:
+        """
+        Заменяет факты отчета `report_id` по ЛПУ `scope` за период [start, end].
+        Факты с датой вне периода не сохраняются - они относятся к другому периоду.
+        """
+        facts = [fact for fact in facts if fact["service_date"] is not None and start <= fact["service_date"] <= end]
+        scope_list = list(scope)
+
+        # Массовая вставка: факты пишутся в NDJSON и читаются DuckDB целиком, без построчных INSERT
+        with tempfile.NamedTemporaryFile("wb", suffix=".ndjson", delete=False) as tmp_file:
+            for fact in facts:
+                tmp_file.write(orjson.dumps(fact))
+                tmp_file.write(b"\n")
+        try:
+            with self._lock:
+                connection = self._connect()
+                try:
+                    connection.execute("BEGIN TRANSACTION")
+                    connection.execute(
+                        "DELETE FROM service_facts WHERE report_id = ? AND list_contains(?, lpu_id) "
+                        "AND service_date BETWEEN ? AND ?",
+                        [report_id, scope_list, start, end],
+                    )
+                    if facts:
+                        connection.execute(
+                            f"INSERT INTO service_facts SELECT ?, {', '.join(_FACT_COLUMNS)} "
+                            f"FROM read_json(?, format = 'newline_delimited', columns = {_FACT_COLUMNS!r})",
+                            [report_id, tmp_file.name],
+                        )
+                    # Периоды, целиком покрытые новой загрузкой, больше не нужны
+                    connection.execute(
+                        "DELETE FROM loaded_ranges WHERE report_id = ? AND list_contains(?, lpu_id) "
+                        "AND start_date >= ? AND end_date <= ?",
+                        [report_id, scope_list, start, end],
+                    )
+                    now = datetime.now()
+                    for lpu_id in scope_list:
+                        rows = sum(1 for fact in facts if fact["lpu_id"] == lpu_id)
+                        connection.execute(
+                            "INSERT INTO loaded_ranges VALUES (?, ?, ?, ?, ?, ?)",
+                            [report_id, lpu_id, start, end, rows, now],
+                        )
+                    connection.execute("COMMIT")
+                except Exception:
+                    connection.execute("ROLLBACK")
+                    raise
+                finally:
+                    connection.close()
+        finally:
+            os.unlink(tmp_file.name)
+        return len(facts)
+
+    def aggregate(
+            self,
+            report_id: str,
+            start: date,
+            end: date,
+            group_by: Sequence[Dimension],
+            bucket: Bucket,
+            lpu_ids: Optional[Sequence[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Количество услуг и сумма их количества за период по измерениям и интервалам дат."""
+        # Имена колонок только из перечислений - подстановка в SQL безопасна
+        columns = [dimension.value for dimension in group_by]
+        if bucket != Bucket.NONE:
+            columns.insert(0, f"date_trunc('{bucket.value}', service_date)::DATE AS period")
+        select = ", ".join([*columns, "count(*) AS services", "sum(quantity) AS quantity"])
+        group = "GROUP BY ALL ORDER BY ALL" if columns else ""
+
+        query = f"SELECT {select} FROM service_facts WHERE report_id = ? AND service_date BETWEEN ? AND ?"
+        parameters: List[Any] = [report_id, start, end]
+        if lpu_ids:
+            query += " AND list_contains(?, lpu_id)"
+            parameters.append(list(lpu_ids))
+
+        with self._lock:
+            connection = self._connect()
+            try:
+                cursor = connection.execute(f"{query} {group}", parameters)
+                names = [column[0] for column in cursor.description]
+                return [dict(zip(names, row)) for row in cursor.fetchall()]
+            finally:
+                connection.close()
+
+    def loaded_ranges(
+            self,
+            report_id: str,
+            start: date,
+            end: date,
+            lpu_ids: Sequence[str],
+    ) -> List[Dict[str, Any]]:
+        """Загрузки, пересекающиеся с периодом [start, end]."""
+        with self._lock:
+            connection = self._connect()
+            try:
+                cursor = connection.execute(
+                    "SELECT lpu_id, start_date, end_date, rows, loaded_at FROM loaded_ranges "
+                    "WHERE report_id = ? AND list_contains(?, lpu_id) AND start_date <= ? AND end_date >= ? "
+                    "ORDER BY lpu_id, start_date",
+                    [report_id, list(lpu_ids), end, start],
+                )
+                names = [column[0] for column in cursor.description]
+                return [dict(zip(names, row)) for row in cursor.fetchall()]
+            finally:
+                connection.close()
+
+
+def missing_ranges(loaded: List[Dict[str, Any]], start: date, end: date, lpu_ids: Sequence[str]) -> List[dict]:
+    """Части периода, за которые в хранилище нет данных (по каждому ЛПУ)."""
+    missing = []
+    for lpu_id in lpu_ids:
+        cursor = start
+        ranges = sorted((r["start_date"], r["end_date"]) for r in loaded if r["lpu_id"] == lpu_id)
+        for range_start, range_end in ranges:
+            if range_start > cursor:
+                missing.append({"lpu_id": lpu_id, "start_date": cursor, "end_date": range_start - timedelta(days=1)})
+            cursor = max(cursor, range_end + timedelta(days=1))
+            if cursor > end:
+                break
+        if cursor <= end:
+            missing.append({"lpu_id": lpu_id, "start_date": cursor, "end_date": end})
+    return missing
+
+
+ANALYTICS = AnalyticsStore(settings.ANALYTICS_DB_PATH, settings.ANALYTICS_LOCK_TIMEOUT)
+
+# Фоновые загрузки в хранилище (ссылки нужны, чтобы задачи не собрал сборщик мусора)
+_INGESTS: Set[asyncio.Task] = set()
+
+
+def _ingest_sync(dataset: "ReportDataset") -> int:
+    projection = REPORTS[dataset.report_id].facts
+    facts = [projection.project(row) for row in dataset.rows]
+    stored = ANALYTICS.ingest(
+        dataset.report_id,
+        facts,
+        projection.scope(dict(dataset.params_key)),
+        parse_date(dataset.start_date),
+        parse_date(dataset.end_date),
+    )
+    ANALYTICS_INGESTED_ROWS.labels(report=dataset.report_id).inc(stored)
+    logger.info(f"Аналитика: отчет {dataset.report_id} за {dataset.start_date}-{dataset.end_date} - "
+                f"сохранено {stored} фактов из {len(facts)} строк")
+    return stored
+
+
+async def ingest_dataset(dataset: "ReportDataset") -> int:
+    """Сохраняет полный набор строк в аналитическое хранилище. Возвращает количество сохраненных фактов."""
+    return await asyncio.to_thread(_ingest_sync, dataset)
+
+
+async def _ingest_in_background(dataset: "ReportDataset"):
+    try:
+        await ingest_dataset(dataset)
+    except Exception as e:
+        logger.error(f"Аналитика: не удалось сохранить отчет {dataset.report_id} "
+                     f"за {dataset.start_date}-{dataset.end_date}: {e}")
+
+
+def schedule_ingest(dataset: "ReportDataset"):
+    """Сохраняет полный набор строк в аналитическое хранилище в фоне, не задерживая выдачу отчета."""
+    if not settings.ANALYTICS_ENABLED or not dataset.complete or REPORTS[dataset.report_id].facts is None:
+        return
+    task = asyncio.create_task(_ingest_in_background(dataset))
+    _INGESTS.add(task)
+    task.add_done_callback(_INGESTS.discard)
@@ -0,0 +1,101 @@
+import asyncio
+import io
+import zipfile
+from enum import Enum
+from typing import List, Optional
+
+from app.core import logger
+from app.core.http_cache import make_etag
+from app.service.gateway.gateway import GatewayService
+from app.service.report.dataset import ARTIFACTS, RenderedReport, ReportDataset, get_dataset
+from app.service.report.engine import fill_sheet, render_workbook
+from app.service.report.registry import REPORTS
+from app.service.tool.tool import add_unresolved_sheet
+
+
+class BundleFormat(str, Enum):
+    XLSX = "xlsx"
+    ZIP = "zip"
+
+
+BUNDLE_MEDIA_TYPES = {
+    BundleFormat.XLSX: "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    BundleFormat.ZIP: "application/zip",
+}
+
+
+async def build_bundle(
+        report_ids: List[str],
+        start_date: str,
+        end_date: str,
+        gateway_service: GatewayService,
+        deadline: Optional[float] = None,
+) -> List[ReportDataset]:
+    """
+    Строит несколько отчетов за один период одним заданием.
+
+    Отчеты собираются параллельно через один GatewayService; наборы строк берутся
+    из общего кеша, поэтому уже собранный отчет в пакет попадает без запросов к ЕВМИАС.
+    """
+    logger.info(f"Сборка пакета отчетов {', '.join(report_ids)} за {start_date}-{end_date}")
+    return list(await asyncio.gather(*(
+        get_dataset(report_id, start_date, end_date, gateway_service, deadline)
+        for report_id in report_ids
+    )))
+
+
+def render_bundle_workbook(datasets: List[ReportDataset]) -> io.BytesIO:
+    """Одна книга Excel: по листу на отчет и общий лист недополученных данных."""
+    from openpyxl import Workbook
+
+    book = Workbook()
+    book.remove(book.active)
+
+    for dataset in datasets:
+        definition = REPORTS[dataset.report_id]
+        fill_sheet(definition, book.create_sheet(definition.title), dataset.rows)
+
+    unresolved = [entry for dataset in datasets for entry in dataset.unresolved]
+    if unresolved:
+        add_unresolved_sheet(book, unresolved)
+
+    output_stream = io.BytesIO()
+    book.save(output_stream)
+    output_stream.seek(0)
+    return output_stream
+
+
+def render_bundle_zip(datasets: List[ReportDataset]) -> io.BytesIO:
+    """Архив с отдельной книгой Excel на каждый отчет."""
+    output_stream = io.BytesIO()
+    # xlsx уже сжат - повторно не сжимаем
+    with zipfile.ZipFile(output_stream, "w", compression=zipfile.ZIP_STORED) as archive:
+        for dataset in datasets:
+            definition = REPORTS[dataset.report_id]
+            content = render_workbook(definition, dataset.rows, dataset.unresolved)
+            archive.writestr(f"{definition.filename}_{dataset.start_date}-{dataset.end_date}.xlsx", content.getvalue())
+
+    output_stream.seek(0)
+    return output_stream
+
+
+def _render_bundle_sync(datasets: List[ReportDataset], bundle_format: BundleFormat) -> RenderedReport:
+    built_at = max(dataset.built_at for dataset in datasets)
+    key = ("bundle", bundle_format.value, tuple((dataset.key, dataset.version) for dataset in datasets))
+    complete = all(dataset.complete for dataset in datasets)
+    # ETag - по версиям наборов: в книгах и архиве записано время их создания
+    etag = make_etag(*key)
+
+    artifact = ARTIFACTS.get(key) if complete else None
+    if artifact is None:
+        render = render_bundle_workbook if bundle_format == BundleFormat.XLSX else render_bundle_zip
+        content = render(datasets).getvalue()
+        if not complete:
+            return RenderedReport(etag, built_at, content=content)
+        artifact = ARTIFACTS.put(key, content, f".{bundle_format.value}", modified=built_at, etag=etag)
+    return RenderedReport(artifact.etag, artifact.last_modified, path=artifact.path)
+
+
+async def render_bundle(datasets: List[ReportDataset], bundle_format: BundleFormat) -> RenderedReport:
+    """Файл пакета; полный пакет сохраняется в хранилище файлов и отдается с диска."""
+    return await asyncio.to_thread(_render_bundle_sync, datasets, bundle_format)
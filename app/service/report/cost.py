@@ -0,0 +1,171 @@
+import math
+import os
+import tempfile
+import threading
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional
+
+import orjson
+
+from app.core import get_settings, logger
+from app.core.profiling import GatewayCallStats
+from app.service.report.registry import REPORTS
+from app.service.tool.sharding import parse_date
+
+settings = get_settings()
+
+# Вес нового наблюдения в скользящем среднем
+_ALPHA = 0.3
+
+
+@dataclass
+class CostProfile:
+    """
+    История сборок отчета: строк в день на одно ЛПУ, справочных запросов на строку
+    и среднее время одного запроса к шлюзу с учетом параллельности сборки.
+    Начальные значения - грубая оценка до первых сборок.
+    """
+    rows_per_day: float = 100.0
+    lookups_per_row: float = 1.0
+    seconds_per_call: float = 0.05
+    builds: int = 0
+    # Сборки со сводкой запросов к шлюзу: только они уточняют lookups_per_row и seconds_per_call
+    # (потоковая выгрузка сводки не дает), первая из них заменяет начальные значения
+    call_builds: int = 0
+
+
+@dataclass(frozen=True)
+class BuildEstimate:
+    report_id: str
+    days: int
+    # ЛПУ (или другие части источника), которые запрашиваются отдельно
+    units: int
+    rows: int
+    gateway_calls: int
+    seconds: float
+    # Сколько сборок отчета легло в оценку (0 - оценка по умолчанию)
+    history: int
+
+    @property
+    def cost(self) -> float:
+        """Стоимость сборки для очереди - ожидаемая длительность в секундах."""
+        return self.seconds
+
+
+def _ewma(current: float, observed: float, first: bool) -> float:
+    return observed if first else current + _ALPHA * (observed - current)
+
+
+class CostModel:
+    """
+    Оценка стоимости сборки отчета по истории: длина периода, строки в день и справочные запросы на строку.
+
+    После каждой полной сборки профиль отчета обновляется скользящим средним и сохраняется
+    в `path` (JSON), чтобы оценки переживали перезапуск. Воркеры пишут файл независимо -
+    последняя запись побеждает, для оценки этого достаточно.
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self._profiles: Dict[str, CostProfile] = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as history:
+                data = orjson.loads(history.read())
+            self._profiles = {report_id: CostProfile(**profile) for report_id, profile in data.items()}
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning(f"История стоимости сборок не загружена: {e}")
+
+    def _save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            data = orjson.dumps({report_id: asdict(profile) for report_id, profile in self._profiles.items()})
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def profile(self, report_id: str) -> CostProfile:
+        return self._profiles.get(report_id) or CostProfile()
+
+    @staticmethod
+    def _units(report_id: str, params: Optional[Dict[str, Any]]) -> int:
+        facts = REPORTS[report_id].facts
+        return len(facts.scope(params or {})) if facts is not None else 1
+
+    def estimate(
+            self,
+            report_id: str,
+            start_date: str,
+            end_date: str,
+            params: Optional[Dict[str, Any]] = None,
+    ) -> BuildEstimate:
+        """Оценка сборки за период. Некорректный период - ValueError."""
+        start, end = parse_date(start_date), parse_date(end_date)
+        if start > end:
+            raise ValueError(f"Дата начала {start_date} позже даты окончания {end_date}")
+        days = (end - start).days + 1
+        units = self._units(report_id, params)
+        profile = self.profile(report_id)
+
+        rows = days * units * profile.rows_per_day
+        shard_days = settings.REPORT_SHARD_DAYS if settings.REPORT_SHARD_DAYS > 0 else days
+        list_calls = math.ceil(days / shard_days) * units
+        calls = list_calls + rows * profile.lookups_per_row
+        return BuildEstimate(
+            report_id=report_id,
+            days=days,
+            units=units,
+            rows=round(rows),
+            gateway_calls=round(calls),
+            seconds=round(calls * profile.seconds_per_call, 2),
+            history=profile.builds,
+        )
+
+    def observe(
+            self,
+            report_id: str,
+            start_date: str,
+            end_date: str,
+            params: Optional[Dict[str, Any]],
+            rows: int,
+            seconds: float,
+            calls: Optional[GatewayCallStats] = None,
+    ):
+        """
+        Учитывает завершенную полную сборку. Без сводки запросов к шлюзу (потоковая выгрузка)
+        обновляется только число строк в день.
+        """
+        days = (parse_date(end_date) - parse_date(start_date)).days + 1
+        units = self._units(report_id, params)
+        with self._lock:
+            profile = self._profiles.setdefault(report_id, CostProfile())
+            profile.rows_per_day = _ewma(profile.rows_per_day, rows / (days * units), profile.builds == 0)
+            if calls is not None:
+                first_calls = profile.call_builds == 0
+                list_calls = calls.count(lambda name: name.startswith("stream "))
+                lookups = calls.count() - list_calls
+                if rows:
+                    profile.lookups_per_row = _ewma(profile.lookups_per_row, lookups / rows, first_calls)
+                if list_calls + lookups:
+                    profile.seconds_per_call = _ewma(profile.seconds_per_call, seconds / (list_calls + lookups), first_calls)
+                profile.call_builds += 1
+            profile.builds += 1
+        try:
+            self._save()
+        except OSError as e:
+            logger.warning(f"История стоимости сборок не сохранена: {e}")
+
+
+BUILD_COSTS = CostModel(settings.REPORT_COST_HISTORY_PATH)
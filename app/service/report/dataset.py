@@ -0,0 +1,462 @@
+import asyncio
+import base64
+import json
+import os
+import pickle
+import time
+from contextlib import aclosing, nullcontext
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import cached_property
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from app.core import get_settings, logger
+from app.core.artifacts import ArtifactStore
+from app.core.cache import CacheKeyInfo, TTLCache
+from app.core.cache_control import ExternalCache, InvalidationRule, register_external_cache
+from app.core.deadline import deadline_scope, iter_within_deadline
+from app.core.decorators import log_and_catch
+from app.core.http_cache import ValidatorIndex, make_etag
+from app.core.lease import LeaseStore
+from app.core.profiling import GatewayCallStats, gateway_call_scope
+from app.service.gateway.gateway import GatewayService
+from app.service.report.analytics import schedule_ingest
+from app.service.report.cost import BUILD_COSTS
+from app.service.report.delta import content_version, schedule_snapshot
+from app.service.report.engine import iter_report_rows, render_workbook
+from app.service.report.registry import REPORTS
+from app.service.tool.sharding import parse_date
+
+settings = get_settings()
+
+def _describe_dataset_key(key: tuple) -> Optional[CacheKeyInfo]:
+    report_id, start_date, end_date, _ = key
+    try:
+        return CacheKeyInfo(report_id, parse_date(start_date), parse_date(end_date))
+    except ValueError:
+        return CacheKeyInfo(report_id)
+
+
+DATASET_CACHE = TTLCache(
+    name="report_datasets",
+    maxsize=settings.DATASET_CACHE_SIZE,
+    ttl=settings.DATASET_CACHE_TTL,
+    describe=_describe_dataset_key,
+)
+
+# Неполные наборы по ключу набора и сроку сборки: курсоры страниц остаются действительными
+PARTIAL_DATASETS = TTLCache(
+    name="partial_datasets",
+    maxsize=settings.DATASET_CACHE_SIZE,
+    ttl=settings.PARTIAL_DATASET_TTL,
+    describe=lambda key: _describe_dataset_key(key[0]),
+)
+
+
+@dataclass
+class ReportDataset:
+    report_id: str
+    start_date: str
+    end_date: str
+    rows: List[BaseModel]
+    built_at: datetime = field(default_factory=datetime.now)
+    # Данные, которые не успели получить до срока сборки (пусто - набор полный)
+    unresolved: List[Dict[str, str]] = field(default_factory=list)
+    # Дополнительные параметры источника (см. _dataset_key)
+    params_key: tuple = ()
+
+    @property
+    def complete(self) -> bool:
+        return not self.unresolved
+
+    @property
+    def key(self) -> tuple:
+        return self.report_id, self.start_date, self.end_date, self.params_key
+
+    @cached_property
+    def version(self) -> str:
+        # Версия по содержимому: пересборка с теми же данными ее не меняет
+        return content_version(self.rows, self.unresolved)
+
+    def etag(self, report_format: str) -> str:
+        """ETag выгрузки набора в формате `report_format`: одинаков во всех воркерах и после пересборки."""
+        return make_etag(*self.key, report_format, self.version)
+
+
+async def _new_dataset(
+        report_id: str,
+        start_date: str,
+        end_date: str,
+        rows: List[BaseModel],
+        unresolved: List[Dict[str, str]],
+        params: Optional[Dict[str, Any]],
+) -> ReportDataset:
+    dataset = ReportDataset(report_id, start_date, end_date, rows, unresolved=unresolved, params_key=_params_key(params))
+    # Версия - хеш всех строк: считаем в потоке, чтобы не задерживать event loop
+    await asyncio.to_thread(lambda: dataset.version)
+    return dataset
+
+
+@dataclass
+class RenderedReport:
+    """
+    Готовая книга Excel по набору строк и валидаторы для условных запросов.
+    Книга по полному набору лежит в хранилище файлов (`path`), по неполному - только в памяти (`content`).
+    """
+    etag: str
+    last_modified: datetime
+    path: Optional[Path] = None
+    content: Optional[bytes] = None
+
+
+ARTIFACTS = ArtifactStore(settings.ARTIFACT_DIR, settings.ARTIFACT_MAX_MB * 2 ** 20)
+
+# Файлы привязаны к версии (содержимому) набора строк: книгу по устаревшим данным после инвалидации
+# больше никто не запросит и она уйдет по LRU, поэтому удаляются сразу только при полной очистке
+register_external_cache("artifacts", ExternalCache(
+    stats=ARTIFACTS.stats,
+    invalidate=lambda rule: ARTIFACTS.clear() if rule.is_total else 0,
+))
+
+# ETag отданных полных отчетов за прошедший период по ключу (отчет, период, параметры, формат)
+VALIDATORS = ValidatorIndex(
+    settings.REPORT_VALIDATOR_DIR,
+    settings.REPORT_VALIDATOR_TTL,
+    describe=lambda key: _describe_dataset_key(key[:4]),
+)
+register_external_cache("validators", ExternalCache(
+    stats=VALIDATORS.stats,
+    invalidate=lambda rule: VALIDATORS.invalidate(lambda key: rule.matches(VALIDATORS, key)),
+    covers=(DATASET_CACHE.name,),
+))
+
+# Полные наборы строк, общие для воркеров: одинаковую сборку выполняет один воркер (аренда в BUILD_LEASES),
+# остальные дожидаются ее и берут набор отсюда
+SHARED_DATASETS = ArtifactStore(
+    os.path.join(settings.SINGLE_FLIGHT_DIR, "datasets"), settings.SHARED_DATASET_MAX_MB * 2 ** 20
+)
+BUILD_LEASES = LeaseStore(
+    os.path.join(settings.SINGLE_FLIGHT_DIR, "leases"), settings.SINGLE_FLIGHT_LEASE_TTL, settings.SINGLE_FLIGHT_POLL
+)
+
+# Правила инвалидации, примененные в этом воркере, и когда: общий набор, собранный раньше
+# подходящего правила, больше не используется. Старше DATASET_CACHE_TTL хранить не нужно
+_SHARED_INVALIDATIONS: List[Tuple[datetime, InvalidationRule]] = []
+
+
+def _invalidate_shared(rule: InvalidationRule) -> int:
+    if rule.is_total:
+        return SHARED_DATASETS.clear()
+    now = datetime.now()
+    _SHARED_INVALIDATIONS[:] = [
+        (applied_at, applied) for applied_at, applied in _SHARED_INVALIDATIONS
+        if (now - applied_at).total_seconds() <= settings.DATASET_CACHE_TTL
+    ]
+    _SHARED_INVALIDATIONS.append((now, rule))
+    return 0
+
+
+register_external_cache("shared_datasets", ExternalCache(
+    stats=SHARED_DATASETS.stats,
+    invalidate=_invalidate_shared,
+    covers=(DATASET_CACHE.name,),
+))
+
+
+def _load_shared_sync(key: tuple) -> Optional[ReportDataset]:
+    artifact = SHARED_DATASETS.get(key)
+    if artifact is None:
+        return None
+    if (datetime.now() - artifact.last_modified).total_seconds() > settings.DATASET_CACHE_TTL:
+        return None
+    if any(applied_at >= artifact.last_modified and rule.matches(DATASET_CACHE, key)
+           for applied_at, rule in list(_SHARED_INVALIDATIONS)):
+        return None
+    try:
+        with open(artifact.path, "rb") as shared_file:
+            return pickle.load(shared_file)
+    except FileNotFoundError:
+        # Файл только что вытеснен
+        return None
+
+
+async def _load_shared(key: tuple) -> Optional[ReportDataset]:
+    """Полный набор строк, собранный другим воркером (или этим до перезапуска), если он еще актуален."""
+    if not settings.SINGLE_FLIGHT_ENABLED:
+        return None
+    return await asyncio.to_thread(_load_shared_sync, key)
+
+
+async def _share(dataset: ReportDataset):
+    """Сохраняет полный набор строк для остальных воркеров. Время изменения файла - время сборки набора."""
+    if not settings.SINGLE_FLIGHT_ENABLED or not dataset.complete:
+        return
+    content = await asyncio.to_thread(pickle.dumps, dataset, pickle.HIGHEST_PROTOCOL)
+    await asyncio.to_thread(SHARED_DATASETS.put, dataset.key, content, ".pickle", dataset.built_at)
+
+
+def _params_key(params: Optional[Dict[str, Any]]) -> tuple:
+    return tuple(sorted((params or {}).items()))
+
+
+def _dataset_key(report_id: str, start_date: str, end_date: str, params: Optional[Dict[str, Any]] = None) -> tuple:
+    return report_id, start_date, end_date, _params_key(params)
+
+
+def peek_dataset(
+        report_id: str,
+        start_date: str,
+        end_date: str,
+        params: Optional[Dict[str, Any]] = None,
+) -> Optional[ReportDataset]:
+    """Возвращает набор строк, только если он уже есть в кеше."""
+    return DATASET_CACHE.get(_dataset_key(report_id, start_date, end_date, params))
+
+
+async def _observe_cost(
+        dataset: ReportDataset,
+        params: Optional[Dict[str, Any]],
+        seconds: float,
+        calls: Optional[GatewayCallStats] = None,
+):
+    """Обновляет историю стоимости сборок (оценки для очереди). Ошибка не мешает выдаче отчета."""
+    try:
+        await asyncio.to_thread(
+            BUILD_COSTS.observe, dataset.report_id, dataset.start_date, dataset.end_date, params,
+            len(dataset.rows), seconds, calls,
+        )
+    except Exception as e:
+        logger.warning(f"Стоимость сборки отчета {dataset.report_id} не учтена: {e}")
+
+
+async def get_dataset(
+        report_id: str,
+        start_date: str,
+        end_date: str,
+        gateway_service: GatewayService,
+        deadline: Optional[float] = None,
+        params: Optional[Dict[str, Any]] = None,
+) -> ReportDataset:
+    """
+    Возвращает обогащенные строки отчета из кеша или строит их через ЕВМИАС.
+
+    `params` - дополнительные параметры источника, входят в ключ кеша.
+    Если задан `deadline` (секунды), сборка ограничена этим сроком: недополученные
+    значения помечаются, а неполный набор возвращается и недолго (PARTIAL_DATASET_TTL)
+    хранится отдельно от полных по ключу со сроком, чтобы следующие страницы шли из него.
+    """
+    definition = REPORTS[report_id]
+    key = _dataset_key(report_id, start_date, end_date, params)
+
+    @log_and_catch()
+    async def build() -> ReportDataset:
+        logger.info(f"Построение набора строк отчета {report_id} за {start_date}-{end_date}")
+        unresolved = []
+        calls = GatewayCallStats()
+        started = time.perf_counter()
+        with deadline_scope(deadline, unresolved), gateway_call_scope(calls):
+            # aclosing: при отмене сборки источник сразу останавливает свои фоновые загрузки
+            rows_source = iter_report_rows(definition, start_date, end_date, gateway_service, **(params or {}))
+            async with aclosing(rows_source) as rows_iter:
+                rows = [row async for row in rows_iter]
+        if unresolved:
+            logger.warning(f"Отчет {report_id} за {start_date}-{end_date} собран не полностью: "
+                           f"истек срок {deadline} с, не получено значений: {len(unresolved)}")
+        dataset = await _new_dataset(report_id, start_date, end_date, rows, unresolved, params)
+        schedule_ingest(dataset)
+        schedule_snapshot(dataset)
+        if dataset.complete:
+            await _observe_cost(dataset, params, time.perf_counter() - started, calls)
+        return dataset
+
+    async def build_once() -> ReportDataset:
+        # Одинаковую сборку в других воркерах ждем, а не повторяем
+        if not settings.SINGLE_FLIGHT_ENABLED:
+            return await build()
+
+        async def build_and_share() -> ReportDataset:
+            dataset = await build()
+            await _share(dataset)
+            return dataset
+
+        return await BUILD_LEASES.run(key, lambda: _load_shared(key), build_and_share)
+
+    if deadline is None:
+        return await DATASET_CACHE.get_or_create(key, build_once)
+
+    dataset = DATASET_CACHE.get(key) or PARTIAL_DATASETS.get((key, deadline))
+    if dataset is None:
+        dataset = await build()
+        if dataset.complete:
+            DATASET_CACHE.set(key, dataset)
+        else:
+            PARTIAL_DATASETS.set((key, deadline), dataset)
+    return dataset
+
+
+async def iter_dataset_rows(
+        report_id: str,
+        start_date: str,
+        end_date: str,
+        gateway_service: GatewayService,
+        deadline: Optional[float] = None,
+        params: Optional[Dict[str, Any]] = None,
+) -> AsyncIterator[BaseModel]:
+    """
+    Отдает строки отчета потоком. Если набор уже в кеше - берет его оттуда,
+    иначе отдает строки по мере обогащения и кладет полный набор в кеш.
+    """
+    key = _dataset_key(report_id, start_date, end_date, params)
+    dataset = DATASET_CACHE.get(key)
+    if dataset is None and deadline is None:
+        dataset = await _load_shared(key)
+        if dataset is not None:
+            DATASET_CACHE.set(key, dataset)
+    if dataset is not None:
+        for row in dataset.rows:
+            yield row
+        return
+
+    lease = None
+    if settings.SINGLE_FLIGHT_ENABLED and deadline is None:
+        lease = await BUILD_LEASES.try_acquire_async(key)
+        if lease is None:
+            # Этот набор уже строит другой воркер - ждем его результат вместо повторной сборки
+            dataset = await get_dataset(report_id, start_date, end_date, gateway_service, params=params)
+            for row in dataset.rows:
+                yield row
+            return
+
+    async with (BUILD_LEASES.hold(lease) if lease is not None else nullcontext()):
+        rows_source = _stream_build(key, report_id, start_date, end_date, gateway_service, deadline, params)
+        async with aclosing(rows_source) as rows_iter:
+            async for row in rows_iter:
+                yield row
+
+
+async def _stream_build(
+        key: tuple,
+        report_id: str,
+        start_date: str,
+        end_date: str,
+        gateway_service: GatewayService,
+        deadline: Optional[float],
+        params: Optional[Dict[str, Any]],
+) -> AsyncIterator[BaseModel]:
+    """Строит набор, отдавая строки по мере обогащения; полный набор кладет в кеш и в общее хранилище."""
+    rows = []
+    unresolved = []
+    started = time.perf_counter()
+
+    def source() -> AsyncIterator[BaseModel]:
+        return iter_report_rows(REPORTS[report_id], start_date, end_date, gateway_service, **(params or {}))
+
+    rows_source = source() if deadline is None else iter_within_deadline(source, deadline, unresolved)
+
+    async with aclosing(rows_source) as rows_iter:
+        async for row in rows_iter:
+            rows.append(row)
+            yield row
+
+    if not unresolved:
+        dataset = await _new_dataset(report_id, start_date, end_date, rows, unresolved, params)
+        DATASET_CACHE.set(key, dataset)
+        schedule_ingest(dataset)
+        schedule_snapshot(dataset)
+        await _share(dataset)
+        await _observe_cost(dataset, params, time.perf_counter() - started)
+
+
+async def peek_rendered(dataset: ReportDataset) -> Optional[RenderedReport]:
+    """Готовая книга по этой версии набора строк, если она уже была построена."""
+    artifact = await asyncio.to_thread(ARTIFACTS.get, (dataset.key, dataset.version))
+    if artifact is None:
+        return None
+    return RenderedReport(artifact.etag, artifact.last_modified, path=artifact.path)
+
+
+def _render_sync(dataset: ReportDataset) -> RenderedReport:
+    definition = REPORTS[dataset.report_id].for_params(dict(dataset.params_key))
+    content = render_workbook(definition, dataset.rows, dataset.unresolved).getvalue()
+    # ETag - по версии набора, а не по байтам книги: openpyxl записывает в файл время сохранения
+    etag = dataset.etag("xlsx")
+    if not dataset.complete:
+        return RenderedReport(etag, dataset.built_at, content=content)
+
+    # Полную книгу отдаем с диска: память воркера не держится, пока медленный клиент ее скачивает
+    artifact = ARTIFACTS.put((dataset.key, dataset.version), content, ".xlsx", modified=dataset.built_at, etag=etag)
+    return RenderedReport(artifact.etag, artifact.last_modified, path=artifact.path)
+
+
+async def render_dataset(dataset: ReportDataset) -> RenderedReport:
+    """
+    Строит книгу Excel по набору строк (в потоке, чтобы не блокировать event loop).
+    Книга по полному набору сохраняется в хранилище файлов: повторная выдача и ETag не требуют пересборки.
+    """
+    rendered = await peek_rendered(dataset)
+    if rendered is not None:
+        return rendered
+    if not settings.SINGLE_FLIGHT_ENABLED or not dataset.complete:
+        return await asyncio.to_thread(_render_sync, dataset)
+
+    # Набор из общего хранилища имеет ту же версию во всех воркерах - книгу по нему строит один из них
+    return await BUILD_LEASES.run(
+        ("xlsx", dataset.key, dataset.version),
+        lambda: peek_rendered(dataset),
+        lambda: asyncio.to_thread(_render_sync, dataset),
+    )
+
+
+def _encode_cursor(offset: int, version: str) -> str:
+    raw = json.dumps({"o": offset, "v": version}).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def _decode_cursor(cursor: str, version: str) -> int:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        offset = int(data["o"])
+    except Exception:
+        raise ValueError("Некорректный курсор")
+
+    if data.get("v") != version:
+        raise ValueError("Курсор устарел: набор данных был перестроен, начните с первой страницы")
+
+    return offset
+
+
+def paginate_dataset(
+        dataset: ReportDataset,
+        filters: Dict[str, Optional[str]],
+        cursor: Optional[str],
+        limit: int
+) -> dict:
+    """Фильтрует строки набора и возвращает страницу с курсором на следующую."""
+    supported = REPORTS[dataset.report_id].filters
+    active = {}
+    for name, value in filters.items():
+        if value is None:
+            continue
+        if name not in supported:
+            raise ValueError(f"Фильтр '{name}' не поддерживается отчетом {dataset.report_id}")
+        active[supported[name]] = value.strip().casefold()
+
+    rows = [
+        row for row in dataset.rows
+        if all(str(getattr(row, attr) or "").casefold() == value for attr, value in active.items())
+    ]
+
+    offset = _decode_cursor(cursor, dataset.version) if cursor else 0
+    items = rows[offset:offset + limit]
+    next_offset = offset + len(items)
+
+    return {
+        "items": items,
+        "total": len(rows),
+        "next_cursor": _encode_cursor(next_offset, dataset.version) if next_offset < len(rows) else None,
+        "built_at": dataset.built_at,
+        "unresolved": dataset.unresolved,
+    }
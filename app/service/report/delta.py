@@ -0,0 +1,315 @@
+import asyncio
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Set, Tuple
+
+import orjson
+from pydantic import BaseModel
+
+from app.core import get_settings, logger
+from app.service.report.engine import Column, Highlight, ReportDefinition, render_workbook
+from app.service.report.registry import REPORTS
+
+if TYPE_CHECKING:
+    from app.service.report.dataset import ReportDataset
+
+settings = get_settings()
+
+ADDED, REMOVED, CHANGED = "added", "removed", "changed"
+CHANGE_TITLES = {ADDED: "Добавлена", REMOVED: "Удалена", CHANGED: "Изменена"}
+CHANGE_COLORS = {ADDED: "E2EFDA", REMOVED: "F8CBAD", CHANGED: "DDEBF7"}
+
+
+def _digest(value: Any) -> str:
+    return hashlib.blake2b(orjson.dumps(value, option=orjson.OPT_SORT_KEYS), digest_size=12).hexdigest()
+
+
+def content_version(rows: List[BaseModel], unresolved: List[Dict[str, str]]) -> str:
+    """
+    Версия набора строк по содержимому: хеш отпечатков всех строк по порядку и недополученных значений.
+    Одинаковые данные дают одну версию и после пересборки (ETag, курсоры страниц, файлы книг).
+    """
+    version = hashlib.blake2b(digest_size=12)
+    for row in rows:
+        version.update(bytes.fromhex(_digest(row.model_dump(mode="json"))))
+    version.update(orjson.dumps(unresolved, option=orjson.OPT_SORT_KEYS))
+    return version.hexdigest()
+
+
+def snapshot_id(dataset: "ReportDataset") -> str:
+    """Идентификатор снимка - время сборки набора: снимки периода упорядочены по времени."""
+    return dataset.built_at.strftime("%Y%m%d%H%M%S%f")
+
+
+def fingerprint_rows(definition: ReportDefinition, rows: List[BaseModel]) -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+    """
+    Идентификатор, отпечаток и значения каждой строки. Идентификатор - по ключу строки
+    (`definition.identity`) и номеру ее повтора в наборе, отпечаток - по всем полям.
+    """
+    seen: Dict[str, int] = {}
+    for row in rows:
+        data = row.model_dump(mode="json")
+        identity = _digest([str(part) if part is not None else None for part in definition.identity(row)])
+        occurrence = seen[identity] = seen.get(identity, -1) + 1
+        yield f"{identity}:{occurrence}", _digest(data), data
+
+
+def _round_trips(definition: ReportDefinition, row: BaseModel) -> bool:
+    """Строка восстанавливается из своих JSON-значений без потерь (так ее читает `diff`)."""
+    data = row.model_dump(mode="json")
+    return definition.row_model.model_validate(data).model_dump(mode="json") == data
+
+
+@dataclass(frozen=True)
+class SnapshotInfo:
+    id: str
+    built_at: datetime
+    rows: int
+
+
+@dataclass
+class Snapshot:
+    info: SnapshotInfo
+    # идентификатор строки -> (отпечаток, значения)
+    rows: Dict[str, Tuple[str, Dict[str, Any]]]
+
+
+class SnapshotStore:
+    """
+    Снимки прогонов отчета на диске: по каждой строке полного набора - идентификатор, отпечаток и значения.
+
+    Снимки хранятся отдельно для каждого отчета, периода и параметров источника
+    (gzip NDJSON, первая строка - заголовок), идентификатор снимка - время сборки набора строк.
+    Для каждого периода хранятся последние `keep` снимков.
+    Методы блокирующие - из event loop их нужно вызывать через asyncio.to_thread.
+    """
+
+    def __init__(self, directory: str, keep: int):
+        self.directory = Path(directory)
+        self.keep = keep
+
+    def _scope_dir(self, report_id: str, start_date: str, end_date: str, params_key: tuple) -> Path:
+        return self.directory / report_id / _digest([start_date, end_date, repr(params_key)])
+
+    def save(self, dataset: "ReportDataset") -> bool:
+        """Сохраняет снимок полного набора. False - снимок этой сборки уже есть."""
+        scope_dir = self._scope_dir(dataset.report_id, dataset.start_date, dataset.end_date, dataset.params_key)
+        path = scope_dir / f"{snapshot_id(dataset)}.ndjson.gz"
+        if path.exists():
+            return False
+        definition = REPORTS[dataset.report_id]
+        if dataset.rows and not _round_trips(definition, dataset.rows[0]):
+            # Из снимка строки восстанавливаются моделью: значения, которые она не читает обратно,
+            # в разнице пропали бы, поэтому такой снимок лучше не сохранять вовсе
+            logger.error(f"Снимок отчета {dataset.report_id} не сохранен: строка {definition.row_model.__name__} "
+                         f"не восстанавливается из JSON без потерь")
+            return False
+        scope_dir.mkdir(parents=True, exist_ok=True)
+
+        header = {"id": snapshot_id(dataset), "built_at": dataset.built_at.isoformat(), "rows": len(dataset.rows)}
+        fd, tmp_path = tempfile.mkstemp(dir=scope_dir, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file, gzip.GzipFile(fileobj=tmp_file, mode="wb") as snapshot:
+                snapshot.write(orjson.dumps(header) + b"\n")
+                for row_id, fingerprint, data in fingerprint_rows(definition, dataset.rows):
+                    snapshot.write(orjson.dumps([row_id, fingerprint, data]) + b"\n")
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+        for stale in sorted(scope_dir.glob("*.ndjson.gz"))[:-self.keep]:
+            stale.unlink(missing_ok=True)
+        return True
+
+    def list(self, report_id: str, start_date: str, end_date: str, params_key: tuple) -> List[SnapshotInfo]:
+        """Снимки периода, от старых к новым."""
+        infos = []
+        for path in sorted(self._scope_dir(report_id, start_date, end_date, params_key).glob("*.ndjson.gz")):
+            try:
+                with gzip.open(path, "rb") as snapshot:
+                    header = orjson.loads(snapshot.readline())
+            except (OSError, ValueError) as e:
+                logger.warning(f"Снимок {path} пропущен: {e}")
+                continue
+            infos.append(SnapshotInfo(header["id"], datetime.fromisoformat(header["built_at"]), header["rows"]))
+        return infos
+
+    def load(self, report_id: str, start_date: str, end_date: str, params_key: tuple, snapshot_id: str) -> Optional[Snapshot]:
+        # Идентификатор приходит из запроса: в путь попадают только идентификаторы снимков (цифры)
+        if not snapshot_id.isdigit():
+            return None
+        path = self._scope_dir(report_id, start_date, end_date, params_key) / f"{snapshot_id}.ndjson.gz"
+        try:
+            with gzip.open(path, "rb") as snapshot:
+                header = orjson.loads(snapshot.readline())
+                rows = {}
+                for line in snapshot:
+                    row_id, fingerprint, data = orjson.loads(line)
+                    rows[row_id] = (fingerprint, data)
+        except FileNotFoundError:
+            return None
+        info = SnapshotInfo(header["id"], datetime.fromisoformat(header["built_at"]), header["rows"])
+        return Snapshot(info, rows)
+
+    def clear(self) -> int:
+        removed = sum(1 for _ in self.directory.rglob("*.ndjson.gz")) if self.directory.exists() else 0
+        shutil.rmtree(self.directory, ignore_errors=True)
+        return removed
+
+
+@dataclass
+class DeltaRow:
+    """Строка разницы: изменение, строка (для удаленной - прежняя) и изменившиеся колонки."""
+    change: str
+    row: BaseModel
+    previous: Optional[BaseModel] = None
+    changed_fields: List[str] = field(default_factory=list)
+
+    @property
+    def change_title(self) -> str:
+        return CHANGE_TITLES[self.change]
+
+    @property
+    def changed_titles(self) -> str:
+        return ", ".join(self.changed_fields)
+
+    def __getattr__(self, name: str) -> Any:
+        # Колонки, подсветка и группировка по листам берутся из самой строки отчета
+        return getattr(self.row, name)
+
+    def model_dump(self, mode: str = "json") -> Dict[str, Any]:
+        # Как у строк отчета: строки разницы отдаются теми же потоковыми выгрузками
+        return {
+            "change": self.change,
+            "row": self.row.model_dump(mode=mode),
+            "previous": self.previous.model_dump(mode=mode) if self.previous is not None else None,
+            "changed_fields": self.changed_fields,
+        }
+
+
+@dataclass(frozen=True)
+class Delta:
+    since: SnapshotInfo
+    until: SnapshotInfo
+    rows: List[DeltaRow]
+
+    def count(self, change: str) -> int:
+        return sum(1 for row in self.rows if row.change == change)
+
+
+def diff(definition: ReportDefinition, since: Snapshot, until: Snapshot) -> Delta:
+    """Строки `until`, которых не было в `since` или которые изменились, и строки `since`, которых больше нет."""
+    model = definition.row_model
+    titles = {column.field: column.title for column in definition.columns}
+    rows: List[DeltaRow] = []
+    for row_id, (fingerprint, data) in until.rows.items():
+        previous = since.rows.get(row_id)
+        if previous is None:
+            rows.append(DeltaRow(ADDED, model.model_validate(data)))
+        elif previous[0] != fingerprint:
+            fields = [titles.get(name, name) for name, value in data.items() if previous[1].get(name) != value]
+            rows.append(DeltaRow(CHANGED, model.model_validate(data), model.model_validate(previous[1]), fields))
+    for row_id, (_, data) in since.rows.items():
+        if row_id not in until.rows:
+            rows.append(DeltaRow(REMOVED, model.model_validate(data)))
+    return Delta(since.info, until.info, rows)
+
+
+def delta_definition(definition: ReportDefinition) -> ReportDefinition:
+    """Описание отчета для вывода разницы: колонки изменения вокруг колонок отчета и подсветка по виду изменения."""
+    return replace(
+        definition,
+        columns=(Column("Изменение", "change_title", center=True), *definition.columns, Column("Изменено", "changed_titles")),
+        highlights=tuple(Highlight(color, lambda row, change=change: row.change == change)
+                         for change, color in CHANGE_COLORS.items()),
+    )
+
+
+def render_delta(report_id: str, delta: Delta, params: Optional[Dict[str, Any]] = None) -> bytes:
+    """Книга Excel с изменившимися строками отчета (`params` - параметры источника)."""
+    return render_workbook(delta_definition(REPORTS[report_id].for_params(params)), delta.rows).getvalue()
+
+
+SNAPSHOTS = SnapshotStore(settings.SNAPSHOT_DIR, settings.SNAPSHOT_KEEP)
+
+# Фоновые сохранения снимков (ссылки нужны, чтобы задачи не собрал сборщик мусора)
+_SAVES: Set[asyncio.Task] = set()
+
+
+async def _save_in_background(dataset: "ReportDataset"):
+    try:
+        if await asyncio.to_thread(SNAPSHOTS.save, dataset):
+            logger.info(f"Снимок отчета {dataset.report_id} за {dataset.start_date}-{dataset.end_date} "
+                        f"сохранен: {snapshot_id(dataset)}, строк {len(dataset.rows)}")
+    except Exception as e:
+        logger.error(f"Не удалось сохранить снимок отчета {dataset.report_id} "
+                     f"за {dataset.start_date}-{dataset.end_date}: {e}")
+
+
+def schedule_snapshot(dataset: "ReportDataset"):
+    """Сохраняет снимок полного набора строк в фоне, не задерживая выдачу отчета."""
+    if not settings.SNAPSHOTS_ENABLED or not dataset.complete or REPORTS[dataset.report_id].identity is None:
+        return
+    task = asyncio.create_task(_save_in_background(dataset))
+    _SAVES.add(task)
+    task.add_done_callback(_SAVES.discard)
+
+
+def _snapshot_of(dataset: "ReportDataset") -> Snapshot:
+    rows = {row_id: (fingerprint, data) for row_id, fingerprint, data in fingerprint_rows(REPORTS[dataset.report_id], dataset.rows)}
+    return Snapshot(SnapshotInfo(snapshot_id(dataset), dataset.built_at, len(dataset.rows)), rows)
+
+
+def _compute_sync(
+        report_id: str,
+        start_date: str,
+        end_date: str,
+        params_key: tuple,
+        since: Optional[str],
+        until: "ReportDataset | str",
+) -> Delta:
+    definition = REPORTS[report_id].for_params(dict(params_key))
+    if isinstance(until, str):
+        until_snapshot = SNAPSHOTS.load(report_id, start_date, end_date, params_key, until)
+        if until_snapshot is None:
+            raise LookupError(f"Снимок {until} не найден")
+    else:
+        until_snapshot = _snapshot_of(until)
+
+    if since is None:
+        # По умолчанию - последний снимок раньше сравниваемого
+        earlier = [info for info in SNAPSHOTS.list(report_id, start_date, end_date, params_key)
+                   if info.id < until_snapshot.info.id]
+        if not earlier:
+            raise LookupError("Нет более раннего снимка отчета за этот период")
+        since = earlier[-1].id
+    since_snapshot = SNAPSHOTS.load(report_id, start_date, end_date, params_key, since)
+    if since_snapshot is None:
+        raise LookupError(f"Снимок {since} не найден")
+    return diff(definition, since_snapshot, until_snapshot)
+
+
+async def compute_delta(
+        report_id: str,
+        start_date: str,
+        end_date: str,
+        params_key: tuple,
+        since: Optional[str],
+        until: "ReportDataset | str",
+) -> Delta:
+    """
+    Разница между снимком `since` (по умолчанию - предыдущим) и `until`: текущим набором строк
+    или другим снимком. Сравнение двух снимков не требует ни одного запроса к ЕВМИАС.
+    Снимок не найден - LookupError.
+    """
+    return await asyncio.to_thread(_compute_sync, report_id, start_date, end_date, params_key, since, until)
@@ -0,0 +1,353 @@
+from __future__ import annotations
+
+import asyncio
+import io
+import time
+from collections import deque
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import (TYPE_CHECKING, Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Hashable, Iterable, List,
+                    Optional, Set, Tuple, Type)
+
+from pydantic import BaseModel
+
+from app.core import get_settings, logger
+from app.core.deadline import UNRESOLVED, DeadlineExceeded, record_unresolved
+from app.core.metrics import REPORT_LOOKUP_SECONDS, REPORT_LOOKUPS, REPORT_ROWS
+from app.service.gateway.gateway import GatewayService
+from app.service.tool.tool import add_unresolved_sheet, align_column_center, align_row_center, auto_cells_width
+
+# openpyxl импортируется при первом построении книги, а не при старте воркера
+if TYPE_CHECKING:
+    from openpyxl.worksheet.worksheet import Worksheet
+
+settings = get_settings()
+
+
+class Resolved(dict):
+    """Результаты справочных запросов по одной исходной записи (имя справочника -> значение)."""
+
+    def __init__(self):
+        super().__init__()
+        # Справочники, которые не успели получить до срока сборки
+        self.unresolved: Set[str] = set()
+
+    def value(self, name: str, unresolved: Any = UNRESOLVED) -> Any:
+        """Значение справочника или `unresolved`, если его не успели получить."""
+        return unresolved if name in self.unresolved else self.get(name)
+
+
+@dataclass(frozen=True)
+class Lookup:
+    """
+    Справочный запрос, которым обогащается исходная запись.
+
+    `key` по записи (и уже полученным справочникам из `needs`) возвращает ключ запроса;
+    None - запрос не нужен. Одинаковые ключи в рамках сборки запрашиваются один раз.
+    `prefetch(gateway_service, start_date, end_date, **params)` - массовая загрузка за весь период
+    (с параметрами источника); по ключам, которых в ней нет, идет `fetch`.
+    """
+    name: str
+    title: str
+    fetch: Callable[[GatewayService, Hashable], Awaitable[Any]]
+    key: Callable[[Any, Resolved], Optional[Hashable]]
+    needs: Tuple[str, ...] = ()
+    prefetch: Optional[Callable[..., Awaitable[Dict[Hashable, Any]]]] = None
+    # Ошибка запроса не прерывает сборку: значение становится None
+    ignore_errors: bool = False
+
+
+@dataclass(frozen=True)
+class Column:
+    title: str
+    field: str
+    width: Optional[int] = None
+    center: bool = False
+
+
+@dataclass(frozen=True)
+class Highlight:
+    """Заливка строки листа, если для нее выполняется условие (срабатывает первое подходящее)."""
+    color: str
+    when: Callable[[BaseModel], bool]
+
+
+def _no_scope(params: Dict[str, Any]) -> Tuple[str, ...]:
+    return ("",)
+
+
+@dataclass(frozen=True)
+class FactProjection:
+    """
+    Как строки отчета попадают в аналитическое хранилище.
+
+    `project(row)` возвращает факт: значения измерений (lpu_id, service_date, pay_source, department,
+    org_category, service_code, service_name) и quantity. `scope(params)` - ЛПУ, данные которых
+    заменяет полный набор строк, собранный с этими параметрами источника.
+    """
+    project: Callable[[BaseModel], Dict[str, Any]]
+    scope: Callable[[Dict[str, Any]], Tuple[str, ...]] = _no_scope
+
+
+@dataclass(frozen=True)
+class ReportDefinition:
+    """
+    Описание отчета: откуда брать исходные записи, какими справочниками их обогащать,
+    как из записи получить строки и как выводить их в Excel.
+
+    `source(start_date, end_date, gateway_service, **params)` отдает исходные записи,
+    `build_rows(record, resolved)` превращает запись в строки отчета.
+    """
+    report_id: str
+    title: str
+    filename: str
+    row_model: Type[BaseModel]
+    source: Callable[..., AsyncIterator[Any]]
+    build_rows: Callable[[Any, Resolved], Iterable[BaseModel]]
+    columns: Tuple[Column, ...]
+    lookups: Tuple[Lookup, ...] = ()
+    highlights: Tuple[Highlight, ...] = ()
+    # Фильтры JSON API -> поле строки отчета
+    filters: Dict[str, str] = field(default_factory=dict)
+    # Если строки дают несколько групп, в Excel каждая группа выводится на свой лист
+    sheet_group: Optional[Callable[[BaseModel], str]] = None
+    # Проекция строк в аналитическое хранилище (None - отчет туда не попадает)
+    facts: Optional[FactProjection] = None
+    # Ключ строки для сравнения прогонов: строки с одинаковым ключом считаются одной и той же
+    # строкой, изменившейся между прогонами (None - снимки прогонов не сохраняются)
+    identity: Optional[Callable[[BaseModel], Tuple]] = None
+    # Вариант вывода для параметров источника (например, лишняя колонка для нескольких ЛПУ);
+    # None - вывод по этому описанию
+    variant: Optional[Callable[[Dict[str, Any]], Optional[ReportDefinition]]] = None
+
+    def for_params(self, params: Optional[Dict[str, Any]]) -> ReportDefinition:
+        """Описание, по которому выводятся строки, собранные с этими параметрами источника."""
+        if self.variant is None:
+            return self
+        return self.variant(params or {}) or self
+
+    @property
+    def titles(self) -> List[str]:
+        return [column.title for column in self.columns]
+
+    def row_values(self, row: BaseModel) -> List[Any]:
+        return [getattr(row, column.field) for column in self.columns]
+
+
+class _LookupRun:
+    """Справочные запросы одной сборки: кеш по ключам, массовые загрузки и ограничение параллельности."""
+
+    def __init__(
+            self,
+            definition: ReportDefinition,
+            gateway_service: GatewayService,
+            start_date: str,
+            end_date: str,
+            params: Dict[str, Any],
+    ):
+        self._definition = definition
+        self._gateway_service = gateway_service
+        self._cache: Dict[Tuple[str, Hashable], asyncio.Future] = {}
+        self._semaphore = asyncio.Semaphore(settings.REPORT_LOOKUP_CONCURRENCY)
+        # Массовые загрузки стартуют сразу, параллельно с получением исходных записей
+        self._prefetched: Dict[str, asyncio.Future] = {
+            lookup.name: asyncio.ensure_future(self._prefetch(lookup, start_date, end_date, params))
+            for lookup in definition.lookups if lookup.prefetch is not None
+        }
+
+    def close(self):
+        for future in [*self._prefetched.values(), *self._cache.values()]:
+            if not future.done():
+                future.cancel()
+
+    def _count(self, lookup: Lookup, result: str):
+        REPORT_LOOKUPS.labels(report=self._definition.report_id, lookup=lookup.name, result=result).inc()
+
+    async def _prefetch(self, lookup: Lookup, start_date: str, end_date: str, params: Dict[str, Any]) -> Dict[Hashable, Any]:
+        try:
+            return await lookup.prefetch(self._gateway_service, start_date, end_date, **params)
+        except Exception as e:
+            # Без массовой загрузки каждое значение будет получено отдельным запросом
+            logger.warning(f"Не удалось выполнить массовую загрузку '{lookup.title}' за {start_date}-{end_date}: {e}")
+            return {}
+
+    async def _fetch(self, lookup: Lookup, key: Hashable) -> Any:
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                value = await lookup.fetch(self._gateway_service, key)
+            except Exception:
+                self._count(lookup, "error")
+                raise
+            REPORT_LOOKUP_SECONDS.labels(report=self._definition.report_id, lookup=lookup.name).observe(
+                time.perf_counter() - started
+            )
+            self._count(lookup, "fetched")
+            return value
+
+    async def resolve(self, lookup: Lookup, key: Hashable) -> Any:
+        prefetched = self._prefetched.get(lookup.name)
+        if prefetched is not None:
+            index = await asyncio.shield(prefetched)
+            if key in index:
+                self._count(lookup, "prefetched")
+                return index[key]
+
+        future = self._cache.get((lookup.name, key))
+        if future is None or (future.done() and (future.cancelled() or future.exception() is not None)):
+            future = asyncio.ensure_future(self._fetch(lookup, key))
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._cache[(lookup.name, key)] = future
+        else:
+            self._count(lookup, "cached")
+        # Запрос общий для всех записей с этим ключом - отмена одной записи его не прерывает
+        return await asyncio.shield(future)
+
+    async def rows_for(self, record: Any) -> List[BaseModel]:
+        resolved = Resolved()
+        tasks: Dict[str, asyncio.Future] = {}
+
+        async def run(lookup: Lookup):
+            for need in lookup.needs:
+                await tasks[need]
+            if any(need in resolved.unresolved for need in lookup.needs):
+                resolved.unresolved.add(lookup.name)
+                return
+
+            key = lookup.key(record, resolved)
+            if key is None:
+                resolved[lookup.name] = None
+                return
+
+            try:
+                resolved[lookup.name] = await self.resolve(lookup, key)
+            except DeadlineExceeded:
+                resolved.unresolved.add(lookup.name)
+                self._count(lookup, "unresolved")
+                record_unresolved(lookup.title, key)
+            except Exception as e:
+                if not lookup.ignore_errors:
+                    raise
+                logger.error(f"Ошибка справочника '{lookup.title}' для {key}: {e}")
+                resolved[lookup.name] = None
+
+        for lookup in self._definition.lookups:
+            tasks[lookup.name] = asyncio.ensure_future(run(lookup))
+        try:
+            await asyncio.gather(*tasks.values())
+        finally:
+            for task in tasks.values():
+                if not task.done():
+                    task.cancel()
+
+        return list(self._definition.build_rows(record, resolved))
+
+
+async def iter_report_rows(
+        definition: ReportDefinition,
+        start_date: str,
+        end_date: str,
+        gateway_service: GatewayService,
+        **params,
+) -> AsyncIterator[BaseModel]:
+    """
+    Отдает строки отчета по описанию: исходные записи обогащаются параллельно
+    (не больше REPORT_LOOKUP_WINDOW записей одновременно), строки отдаются в порядке записей.
+    """
+    lookups = _LookupRun(definition, gateway_service, start_date, end_date, params)
+    window: Deque[asyncio.Future] = deque()
+    rows_total = REPORT_ROWS.labels(report=definition.report_id)
+
+    try:
+        async with aclosing(definition.source(start_date, end_date, gateway_service, **params)) as records:
+            try:
+                async for record in records:
+                    window.append(asyncio.ensure_future(lookups.rows_for(record)))
+                    # Отдаем готовые строки, не дожидаясь конца источника
+                    while window and (len(window) >= settings.REPORT_LOOKUP_WINDOW or window[0].done()):
+                        for row in await window.popleft():
+                            rows_total.inc()
+                            yield row
+            except DeadlineExceeded:
+                # Срок сборки истек раньше, чем источник отдал все записи - отдаем то, что успели
+                record_unresolved(f"Исходные данные отчета {definition.title}",
+                                  f"{start_date}-{end_date}: получены не полностью")
+
+        while window:
+            for row in await window.popleft():
+                rows_total.inc()
+                yield row
+    finally:
+        for task in window:
+            task.cancel()
+        lookups.close()
+
+
+def fill_sheet(definition: ReportDefinition, sheet: Worksheet, rows: List[BaseModel]):
+    """Заполняет лист строками отчета: заголовки, даты ДД.ММ.ГГГГ, подсветка, ширина и выравнивание колонок."""
+    from openpyxl.styles import PatternFill
+    from openpyxl.utils import get_column_letter
+
+    fills = [
+        (PatternFill(start_color=rule.color, end_color=rule.color, fill_type="solid"), rule.when)
+        for rule in definition.highlights
+    ]
+
+    sheet.append(definition.titles)
+
+    for row in rows:
+        sheet.append(definition.row_values(row))
+        fill = next((row_fill for row_fill, when in fills if when(row)), None)
+
+        for cell in sheet[sheet.max_row]:
+            if isinstance(cell.value, (date, datetime)):
+                cell.number_format = 'DD.MM.YYYY'
+            if fill is not None:
+                cell.fill = fill
+
+    # автоширина всех колонок, затем заданная ширина
+    auto_cells_width(sheet)
+    for index, column in enumerate(definition.columns, start=1):
+        if column.width:
+            sheet.column_dimensions[get_column_letter(index)].width = column.width
+
+    # выравнивание первой строки и отмеченных колонок по центру
+    align_row_center(sheet, [1])
+    align_column_center(
+        sheet, [get_column_letter(index) for index, column in enumerate(definition.columns, start=1) if column.center]
+    )
+
+    # включить АВТОФИЛЬТР
+    sheet.auto_filter.ref = sheet.dimensions
+
+
+def render_workbook(
+        definition: ReportDefinition,
+        rows: List[BaseModel],
+        unresolved: Optional[List[dict]] = None,
+) -> io.BytesIO:
+    """Книга Excel отчета (по листу на группу строк, если задан sheet_group) и сводка недополученных данных."""
+    from openpyxl import Workbook
+
+    book = Workbook()
+
+    groups: Dict[str, List[BaseModel]] = {}
+    if definition.sheet_group is not None:
+        for row in rows:
+            groups.setdefault(definition.sheet_group(row), []).append(row)
+
+    if len(groups) > 1:
+        book.remove(book.active)
+        for title, group_rows in groups.items():
+            fill_sheet(definition, book.create_sheet(title), group_rows)
+    else:
+        fill_sheet(definition, book.active, rows)
+
+    if unresolved:
+        add_unresolved_sheet(book, unresolved)
+
+    output_stream = io.BytesIO()
+    book.save(output_stream)
+    output_stream.seek(0)
+    return output_stream
@@ -1,18 +1,25 @@
-import io
-import json
+import zlib
+from typing import AsyncIterator, List, Optional
 
-from openpyxl import Workbook
-from async_lru import alru_cache
-from openpyxl.styles import PatternFill
+import orjson
 
-from app.core.decorators import log_and_catch
-from app.core import ORGS_MAPPER, PAY_TYPE_MAPPER, logger
+from app.core.deadline import UNRESOLVED
+from app.core import ORGS_MAPPER, PAY_TYPE_MAPPER, get_settings, logger
+from app.core.metrics import REPORT_PROJECTION_CHECKS
+from app.model.invitro import InvitroRow
 from app.service.gateway.gateway import GatewayService
-from app.service.tool.tool import auto_cells_width, set_column_width, align_row_center, align_column_center
+from app.service.report.engine import Column, FactProjection, Highlight, Lookup, ReportDefinition, Resolved
+from app.service.report.service_catalog import INVITRO_USLUGA_PID, SERVICE_CATALOG
+from app.service.tool.sharding import iter_sharded, parse_date
+from app.service.tool.tool import UNRESOLVED_FILL_COLOR
 
+settings = get_settings()
 
-@alru_cache(maxsize=1000)
-async def _fetch_job_data(person_id: str, gateway_service: GatewayService):
+# Сведения о работе, если их не успели получить до срока сборки
+_UNRESOLVED_JOB = {"job_id": "", "job_name": UNRESOLVED, "soc_status": UNRESOLVED}
+
+
+async def _fetch_job_data(gateway_service: GatewayService, person_id: str):
     payload = {
         "params": {
             "c": "Common",
@@ -33,13 +40,12 @@ async def _fetch_job_data(person_id: str, gateway_service: GatewayService):
     soc_status = response_json[0].get("SocStatus_Name", "")
 
     if soc_status == "Работает" and not job_name:
-        job_name = "В ЕВМИАС отсутствуют данные о месте работы"
+        job_name = InvitroRow.MISSING_JOB
 
     return {"job_id": job_id, "job_name": job_name, "soc_status": soc_status}
 
 
-@alru_cache(maxsize=1000)
-async def _fetch_usluga_code(usluga_complex_code_name: str, gateway_service: GatewayService) -> dict:
+async def _fetch_usluga_code(gateway_service: GatewayService, usluga_complex_code_name: str) -> dict:
     payload = {
         "params": {
             "c": "UslugaComplex",
@@ -48,7 +54,7 @@ async def _fetch_usluga_code(usluga_complex_code_name: str, gateway_service: Gat
         "data": {
             "UslugaComplex_CodeName": usluga_complex_code_name,
             "object": "UslugaComplex",
-            "UslugaComplex_pid": "3010101000029801",
+            "UslugaComplex_pid": INVITRO_USLUGA_PID,
             "contents": 2
         }
     }
@@ -58,8 +64,12 @@ async def _fetch_usluga_code(usluga_complex_code_name: str, gateway_service: Gat
     return response_json[0].get("UslugaComplex_Code")
 
 
-@alru_cache(maxsize=1000)
-async def _fetch_pay_type(evn_direction_id: str, gateway_service: GatewayService):
+async def _load_service_catalog(gateway_service: GatewayService, start_date: str, end_date: str, **_params):
+    # Каталог не зависит от периода - общий снимок для всех сборок
+    return await SERVICE_CATALOG.get_index(gateway_service)
+
+
+async def _fetch_pay_type(gateway_service: GatewayService, evn_direction_id: str):
     payload = {
         "params": {
             "c": "EvnLabRequest",
@@ -78,7 +88,50 @@ async def _fetch_pay_type(evn_direction_id: str, gateway_service: GatewayService
     return PAY_TYPE_MAPPER.get(pay_type_id, "")
 
 
-async def _fetch_source_data(start_date: str, end_date: str, gateway_service: GatewayService):
+def _listed_pay_type(item: dict) -> Optional[str]:
+    """Вид оплаты из элемента списка заявок; None - в списке его нет (или чтение из списка выключено)."""
+    if not settings.INVITRO_PAY_TYPE_FROM_LIST:
+        return None
+    pay_type_id = item.get("PayType_id")
+    if not pay_type_id:
+        return None
+    return PAY_TYPE_MAPPER.get(str(pay_type_id), "")
+
+
+def _verify_sampled(evn_direction_id: str) -> bool:
+    # Выборка детерминирована по направлению: все услуги одной заявки попадают в нее вместе
+    rate = settings.INVITRO_PAY_TYPE_VERIFY_RATE
+    return rate > 0 and zlib.crc32(evn_direction_id.encode()) % 10_000 < rate * 10_000
+
+
+def _pay_type_key(record: dict, _: Resolved) -> Optional[str]:
+    item = record["request"]
+    evn_direction_id = item.get("EvnDirection_id")
+    if evn_direction_id and _listed_pay_type(item) is not None and not _verify_sampled(evn_direction_id):
+        return None
+    return evn_direction_id
+
+
+def _pay_type(item: dict, resolved: Resolved) -> str:
+    """Вид оплаты строки: из списка заявок или из запроса по направлению (при сверке он главнее)."""
+    listed = _listed_pay_type(item)
+    if listed is None:
+        return resolved.value("pay_type")
+
+    loaded = resolved.get("pay_type")
+    if loaded is None:
+        return listed
+
+    result = "match" if loaded == listed else "mismatch"
+    REPORT_PROJECTION_CHECKS.labels(report="invitro", field="pay_type", result=result).inc()
+    if result == "mismatch":
+        logger.warning(f"Вид оплаты направления {item.get('EvnDirection_id')} в списке заявок ('{listed}') "
+                       f"не совпадает с загруженным ('{loaded}')")
+    return loaded
+
+
+async def _iter_source_data(start_date: str, end_date: str, gateway_service: GatewayService) -> AsyncIterator[dict]:
+    """Потоково отдает заявки из loadEvnLabRequestList, не дожидаясь загрузки всего списка."""
     payload = {
         "params": {
             "c": "EvnLabRequest",
@@ -96,92 +149,126 @@ async def _fetch_source_data(start_date: str, end_date: str, gateway_service: Ga
             "formMode": "false",
         }
     }
-    response = await gateway_service.make_request(method="post", json=payload)
-    logger.info("Исходные данные успешно получены")
-    return response.get("data", "")  # noqa
-
-
-@log_and_catch()
-async def process_invitro_list(start_date: str, end_date: str, gateway_service: GatewayService):
-    source_data = await _fetch_source_data(start_date, end_date, gateway_service)
-
-    book = Workbook()
-    sheet = book.active
-    invalid_fill = PatternFill(start_color="FFE4E1", end_color="FFE4E1", fill_type="solid")
-
-    titles = ["Фамилия", "Имя", "Отчество", "ДР", "Соц.статус", "Таможня/УФССП", "Место работы",
-              "Дата услуги", "Вид оплаты", "Код услуги", "Услуга"]
-    sheet.append(titles)
-
-    for item in source_data:
-        person_id = item.get("Person_id", "")
-
-        services_list = json.loads(item.get("EvnLabRequest_UslugaName", ""))
-
-        evn_direction_id = item.get("EvnDirection_id")
-        pay_type = await _fetch_pay_type(evn_direction_id, gateway_service)
-
-        surname = item.get("Person_Surname", "").title()
-        first_name = item.get("Person_Firname", "").title()
-        middle_name = item.get("Person_Secname", "").title()
-        birthday = item.get("Person_Birthday", "")
-        service_date = item.get("TimetableMedService_Date", "")
-
-        for service in services_list:
-            service_name = service.get("UslugaComplex_Name")
-            service_code = await _fetch_usluga_code(service_name, gateway_service)
-
-            job_data = await _fetch_job_data(person_id, gateway_service)
-            job_id = job_data.get("job_id", "")
-            job_name = job_data.get("job_name", "")
-            soc_status = job_data.get("soc_status", "")
-
-            job_category = ""
-            if job_id in ORGS_MAPPER:
-                job_category = ORGS_MAPPER[job_id]
-
-            row_data = [
-                surname,
-                first_name,
-                middle_name,
-                birthday,
-                soc_status,
-                job_category,
-                job_name,
-                service_date,
-                pay_type,
-                service_code,
-                service_name,
-            ]
-
-            sheet.append(row_data)
-
-            # помечаем строки где нет данных о месте работы
-            if job_name == "В ЕВМИАС отсутствуют данные о месте работы":
-                current_row = sheet.max_row
-                for cell in sheet[current_row]:
-                    cell.fill = invalid_fill
-
-    # автоширина всех колонок
-    auto_cells_width(sheet)
-
-    # задаем ширину колонки принудительно
-    set_column_width(sheet=sheet, column_letter="G", width=45)
-
-    # выравнивание первой строки по центру
-    rows_to_align = [1]
-    align_row_center(sheet, rows_to_align)
-
-    # выравнивание колонок по центру
-    columns_to_align = ["D", "H"]
-    align_column_center(sheet, columns_to_align)
-
-    # включить АВТОФИЛЬТР
-    # sheet.dimensions вернет строку вида "A1:K150"
-    sheet.auto_filter.ref = sheet.dimensions
-
-    output_stream = io.BytesIO()
-    book.save(output_stream)
-    output_stream.seek(0)
-
-    return output_stream
+    count = 0
+    async for item in gateway_service.stream_list(array_key="data", json=payload):
+        count += 1
+        yield item
+    logger.info(f"Исходные данные успешно получены: {count} заявок")
+
+
+async def _iter_request_services(
+        start_date: str,
+        end_date: str,
+        gateway_service: GatewayService
+) -> AsyncIterator[dict]:
+    """Исходные записи отчета: по одной на каждую услугу каждой заявки."""
+    # Большие периоды запрашиваются по частям параллельно, дубли заявок отбрасываются
+    items = iter_sharded(
+        start_date,
+        end_date,
+        lambda shard_start, shard_end: _iter_source_data(shard_start, shard_end, gateway_service),
+        shard_days=settings.REPORT_SHARD_DAYS,
+        concurrency=settings.REPORT_SHARD_CONCURRENCY,
+        key=lambda item: item.get("EvnLabRequest_id") or item.get("EvnDirection_id"),
+    )
+
+    async for item in items:
+        # Список услуг приходит JSON-строкой внутри элемента - разбираем только сейчас
+        for service in orjson.loads(item.get("EvnLabRequest_UslugaName", "")):
+            yield {"request": item, "service_name": service.get("UslugaComplex_Name")}
+
+
+def _build_rows(record: dict, resolved: Resolved) -> List[InvitroRow]:
+    item = record["request"]
+    job_data = resolved.value("job", unresolved=_UNRESOLVED_JOB) or {}
+
+    return [InvitroRow(
+        surname=item.get("Person_Surname", "").title(),
+        first_name=item.get("Person_Firname", "").title(),
+        middle_name=item.get("Person_Secname", "").title(),
+        birthday=item.get("Person_Birthday", ""),
+        soc_status=job_data.get("soc_status", ""),
+        job_category=ORGS_MAPPER.get(job_data.get("job_id", ""), ""),
+        job_name=job_data.get("job_name", ""),
+        service_date=item.get("TimetableMedService_Date", ""),
+        pay_type=_pay_type(item, resolved),
+        service_code=resolved.value("service_code"),
+        service_name=record["service_name"],
+    )]
+
+
+def _fact(row: InvitroRow) -> dict:
+    try:
+        service_date = parse_date(row.service_date) if row.service_date else None
+    except ValueError:
+        service_date = None
+
+    return {
+        "lpu_id": "",
+        "service_date": service_date,
+        "pay_source": row.pay_type,
+        "department": None,
+        "org_category": row.job_category or None,
+        "service_code": row.service_code,
+        "service_name": row.service_name,
+        "quantity": 1,
+    }
+
+
+INVITRO_REPORT = ReportDefinition(
+    report_id="invitro",
+    title="ИНВИТРО",
+    filename="invitro",
+    row_model=InvitroRow,
+    source=_iter_request_services,
+    build_rows=_build_rows,
+    lookups=(
+        Lookup(
+            name="pay_type",
+            title="Вид оплаты",
+            fetch=_fetch_pay_type,
+            # Если вид оплаты пришел в списке заявок, отдельный запрос по направлению не нужен
+            key=_pay_type_key,
+        ),
+        Lookup(
+            name="service_code",
+            title="Код услуги",
+            fetch=_fetch_usluga_code,
+            key=lambda record, _: record["service_name"],
+            # Коды берутся из каталога услуг, запрос по названию - только для услуг не из каталога
+            prefetch=_load_service_catalog,
+        ),
+        Lookup(
+            name="job",
+            title="Место работы",
+            fetch=_fetch_job_data,
+            key=lambda record, _: record["request"].get("Person_id", ""),
+        ),
+    ),
+    columns=(
+        Column("Фамилия", "surname"),
+        Column("Имя", "first_name"),
+        Column("Отчество", "middle_name"),
+        Column("ДР", "birthday", center=True),
+        Column("Соц.статус", "soc_status"),
+        Column("Таможня/УФССП", "job_category"),
+        Column("Место работы", "job_name", width=45),
+        Column("Дата услуги", "service_date", center=True),
+        Column("Вид оплаты", "pay_type"),
+        Column("Код услуги", "service_code"),
+        Column("Услуга", "service_name"),
+    ),
+    highlights=(
+        # строки, где не все данные успели получить, и строки без данных о месте работы
+        Highlight(UNRESOLVED_FILL_COLOR, lambda row: row.is_unresolved),
+        Highlight("FFE4E1", lambda row: row.is_missing_job),
+    ),
+    filters={
+        "pay_source": "pay_type",
+        "service_code": "service_code",
+    },
+    facts=FactProjection(project=_fact),
+    # Исследование пациента: вид оплаты и место работы могут меняться между прогонами
+    identity=lambda row: (row.surname, row.first_name, row.middle_name, row.birthday,
+                          row.service_date, row.service_name),
+)
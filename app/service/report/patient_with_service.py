@@ -1,43 +1,130 @@
 from __future__ import annotations
 import io
 import asyncio
-import json
-from typing import List
+from dataclasses import replace
+from typing import TYPE_CHECKING, AsyncIterator, Dict, List, Optional, Sequence, Tuple
 from fastapi import HTTPException
-from openpyxl import load_workbook
-from openpyxl.worksheet.worksheet import Worksheet
-from async_lru import alru_cache
-from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_exception
-from openpyxl import Workbook
-from pydantic import BaseModel
-from datetime import date, datetime
 import warnings
 
-from app.core import logger, PAY_TYPE_MAPPER
+from app.core import get_settings, logger, PAY_TYPE_MAPPER
+from app.core.deadline import DeadlineExceeded, record_unresolved
 from app.service.gateway.gateway import GatewayService
 from app.model.patient_with_services import PatientServiceRow
-from app.service.tool.tool import auto_cells_width, set_column_width, align_row_center, align_column_center
+from app.service.report.engine import Column, FactProjection, Highlight, Lookup, ReportDefinition, Resolved
+from app.service.tool.sharding import iter_concurrent, iter_sharded
+from app.service.tool.tool import UNRESOLVED_FILL_COLOR
+
+# openpyxl импортируется при первом разборе выгрузки, а не при старте воркера
+if TYPE_CHECKING:
+    from openpyxl.worksheet.worksheet import Worksheet
+
+settings = get_settings()
+
+
+def _hosp_search_payload(
+        lpu_id: str,
+        card_number: Optional[str],
+        date_range: str,
+        start: int = 0,
+        limit: Optional[int] = None,
+) -> dict:
+    data = {
+        "Lpu_id": lpu_id,
+        "PersonPeriodicType_id": 1,
+        "SearchFormType": "EvnPS",
+        "EvnSection_setDate_Range": date_range,
+        "Date_Type": 1,
+        "SearchType_id": 1,
+        "PersonCardStateType_id": 1,
+    }
+    if card_number is not None:
+        data["EvnPS_NumCard"] = card_number
+    if limit is not None:
+        data["start"] = start
+        data["limit"] = limit
+    return {"params": {"c": "Search", "m": "searchData"}, "data": data}
 
 
-@alru_cache(maxsize=1000)
-async def _cached_search_hosp(gateway_service: GatewayService, card_number: str, hosp_start_date: str) -> dict:
-    payload = {
-        "params": {"c": "Search", "m": "searchData"},
-        "data": {
-            "PersonPeriodicType_id": 1,
-            "SearchFormType": "EvnPS",
-            "EvnPS_NumCard": card_number,
-            "EvnSection_setDate_Range": f"{hosp_start_date} - {hosp_start_date}",
-            "Date_Type": 1,
-            "SearchType_id": 1,
-            "PersonCardStateType_id": 1,
-        }
-    }
-    return await gateway_service.make_request(method="post", json=payload)
+def _is_lpu_hosp(hosp: dict, lpu_id: str) -> bool:
+    """
+    Госпитализация принадлежит ЛПУ. Номера карт уникальны только внутри ЛПУ, поэтому
+    записи другого ЛПУ (если поиск их все же вернул) отбрасываются.
+    """
+    hosp_lpu_id = hosp.get("Lpu_id")
+    return hosp_lpu_id is None or str(hosp_lpu_id) == lpu_id
+
+
+async def _search_hosp_id(gateway_service: GatewayService, key: Tuple[str, str, str]) -> Optional[str]:
+    """Поиск госпитализации по ЛПУ, номеру карты и дате поступления - для карт, которых нет в индексе за период."""
+    lpu_id, card_number, hosp_start_date = key
+    payload = _hosp_search_payload(lpu_id, card_number, f"{hosp_start_date} - {hosp_start_date}")
+    patient_hosp_response = await gateway_service.make_request(method="post", json=payload)
+    hosp_data = patient_hosp_response.get("data")
+    if isinstance(hosp_data, list):
+        hosp_data = [hosp for hosp in hosp_data if _is_lpu_hosp(hosp, lpu_id)]
+
+    # Проверка: нашли ли госпитализацию?
+    if not hosp_data or not isinstance(hosp_data, list):
+        logger.warning(f"Госпитализация не найдена для карты {card_number} (ЛПУ {lpu_id})")
+        return None
+
+    return hosp_data[0].get("EvnPS_id")
+
+
+async def _load_lpu_hosp_index(
+        gateway_service: GatewayService,
+        start_date: str,
+        end_date: str,
+        lpu_id: str,
+) -> Dict[Tuple[str, str, str], str]:
+    """
+    Одним поиском (с постраничной догрузкой) находит все госпитализации ЛПУ за период
+    и строит индекс (ЛПУ, номер карты, дата поступления) -> EvnPS_id.
+    """
+    date_range = f"{start_date} - {end_date}"
+    page_size = settings.HOSP_SEARCH_PAGE_SIZE
+
+    async def load_page(start: int) -> dict:
+        payload = _hosp_search_payload(lpu_id, None, date_range, start=start, limit=page_size)
+        return await gateway_service.make_request(method="post", json=payload)
+
+    first_page = await load_page(0)
+    pages = [first_page]
+    total = int(first_page.get("totalCount") or 0)
+    if total > page_size:
+        pages += await asyncio.gather(*(load_page(start) for start in range(page_size, total, page_size)))
+
+    index = {}
+    for page in pages:
+        for hosp in page.get("data") or []:
+            if not _is_lpu_hosp(hosp, lpu_id):
+                continue
+            key = (lpu_id, str(hosp.get("EvnPS_NumCard", "")).strip(), hosp.get("EvnPS_setDate", ""))
+            index.setdefault(key, hosp.get("EvnPS_id"))
+
+    logger.info(f"Найдено госпитализаций ЛПУ {lpu_id} за {date_range}: {len(index)} (всего записей {total})")
+    return index
+
+
+async def _load_bulk_hosp_index(
+        gateway_service: GatewayService,
+        start_date: str,
+        end_date: str,
+        lpu_ids: Optional[Sequence[str]] = None,
+) -> Dict[Tuple[str, str, str], str]:
+    """Индексы госпитализаций за период по всем ЛПУ сборки (загружаются параллельно)."""
+    indexes = await asyncio.gather(*(
+        _load_lpu_hosp_index(gateway_service, start_date, end_date, lpu_id)
+        for lpu_id in normalize_lpu_ids(lpu_ids)
+    ))
+    return {key: hosp_id for index in indexes for key, hosp_id in index.items()}
 
 
-@alru_cache(maxsize=1000)
-async def _cached_search_hosp_services(gateway_service: GatewayService, hosp_id: str) -> list[dict]:
+async def _load_hosp_services_index(gateway_service: GatewayService, hosp_id: str) -> Dict[Tuple[str, str], str]:
+    """
+    Загружает услуги госпитализации и строит индекс (код услуги, дата) -> id типа оплаты.
+    В кеше сборки остается только индекс, сам список услуг после построения не хранится.
+    """
     payload = {
         "params": {"c": "EvnUsluga", "m": "loadEvnUslugaGrid"},
         "data": {
@@ -45,7 +132,18 @@ async def _cached_search_hosp_services(gateway_service: GatewayService, hosp_id:
             "parent": "EvnPS",
         }
     }
-    return await gateway_service.make_request(method="post", json=payload)
+    services_response = await gateway_service.make_request(method="post", json=payload)
+
+    index = {}
+    if not isinstance(services_response, list):
+        return index
+
+    for each in services_response:
+        key = (each.get("Usluga_Code", ""), each.get("EvnUsluga_setDate", ""))
+        # При совпадении ключей берем первую услугу, как и при переборе списка
+        index.setdefault(key, str(each.get("PayType_id", "")))
+
+    return index
 
 
 def _unmerge_and_fill_sheet(sheet: Worksheet):
@@ -69,6 +167,8 @@ def _unmerge_and_fill_sheet(sheet: Worksheet):
 
 
 def _process_excel_sync(content: bytes) -> List[PatientServiceRow]:
+    from openpyxl import load_workbook
+
     if not content.startswith(b'\x50\x4b\x03\x04'):
         # Если это не ZIP, попробуем понять, что это
         preview = content[:200].decode('utf-8', errors='ignore')
@@ -119,13 +219,14 @@ def _process_excel_sync(content: bytes) -> List[PatientServiceRow]:
     return result_data
 
 
-async def get_list_patients_with_services(
+async def _download_report_rows(
         start_date: str,
         end_date: str,
-        gateway_service: GatewayService
+        gateway_service: GatewayService,
+        lpu_id: str,
 ) -> List[PatientServiceRow]:
     report_params = (
-        f"paramLpu=13102423&"
+        f"paramLpu={lpu_id}&"
         f"__isnull=paramLpuBuilding&"
         f"__isnull=paramLpuUnit&"
         f"__isnull=paramLpuSection&"
@@ -137,7 +238,7 @@ async def get_list_patients_with_services(
         f"paramOnSection=1&"
         f"__isnull=paramPrehospRefuse&"
         f"param_RegionCode=301&"
-        f"param_pmuser_id=461432278617"
+        f"param_pmuser_id={settings.REPORT_PMUSER_ID}"
     )
 
     payload = {
@@ -164,125 +265,217 @@ async def get_list_patients_with_services(
 
         logger.info(f"[CLIENT] Получено {len(file_bytes)} байт.")
 
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"[CLIENT] Ошибка сети: {e}")
         raise HTTPException(503, "Не удалось связаться со шлюзом")
 
     try:
         # Запускаем в потоке
-        result = await asyncio.to_thread(_process_excel_sync, file_bytes)
+        rows = await asyncio.to_thread(_process_excel_sync, file_bytes)
 
-        for record in result:
-            card_number = record.card_number
-            hosp_start_date = record.start_date.strftime("%d.%m.%Y")
-            service_date = record.service_date.strftime("%d.%m.%Y")
-            try:
-                patient_hosp_response = await _cached_search_hosp(gateway_service, card_number, hosp_start_date)
-                hosp_data = patient_hosp_response.get("data")
+    except Exception as e:
+        logger.error(f"[CLIENT] Ошибка парсинга или обработки: {e}", exc_info=True)
+        raise HTTPException(500, "Ошибка обработки файла")
 
-                # Проверка: нашли ли госпитализацию?
-                if not hosp_data or not isinstance(hosp_data, list):
-                    logger.warning(f"Госпитализация не найдена для карты {card_number}")
-                    continue
+    for row in rows:
+        row.lpu_id = lpu_id
+    return rows
 
-                patient_hosp_id = hosp_data[0].get("EvnPS_id")
 
-                services_response = await _cached_search_hosp_services(gateway_service, patient_hosp_id)
+def normalize_lpu_ids(lpu_ids: Optional[Sequence[str]]) -> List[str]:
+    """Список ЛПУ без повторов в порядке запроса; пустой - ЛПУ по умолчанию."""
+    result = []
+    for lpu_id in lpu_ids or []:
+        lpu_id = lpu_id.strip()
+        if not lpu_id.isdigit():
+            raise ValueError(f"Некорректный идентификатор ЛПУ: '{lpu_id}'")
+        if lpu_id not in result:
+            result.append(lpu_id)
 
-                # Проверка: есть ли услуги?
-                if not services_response or not isinstance(services_response, list):
-                    continue
+    if len(result) > settings.REPORT_MAX_LPUS:
+        raise ValueError(f"За один запрос можно выгрузить не больше {settings.REPORT_MAX_LPUS} ЛПУ")
 
-                if record.full_name == 'АБРОСИМОВА ЛЮДМИЛА ВИКТОРОВНА':
-                    with open('./logs/temp.json', 'w', encoding='utf8') as file:
-                        json.dump(services_response, file, indent=2, ensure_ascii=False)
+    return result or [settings.REPORT_32430_LPU_ID]
 
-                for each in services_response:
-                    api_date = each.get("EvnUsluga_setDate", "")
-                    api_code = each.get("Usluga_Code", "")
 
-                    if api_code == record.service_code and api_date == service_date:
-                        pay_type_id = each.get("PayType_id", "")
-                        pay_source_name = PAY_TYPE_MAPPER.get(str(pay_type_id))
+async def _iter_lpu_records(
+        start_date: str,
+        end_date: str,
+        gateway_service: GatewayService,
+        lpu_id: str,
+) -> AsyncIterator[PatientServiceRow]:
+    """Строки выгрузки отчета 32430 одного ЛПУ (еще без источника оплаты)."""
+    async def download_shard(shard_start: str, shard_end: str) -> AsyncIterator[PatientServiceRow]:
+        for row in await _download_report_rows(shard_start, shard_end, gateway_service, lpu_id):
+            yield row
+
+    # Большие периоды выгружаются из ЕВМИАС по частям параллельно, повторяющиеся строки отбрасываются
+    records = iter_sharded(
+        start_date,
+        end_date,
+        download_shard,
+        shard_days=settings.REPORT_SHARD_DAYS,
+        concurrency=settings.REPORT_SHARD_CONCURRENCY,
+        key=lambda row: tuple(row.model_dump().values()),
+    )
 
-                        if pay_source_name:
-                            record.service_payment_source = pay_source_name
-                        else:
-                            record.service_payment_source = f"Неизвестный id типа оплаты ({pay_type_id})"
-                        break
+    try:
+        async for record in records:
+            yield record
+    except DeadlineExceeded:
+        # Срок истек до окончания выгрузки - отдаем строки, которые успели выгрузить
+        record_unresolved("Выгрузка отчета 32430", f"ЛПУ {lpu_id}, {start_date}-{end_date}: получена не полностью")
 
-            except Exception as e:
-                logger.error(f"Ошибка при обогащении данных для карты {card_number}: {e}")
-                continue
 
-        return result
+async def _iter_report_records(
+        start_date: str,
+        end_date: str,
+        gateway_service: GatewayService,
+        lpu_ids: Optional[Sequence[str]] = None,
+) -> AsyncIterator[PatientServiceRow]:
+    """
+    Исходные записи отчета 32430. Если передано несколько ЛПУ, их выгрузки и разбор
+    идут параллельно, а справочники сборки (госпитализации, услуги) общие для всех ЛПУ.
+    Записи отдаются по порядку ЛПУ.
+    """
+    lpu_ids = normalize_lpu_ids(lpu_ids)
+    if len(lpu_ids) == 1:
+        records = _iter_lpu_records(start_date, end_date, gateway_service, lpu_ids[0])
+    else:
+        records = iter_concurrent(
+            [
+                lambda lpu_id=lpu_id: _iter_lpu_records(start_date, end_date, gateway_service, lpu_id)
+                for lpu_id in lpu_ids
+            ],
+            settings.REPORT_LPU_CONCURRENCY,
+        )
 
-    except Exception as e:
-        logger.error(f"[CLIENT] Ошибка парсинга или обработки: {e}", exc_info=True)
-        raise HTTPException(500, "Ошибка обработки файла")
+    async for record in records:
+        yield record
 
 
-def generate_excel_from_models(data_list: List[BaseModel]) -> io.BytesIO:
-    """
-    Генерирует Excel файл из списка Pydantic моделей.
-    Применяет форматирование дат ДД.ММ.ГГГГ.
-    """
-    output_stream = io.BytesIO()
-    work_book = Workbook()
-    sheet = work_book.active
-
-    titles = ["ФИО", "ДР", "Возраст", "Адрес", "Страховая", "Номер полиса", "Номер карты",
-              "Поступление", "Выписка", "Результат", "Койко-дни", "Отделение", "Профиль", "МКБ",
-              "Диагноз", "Врач", "", "Код услуги", "Название", "Кол-во", "Дата", "Источник оплаты"]
-    sheet.append(titles)
-
-
-    # Если список пуст, возвращаем пустой файл (или можно добавить заголовки)
-    if not data_list:
-        work_book.save(output_stream)
-        output_stream.seek(0)
-        return output_stream
-
-    # Логика заполнения
-    for row in data_list:
-        # 1. Превращаем модель в словарь и берем значения
-        row_dict = row.model_dump()
-        row_values = list(row_dict.values())
-
-        # 2. Добавляем строку
-        sheet.append(row_values)
-
-        # 3. Форматирование дат
-        current_row = sheet[sheet.max_row]
-        for cell in current_row:
-            if isinstance(cell.value, (date, datetime)):
-                cell.number_format = 'DD.MM.YYYY'
-
-    # автоширина всех колонок
-    auto_cells_width(sheet)
-
-    # задаем ширину колонок принудительно
-    set_column_width(sheet=sheet, column_letter="D", width=45)
-    set_column_width(sheet=sheet, column_letter="E", width=45)
-    set_column_width(sheet=sheet, column_letter="L", width=45)
-    set_column_width(sheet=sheet, column_letter="M", width=45)
-    set_column_width(sheet=sheet, column_letter="Q", width=45)
-    set_column_width(sheet=sheet, column_letter="S", width=45)
-
-    # выравнивание первой строки по центру
-    rows_to_align = [1]
-    align_row_center(sheet, rows_to_align)
-
-    # выравнивание колонок по центру
-    columns_to_align = ["B", "C", "H", "I", "K", "T", "U"]
-    align_column_center(sheet, columns_to_align)
-
-    # включить АВТОФИЛЬТР
-    # sheet.dimensions вернет строку вида "A1:K150"
-    sheet.auto_filter.ref = sheet.dimensions
-
-    # Сохраняем
-    work_book.save(output_stream)
-    output_stream.seek(0)
-
-    return output_stream
+def _hosp_key(record: PatientServiceRow, _: Resolved) -> Optional[Tuple[str, str, str]]:
+    if record.start_date is None or not record.card_number:
+        return None
+    # Номер карты уникален только внутри ЛПУ
+    lpu_id = record.lpu_id or settings.REPORT_32430_LPU_ID
+    return lpu_id, str(record.card_number or "").strip(), record.start_date.strftime("%d.%m.%Y")
+
+
+def _build_rows(record: PatientServiceRow, resolved: Resolved) -> List[PatientServiceRow]:
+    """Дополняет строку отчета источником оплаты услуги из ЕВМИАС."""
+    if "services" in resolved.unresolved:
+        # Срок сборки истек - строка попадает в отчет с пометкой
+        record.service_payment_source = resolved.value("services")
+        return [record]
+
+    services_index = resolved.get("services")
+    if not services_index or record.service_date is None:
+        return [record]
+
+    pay_type_id = services_index.get((record.service_code, record.service_date.strftime("%d.%m.%Y")))
+    if pay_type_id is None:
+        return [record]
+
+    pay_source_name = PAY_TYPE_MAPPER.get(pay_type_id)
+
+    if pay_source_name:
+        record.service_payment_source = pay_source_name
+    else:
+        record.service_payment_source = f"Неизвестный id типа оплаты ({pay_type_id})"
+
+    return [record]
+
+
+def _fact(row: PatientServiceRow) -> dict:
+    return {
+        "lpu_id": row.lpu_id or "",
+        "service_date": row.service_date,
+        "pay_source": row.service_payment_source,
+        "department": row.department,
+        "org_category": None,
+        "service_code": row.service_code,
+        "service_name": row.service_name,
+        "quantity": row.service_quantity or 1,
+    }
+
+
+PATIENT_SERVICES_REPORT = ReportDefinition(
+    report_id="32430",
+    title="Отчет 32430",
+    filename="report_32430",
+    row_model=PatientServiceRow,
+    source=_iter_report_records,
+    build_rows=_build_rows,
+    lookups=(
+        Lookup(
+            name="hosp_id",
+            title="Госпитализация",
+            fetch=_search_hosp_id,
+            key=_hosp_key,
+            # Госпитализации за период ищутся заранее, параллельно с выгрузкой отчета
+            prefetch=_load_bulk_hosp_index,
+            ignore_errors=True,
+        ),
+        Lookup(
+            name="services",
+            title="Источник оплаты",
+            fetch=_load_hosp_services_index,
+            key=lambda _, resolved: resolved.get("hosp_id"),
+            needs=("hosp_id",),
+            ignore_errors=True,
+        ),
+    ),
+    columns=(
+        Column("ФИО", "full_name"),
+        Column("ДР", "birthday", center=True),
+        Column("Возраст", "age", center=True),
+        Column("Адрес", "address", width=45),
+        Column("Страховая", "insurance_company", width=45),
+        Column("Номер полиса", "polis_number"),
+        Column("Номер карты", "card_number"),
+        Column("Поступление", "start_date", center=True),
+        Column("Выписка", "end_date", center=True),
+        Column("Результат", "outcome_result"),
+        Column("Койко-дни", "bed_days", center=True),
+        Column("Отделение", "department", width=45),
+        Column("Профиль", "department_profile", width=45),
+        Column("МКБ", "diag_code"),
+        Column("Диагноз", "diag_name"),
+        Column("Врач", "doctor_name"),
+        Column("", "doctor_position", width=45),
+        Column("Код услуги", "service_code"),
+        Column("Название", "service_name", width=45),
+        Column("Кол-во", "service_quantity", center=True),
+        Column("Дата", "service_date", center=True),
+        Column("Источник оплаты", "service_payment_source"),
+    ),
+    highlights=(
+        Highlight(UNRESOLVED_FILL_COLOR, lambda row: row.is_unresolved),
+    ),
+    filters={
+        "department": "department",
+        "pay_source": "service_payment_source",
+        "service_code": "service_code",
+    },
+    # Несколько ЛПУ в Excel выводятся на отдельные листы
+    sheet_group=lambda row: f"ЛПУ {row.lpu_id}",
+    facts=FactProjection(
+        project=_fact,
+        scope=lambda params: tuple(normalize_lpu_ids(params.get("lpu_ids"))),
+    ),
+    # Услуга пациента в госпитализации: остальные поля могут меняться между прогонами
+    identity=lambda row: (row.lpu_id, row.card_number, row.full_name, row.birthday, row.start_date,
+                          row.department, row.service_code, row.service_date),
+    variant=lambda params: _MULTI_LPU_REPORT if len(normalize_lpu_ids(params.get("lpu_ids"))) > 1 else None,
+)
+
+# Несколько ЛПУ: в CSV/NDJSON строки идут общим набором, поэтому добавляется колонка ЛПУ.
+# Выгрузка одного ЛПУ (по умолчанию) сохраняет прежний набор колонок
+_MULTI_LPU_REPORT = replace(
+    PATIENT_SERVICES_REPORT,
+    columns=(*PATIENT_SERVICES_REPORT.columns, Column("ЛПУ", "lpu_id")),
+    variant=None,
+)
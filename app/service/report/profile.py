@@ -0,0 +1,65 @@
+import asyncio
+import time
+from contextlib import aclosing
+
+from fastapi import HTTPException, status
+
+from app.core import get_settings, logger
+from app.core.profiling import (GatewayCallStats, SamplingProfiler, allocation_summary, gateway_call_scope,
+                                trace_allocations)
+from app.service.gateway.gateway import GatewayService
+from app.service.report.engine import iter_report_rows
+from app.service.report.registry import REPORTS
+
+settings = get_settings()
+
+# tracemalloc и профайлер действуют на весь процесс - одновременно профилируется только одна сборка
+_PROFILE_LOCK = asyncio.Lock()
+
+
+async def profile_report_build(
+        report_id: str,
+        start_date: str,
+        end_date: str,
+        gateway_service: GatewayService,
+        top: int,
+) -> dict:
+    """
+    Собирает отчет с нуля (минуя кеш наборов строк) под сэмплирующим профайлером
+    и tracemalloc. Возвращает горячие функции, статистику памяти и сводку запросов к шлюзу.
+    """
+    if report_id not in REPORTS:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Неизвестный отчет {report_id}")
+    if _PROFILE_LOCK.locked():
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Профилирование уже выполняется")
+
+    async with _PROFILE_LOCK:
+        logger.info(f"[PROFILE] Профилирование сборки отчета {report_id} за {start_date}-{end_date}")
+        profiler = SamplingProfiler(settings.PROFILE_SAMPLE_INTERVAL)
+        calls = GatewayCallStats()
+
+        with trace_allocations(), gateway_call_scope(calls):
+            started = time.perf_counter()
+            profiler.start()
+            try:
+                source = iter_report_rows(REPORTS[report_id], start_date, end_date, gateway_service)
+                async with aclosing(source) as rows_iter:
+                    rows = sum([1 async for _ in rows_iter])
+            finally:
+                profiler.stop()
+            duration = time.perf_counter() - started
+            memory = allocation_summary(top)
+
+    logger.info(f"[PROFILE] Сборка {report_id} за {start_date}-{end_date}: {rows} строк за {duration:.2f} с")
+    return {
+        "report_id": report_id,
+        "start_date": start_date,
+        "end_date": end_date,
+        "rows": rows,
+        "duration_seconds": round(duration, 3),
+        "samples": profiler.samples,
+        "sample_interval": profiler.interval,
+        "hot_functions": profiler.summary(top),
+        "memory": memory,
+        "gateway": calls.summary(),
+    }
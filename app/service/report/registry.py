@@ -0,0 +1,11 @@
+from typing import Dict
+
+from app.service.report.engine import ReportDefinition
+from app.service.report.invitro_list import INVITRO_REPORT
+from app.service.report.patient_with_service import PATIENT_SERVICES_REPORT
+
+# Все отчеты, которые умеет строить движок, по идентификатору
+REPORTS: Dict[str, ReportDefinition] = {
+    definition.report_id: definition
+    for definition in (PATIENT_SERVICES_REPORT, INVITRO_REPORT)
+}
@@ -0,0 +1,163 @@
+import asyncio
+from collections.abc import Mapping
+from datetime import datetime
+from typing import Dict, Iterator, Optional
+
+from app.core import get_settings, logger
+from app.core.cache_control import ExternalCache, register_external_cache
+from app.core.metrics import SERVICE_CATALOG_ENTRIES, SERVICE_CATALOG_LOADS
+from app.service.gateway.gateway import GatewayService
+
+settings = get_settings()
+
+# Раздел услуг ИНВИТРО в справочнике комплексных услуг ЕВМИАС
+INVITRO_USLUGA_PID = "3010101000029801"
+
+
+def normalize_service_name(name: str) -> str:
+    """Ключ каталога: регистр, ё/е и лишние пробелы в названии услуги не важны."""
+    return " ".join(name.replace("ё", "е").replace("Ё", "Е").split()).casefold()
+
+
+class CatalogIndex(Mapping):
+    """Неизменяемый снимок каталога: название услуги -> код. Поиск по нормализованному названию."""
+
+    def __init__(self, codes: Dict[str, str], loaded_at: Optional[datetime] = None):
+        self._codes = codes
+        self.loaded_at = loaded_at
+
+    def __getitem__(self, name: str) -> str:
+        return self._codes[normalize_service_name(name)]
+
+    def __contains__(self, name: object) -> bool:
+        return isinstance(name, str) and normalize_service_name(name) in self._codes
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._codes)
+
+    def __len__(self) -> int:
+        return len(self._codes)
+
+
+class ServiceCatalog:
+    """
+    Каталог кодов услуг раздела `parent_id`, загружаемый из ЕВМИАС целиком одним запросом.
+
+    Заменяет поиск кода по каждому названию отдельным запросом: сборка отчета берет
+    коды из снимка каталога, запрос по названию остается только для услуг, которых в каталоге нет.
+    Каталог обновляется в фоне раз в `refresh_interval` секунд; неудачное обновление
+    повторяется через `retry_interval`, до этого используется прежний снимок.
+    """
+
+    def __init__(self, parent_id: str, refresh_interval: float, retry_interval: float):
+        self.parent_id = parent_id
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self._index = CatalogIndex({})
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._index.loaded_at is not None
+
+    def reset(self) -> int:
+        """Сбрасывает снимок: следующая сборка (или фоновое обновление) загрузит каталог заново."""
+        entries = len(self._index)
+        self._index = CatalogIndex({})
+        return entries
+
+    def stats(self) -> dict:
+        loaded_at = self._index.loaded_at
+        return {
+            "kind": "memory",
+            "entries": len(self._index),
+            "loaded_at": loaded_at,
+            "age_seconds": round((datetime.now() - loaded_at).total_seconds(), 1) if loaded_at else None,
+        }
+
+    async def load(self, gateway_service: GatewayService) -> CatalogIndex:
+        """Загружает каталог целиком и подменяет снимок."""
+        payload = {
+            "params": {
+                "c": "UslugaComplex",
+                "m": "loadUslugaContentsGrid"
+            },
+            "data": {
+                "object": "UslugaComplex",
+                "UslugaComplex_pid": self.parent_id,
+                "contents": 2
+            }
+        }
+        logger.info(f"Загрузка каталога услуг раздела {self.parent_id}")
+
+        codes: Dict[str, str] = {}
+        try:
+            async for item in gateway_service.stream_list(array_key=None, json=payload):
+                name, code = item.get("UslugaComplex_Name"), item.get("UslugaComplex_Code")
+                if name and code:
+                    # При повторах названия берем первый код - как и запрос по названию
+                    codes.setdefault(normalize_service_name(name), code)
+        except Exception:
+            SERVICE_CATALOG_LOADS.labels(result="error").inc()
+            raise
+
+        self._index = CatalogIndex(codes, datetime.now())
+        SERVICE_CATALOG_LOADS.labels(result="ok").inc()
+        SERVICE_CATALOG_ENTRIES.set(len(codes))
+        logger.info(f"Каталог услуг раздела {self.parent_id} загружен: {len(codes)} услуг")
+        return self._index
+
+    async def get_index(self, gateway_service: GatewayService) -> CatalogIndex:
+        """
+        Снимок каталога для сборки отчета. Если каталог еще ни разу не загружался
+        (фоновое обновление выключено или не успело), загружает его сейчас - один раз на все сборки.
+        """
+        if self.loaded:
+            return self._index
+        async with self._lock:
+            if self.loaded:
+                return self._index
+            return await self.load(gateway_service)
+
+    def start(self, gateway_service: GatewayService):
+        if self.refresh_interval <= 0:
+            logger.info("Фоновое обновление каталога услуг отключено")
+            return
+        self._task = asyncio.create_task(self._refresh(gateway_service))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _refresh(self, gateway_service: GatewayService):
+        # Каталог, предзагруженный в мастере gunicorn, сразу не перезагружаем
+        delay = self.refresh_interval if self.loaded else 0
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                async with self._lock:
+                    await self.load(gateway_service)
+                delay = self.refresh_interval
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Не удалось обновить каталог услуг раздела {self.parent_id}: {e}")
+                delay = self.retry_interval
+
+
+SERVICE_CATALOG = ServiceCatalog(
+    parent_id=INVITRO_USLUGA_PID,
+    refresh_interval=settings.SERVICE_CATALOG_REFRESH,
+    retry_interval=settings.SERVICE_CATALOG_RETRY,
+)
+
+register_external_cache("service_catalog", ExternalCache(
+    stats=SERVICE_CATALOG.stats,
+    # Каталог не относится к отчету или периоду - сбрасывается только по имени или полной очисткой
+    invalidate=lambda rule: SERVICE_CATALOG.reset() if rule.is_total or rule.caches else 0,
+))
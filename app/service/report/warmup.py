@@ -0,0 +1,70 @@
+import asyncio
+from typing import Dict, Sequence, Set
+
+from fastapi import HTTPException
+
+from app.core import logger
+from app.core.admission import AdmissionController
+from app.service.gateway.gateway import GatewayService
+from app.service.report.cost import BUILD_COSTS
+from app.service.report.dataset import get_dataset, render_dataset
+from app.service.report.service_catalog import SERVICE_CATALOG
+from app.service.tool.export import ReportFormat
+
+# Фоновые прогревы (ссылки нужны, чтобы задачи не собрал сборщик мусора)
+_WARMUPS: Set[asyncio.Task] = set()
+
+
+async def _warm_report(
+        report_id: str,
+        start_date: str,
+        end_date: str,
+        gateway_service: GatewayService,
+        admission: AdmissionController,
+) -> str:
+    async def build():
+        dataset = await get_dataset(report_id, start_date, end_date, gateway_service)
+        return await render_dataset(dataset), len(dataset.unresolved)
+
+    # Ключ совпадает с ключом выгрузки xlsx: пользовательский запрос того же отчета
+    # присоединится к прогреву, а не запустит вторую сборку
+    try:
+        cost = BUILD_COSTS.estimate(report_id, start_date, end_date).cost
+        await admission.run((report_id, start_date, end_date, ReportFormat.XLSX.value, None, ()), build, cost=cost)
+    except HTTPException as e:
+        # Очередь сборок заполнена - прогрев не вытесняет пользовательские запросы
+        return f"skipped: {e.detail}"
+    return "ok"
+
+
+async def warm_up(
+        report_ids: Sequence[str],
+        start_date: str,
+        end_date: str,
+        gateway_service: GatewayService,
+        admission: AdmissionController,
+        catalog: bool,
+) -> Dict[str, str]:
+    """Загружает каталог услуг и строит отчеты за период, наполняя кеш строк и хранилище файлов."""
+    results: Dict[str, str] = {}
+    if catalog:
+        try:
+            await SERVICE_CATALOG.load(gateway_service)
+            results["service_catalog"] = "ok"
+        except Exception as e:
+            results["service_catalog"] = f"error: {e}"
+
+    for report_id in report_ids:
+        try:
+            results[report_id] = await _warm_report(report_id, start_date, end_date, gateway_service, admission)
+        except Exception as e:
+            results[report_id] = f"error: {e}"
+    logger.info(f"[CACHE] Прогрев за {start_date}-{end_date} завершен: {results}")
+    return results
+
+
+def schedule_warm_up(*args, **kwargs):
+    """Запускает прогрев в фоне: ответ администратору не ждет построения отчетов."""
+    task = asyncio.create_task(warm_up(*args, **kwargs))
+    _WARMUPS.add(task)
+    task.add_done_callback(_WARMUPS.discard)
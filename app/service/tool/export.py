@@ -0,0 +1,98 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+from enum import Enum
+from typing import Any, AsyncIterator, Callable, Iterable, List
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+# Excel в русской локали ожидает ";" в качестве разделителя
+CSV_DELIMITER = ";"
+# Сколько строк копим перед отправкой очередного куска клиенту
+STREAM_BATCH_SIZE = 100
+# Последняя строка CSV, если выгрузка прервалась после отправки заголовков
+CSV_ERROR_MARK = "#ОШИБКА: выгрузка неполная"
+
+
+class ReportFormat(str, Enum):
+    XLSX = "xlsx"
+    CSV = "csv"
+    NDJSON = "ndjson"
+
+
+MEDIA_TYPES = {
+    ReportFormat.XLSX: "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ReportFormat.CSV: "text/csv; charset=utf-8",
+    ReportFormat.NDJSON: "application/x-ndjson; charset=utf-8",
+}
+
+
+def _csv_value(value: Any) -> Any:
+    if isinstance(value, (date, datetime)):
+        return value.strftime("%d.%m.%Y")
+    return "" if value is None else value
+
+
+def stream_error_message(error: BaseException) -> str:
+    if isinstance(error, HTTPException):
+        return str(error.detail)
+    return str(error) or type(error).__name__
+
+
+def _csv_line(values: Iterable[Any]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer, delimiter=CSV_DELIMITER, lineterminator="\r\n").writerow(
+        [_csv_value(value) for value in values]
+    )
+    return buffer.getvalue().encode("utf-8")
+
+
+async def stream_csv(
+        titles: List[str],
+        rows: AsyncIterator[BaseModel],
+        values: Callable[[BaseModel], Iterable[Any]] = lambda row: row.model_dump().values(),
+) -> AsyncIterator[bytes]:
+    """
+    Отдает строки отчета в CSV по мере их получения.
+    Файл начинается с BOM, чтобы Excel корректно открыл кириллицу.
+    `values` - значения колонок строки (по умолчанию все поля модели по порядку).
+    Статус ответа к этому моменту уже отправлен, поэтому ошибка получения строк
+    отмечается последней строкой файла (CSV_ERROR_MARK и текст ошибки).
+    """
+    yield "\ufeff".encode("utf-8") + _csv_line(titles)
+
+    batch = []
+    try:
+        async for row in rows:
+            batch.append(_csv_line(values(row)))
+            if len(batch) >= STREAM_BATCH_SIZE:
+                yield b"".join(batch)
+                batch.clear()
+    except Exception as e:
+        batch.append(_csv_line([CSV_ERROR_MARK, stream_error_message(e)]))
+
+    if batch:
+        yield b"".join(batch)
+
+
+async def stream_ndjson(rows: AsyncIterator[BaseModel]) -> AsyncIterator[bytes]:
+    """
+    Отдает строки отчета в NDJSON (один JSON-объект на строку, даты в ISO).
+    Ошибка получения строк после отправки статуса отмечается последней строкой {"error": ...}.
+    """
+    batch = []
+    try:
+        async for row in rows:
+            line = json.dumps(row.model_dump(mode="json"), ensure_ascii=False) + "\n"
+            batch.append(line.encode("utf-8"))
+            if len(batch) >= STREAM_BATCH_SIZE:
+                yield b"".join(batch)
+                batch.clear()
+    except Exception as e:
+        line = json.dumps({"error": stream_error_message(e)}, ensure_ascii=False) + "\n"
+        batch.append(line.encode("utf-8"))
+
+    if batch:
+        yield b"".join(batch)
@@ -0,0 +1,133 @@
+import asyncio
+from contextlib import aclosing
+from datetime import date, datetime, timedelta
+from typing import AsyncIterator, Callable, Hashable, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+DATE_FORMAT = "%d.%m.%Y"
+
+
+def parse_date(value: str) -> date:
+    return datetime.strptime(value, DATE_FORMAT).date()
+
+
+def format_date(value: date) -> str:
+    return value.strftime(DATE_FORMAT)
+
+
+def split_date_range(start_date: str, end_date: str, shard_days: int) -> List[Tuple[str, str]]:
+    """
+    Делит период 'ДД.ММ.ГГГГ'-'ДД.ММ.ГГГГ' на подпериоды не длиннее shard_days дней.
+    Подпериоды идут по порядку и не пересекаются.
+    """
+    start, end = parse_date(start_date), parse_date(end_date)
+    if start > end:
+        raise ValueError(f"Дата начала {start_date} позже даты окончания {end_date}")
+    if shard_days < 1:
+        return [(start_date, end_date)]
+
+    shards = []
+    shard_start = start
+    while shard_start <= end:
+        shard_end = min(shard_start + timedelta(days=shard_days - 1), end)
+        shards.append((format_date(shard_start), format_date(shard_end)))
+        shard_start = shard_end + timedelta(days=1)
+
+    return shards
+
+
+class _SourceFailed:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+async def iter_concurrent(
+        sources: List[Callable[[], AsyncIterator[T]]],
+        concurrency: int,
+        prefetch: int = 500,
+) -> AsyncIterator[T]:
+    """
+    Отдает элементы нескольких источников, загружая их параллельно.
+
+    Не больше `concurrency` источников читаются одновременно. Элементы отдаются
+    в порядке источников: первый отдается по мере получения, остальные тем временем
+    загружаются в фоне с опережением не более чем на `prefetch` элементов каждый.
+    Ошибка любого источника пробрасывается потребителю.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    queues: List[asyncio.Queue] = [asyncio.Queue(maxsize=prefetch) for _ in sources]
+    done = object()
+
+    async def load(source: Callable[[], AsyncIterator[T]], queue: asyncio.Queue):
+        async with semaphore:
+            try:
+                # Заполненная очередь приостанавливает источник, пока потребитель до него не дойдет.
+                # Слоты семафора выдаются по порядку источников, поэтому текущий источник
+                # потребителя всегда уже читается или прочитан - взаимной блокировки нет
+                async for item in source():
+                    await queue.put(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await queue.put(_SourceFailed(e))
+                return
+            await queue.put(done)
+
+    tasks = [asyncio.create_task(load(source, queue)) for source, queue in zip(sources, queues)]
+    try:
+        for queue in queues:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, _SourceFailed):
+                    raise item.error
+                yield item
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def iter_sharded(
+        start_date: str,
+        end_date: str,
+        source: Callable[[str, str], AsyncIterator[T]],
+        shard_days: int,
+        concurrency: int,
+        key: Optional[Callable[[T], Optional[Hashable]]] = None,
+) -> AsyncIterator[T]:
+    """
+    Отдает элементы source за весь период, запрашивая его по подпериодам параллельно.
+
+    Не больше `concurrency` подпериодов загружаются одновременно. Элементы отдаются
+    в порядке подпериодов: первый отдается по мере получения, остальные тем временем
+    загружаются в фоне. Если задан `key`, элементы с уже встречавшимся ключом пропускаются.
+    """
+    shards = split_date_range(start_date, end_date, shard_days)
+    seen = set()
+
+    def is_duplicate(item: T) -> bool:
+        if key is None:
+            return False
+        item_key = key(item)
+        if item_key is None:
+            return False
+        if item_key in seen:
+            return True
+        seen.add(item_key)
+        return False
+
+    if len(shards) == 1:
+        items = source(start_date, end_date)
+    else:
+        items = iter_concurrent(
+            [lambda shard=shard: source(*shard) for shard in shards],
+            concurrency,
+        )
+
+    async with aclosing(items) as items_iter:
+        async for item in items_iter:
+            if not is_duplicate(item):
+                yield item
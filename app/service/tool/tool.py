@@ -1,12 +1,25 @@
-import httpx
-from openpyxl.utils import get_column_letter
-from openpyxl.worksheet.worksheet import Worksheet
-from openpyxl.styles import Alignment
+from __future__ import annotations
 
-CENTER_ALIGNED = Alignment(horizontal='center', vertical='center')
+from functools import lru_cache
+from typing import TYPE_CHECKING, List
+
+# openpyxl импортируется при первом построении книги, а не при старте воркера
+if TYPE_CHECKING:
+    from openpyxl import Workbook
+    from openpyxl.styles import Alignment
+    from openpyxl.worksheet.worksheet import Worksheet
+
+
+@lru_cache(maxsize=1)
+def center_aligned() -> Alignment:
+    from openpyxl.styles import Alignment
+
+    return Alignment(horizontal='center', vertical='center')
 
 
 def auto_cells_width(sheet: Worksheet):
+    from openpyxl.utils import get_column_letter
+
     for col in sheet.columns:
         max_length = 0
         col_letter = get_column_letter(col[0].column)
@@ -23,10 +36,24 @@ def set_column_width(sheet: Worksheet, column_letter: str, width: int):
 def align_row_center(sheet: Worksheet, rows: list):
     for row_to_align in rows:
         for cell in sheet[row_to_align]:
-            cell.alignment = CENTER_ALIGNED
+            cell.alignment = center_aligned()
 
 
 def align_column_center(sheet: Worksheet, columns: list):
     for column_to_align in columns:
         for cell in sheet[column_to_align]:
-            cell.alignment = CENTER_ALIGNED
\ No newline at end of file
+            cell.alignment = center_aligned()
+
+
+# Цвет строк, часть сведений которых не успели получить до срока сборки
+UNRESOLVED_FILL_COLOR = "FFF2CC"
+
+
+def add_unresolved_sheet(book: Workbook, unresolved: List[dict]):
+    """Добавляет лист со сводкой данных, которые не успели получить до срока сборки."""
+    sheet = book.create_sheet("Не получено")
+    sheet.append(["Что не получено", "Ключ"])
+    for entry in unresolved:
+        sheet.append([entry.get("lookup"), entry.get("key")])
+    auto_cells_width(sheet)
+    align_row_center(sheet, [1])